@@ -15,6 +15,7 @@ import pandas as pd
 from struct import unpack
 from threading import Thread
 import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from numpy import (
     uint8,
     uint32,
@@ -40,12 +41,13 @@ dr = os.path.dirname(os.path.abspath(__file__))
 from Control_Logic.RF_Synthesizer_Control import SynthControl
 from Control_Logic.DAQ_Setup import SetupROACH
 from Control_Logic.Frequency_Domain_DAQ_Control import DAQ_SpecWriter
-from Control_Logic.Frequency_Domain_Packet import FDpacket
+from Control_Logic.Frequency_Domain_Packet import FDpacket, FDpacketView
 from Control_Logic.Trap_Control import TrapControl
 from Control_Logic.Env_Parameters import EnvParams
 from Control_Logic.Spec_Packet_Report import packet_report, delete_files, delete_run_ids
 import Control_Logic.PostgreSQL_Interface as he6db
 import Control_Logic.Data_Quality_Control as DQC
+import Control_Logic.Spec_Summary as Spec_Summary
 
 from telnetlib import Telnet
 from time import sleep
@@ -90,6 +92,7 @@ class LiveDAQ:
             roach_avg, analog_inputs, freq_ch, roach_nyquist, requant_gain
         )
         self.setup = False
+        self.spec_writer = None
 
         if self.freq_ch == 4096:
             self.BUFFERSIZE = 4128
@@ -131,6 +134,9 @@ class LiveDAQ:
         write_to_db=True,
         no_report=False,
         delete_imperfect_files=True,
+        use_udprx=True,
+        verify=False,
+        write_summaries=False,
     ):
         """
         Takes packets off of the high-rate data interface used to transmit power
@@ -143,11 +149,30 @@ class LiveDAQ:
         time (int): The length of the datastream written to each .spec file, in milliseconds
         isotope (str): Put either '19Ne', '6He', or '83Kr'.
         rf_side (bool): 0 = U side, 1 = I side.
+        no_report (bool): Skip the packet report. Only for the udprx path;
+            the in-process receiver always takes gap statistics during
+            capture, so combining this with use_udprx=False is an error.
+        use_udprx (bool): Receive with the udprx executable and reread every
+            file for the packet report. Default True. False receives
+            in-process with DAQ_SpecWriter, which tracks gaps during capture
+            and drains the socket before each capture.
+        verify (bool): With the in-process receiver, also reread every file
+            with packet_report and print any file whose dropped-packet count
+            disagrees with the capture-time one.
+        write_summaries (bool): After the run, write a summary sidecar
+            (noise floor, packet index, gap report) and a spectrogram
+            pyramid next to each kept file, for the viewers. See
+            Spec_Summary and Spec_Pyramid.
         """
         if not self.setup:
             raise ValueError(
                 "Must set up roach by calling CLI.roach_setup() before taking FD data."
             )
+        if no_report and not use_udprx:
+            raise ValueError(
+                "no_report only applies to use_udprx=True; the in-process "
+                "receiver always reports gaps."
+            )
 
         time_per_slice_ms = 1000 * self.roach_avg * self.freq_ch / self.roach_nyquist
 
@@ -173,60 +198,67 @@ class LiveDAQ:
         total_spec_file_list = []
         chunk_size = acq_size
         acquired = 0
-        while acquired < acq_size:
-
-            # Take data in chuncks of 10 files.
-            udprx_out = []
-            for i in range(chunk_size):
-                print("\nReceiver active for file_in_acq: {}".format(acquired + i))
-
-                process = subprocess.run(
-                    [
-                        "./UDP_receiver/build/udprx",
-                        "{}".format(self.BUFFERSIZE),
-                        "{}".format(packets_per_acq),
-                        "{}".format(i % 3),
-                    ],
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.STDOUT,
-                )
-                udprx_out.append(process.stdout.decode("utf-8"))
-                print("udprx_out: ", process.stdout.decode("utf-8"))  # Print file path.
-                if process.stderr is not None:
-                    # Print errors.
-                    print("udprx errors: ", process.stderr.decode("utf-8"))
-
-            spec_file_list = he6db.format_udprx_output(udprx_out)
-
-            # Construct packet report and add to he6cres_db
-            spec_file_list = packet_report(
-                spec_file_list, self.BUFFERSIZE, no_report, delete_imperfect_files
+        # One pool for every chunk's packet report. Its workers start with
+        # the first report and are reused by the ones after.
+        with ProcessPoolExecutor(
+            max_workers=len(DAQ_SpecWriter.OUT_DIRS)
+        ) as report_pool:
+            while acquired < acq_size:
+
+                if use_udprx:
+                    spec_file_list = self.udprx_capture(
+                        acquired,
+                        chunk_size,
+                        packets_per_acq,
+                        no_report,
+                        delete_imperfect_files,
+                        report_pool,
+                    )
+                else:
+                    if self.spec_writer is None:
+                        self.spec_writer = DAQ_SpecWriter(dsoc_desc=self.socket)
+                    print("\nReceiver active for files_in_acq: {}-{}".format(
+                        acquired, acquired + chunk_size - 1))
+                    # capture_files drains the socket first, so packets queued
+                    # during params.get() or between chunks are not written.
+                    self.spec_writer.capture_files(
+                        chunk_size, packets_per_acq, bytes_in_packet=self.BUFFERSIZE
+                    )
+                    spec_file_list = self.spec_writer.spec_file_list
+                    if verify:
+                        self.verify_packet_report(spec_file_list, report_pool)
+
+                if delete_imperfect_files:
+
+                    # Collect files to be deleted:
+                    files_to_delete = [
+                        spec_dict["file_path"]
+                        for spec_dict in spec_file_list
+                        if spec_dict["num_dropped_packets"] > 0
+                    ]
+
+                    # Delete those files:
+                    delete_files(files_to_delete)
+                    acquired+= chunk_size - len(files_to_delete)
+                    chunk_size = acq_size - acquired
+
+                    # Keep only the perfect files in the spec_file_list
+                    spec_file_list = [spec_dict for spec_dict in spec_file_list
+                        if spec_dict["num_dropped_packets"] == 0 
+                    ]
+
+                else: 
+                    acquired += chunk_size
+
+                total_spec_file_list += spec_file_list
+
+        if write_summaries:
+            Spec_Summary.write_summaries(
+                [spec_dict["file_path"] for spec_dict in total_spec_file_list],
+                self.freq_ch,
+                pyramids=True,
             )
 
-            if delete_imperfect_files:
-
-                # Collect files to be deleted:
-                files_to_delete = [
-                    spec_dict["file_path"]
-                    for spec_dict in spec_file_list
-                    if spec_dict["num_dropped_packets"] > 0
-                ]
-
-                # Delete those files:
-                delete_files(files_to_delete)
-                acquired+= chunk_size - len(files_to_delete)
-                chunk_size = acq_size - acquired
-
-                # Keep only the perfect files in the spec_file_list
-                spec_file_list = [spec_dict for spec_dict in spec_file_list
-                    if spec_dict["num_dropped_packets"] == 0 
-                ]
-
-            else: 
-                acquired += chunk_size
-
-            total_spec_file_list += spec_file_list
-
         if write_to_db:
             # Fill the he6cres_db tables with this info.
             he6db.fill_he6cres_db(env_parameters, total_spec_file_list)
@@ -234,6 +266,82 @@ class LiveDAQ:
 
         return None
 
+    def udprx_capture(
+        self,
+        acquired,
+        chunk_size,
+        packets_per_acq,
+        no_report,
+        delete_imperfect_files,
+        report_pool=None,
+    ):
+        """
+        Write chunk_size files with the udprx executable, then reread each
+        one to build its packet report (in report_pool, if given).
+        """
+        udprx_out = []
+        for i in range(chunk_size):
+            print("\nReceiver active for file_in_acq: {}".format(acquired + i))
+
+            process = subprocess.run(
+                [
+                    "./UDP_receiver/build/udprx",
+                    "{}".format(self.BUFFERSIZE),
+                    "{}".format(packets_per_acq),
+                    "{}".format(i % 3),
+                ],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+            )
+            udprx_out.append(process.stdout.decode("utf-8"))
+            print("udprx_out: ", process.stdout.decode("utf-8"))  # Print file path.
+            if process.stderr is not None:
+                # Print errors.
+                print("udprx errors: ", process.stderr.decode("utf-8"))
+
+        spec_file_list = he6db.format_udprx_output(udprx_out)
+
+        # Construct packet report and add to he6cres_db
+        return packet_report(
+            spec_file_list,
+            self.BUFFERSIZE,
+            no_report,
+            delete_imperfect_files,
+            pool=report_pool,
+        )
+
+    def verify_packet_report(self, spec_file_list, report_pool=None):
+        """
+        Reread the files in spec_file_list with packet_report (in
+        report_pool, if given) and compare the dropped-packet counts to the
+        ones taken during capture. Returns the number of files that
+        disagree.
+        """
+        reread = packet_report(
+            [
+                {"file_path": spec_dict["file_path"]}
+                for spec_dict in spec_file_list
+            ],
+            self.BUFFERSIZE,
+            False,
+            False,
+            pool=report_pool,
+        )
+        mismatched = 0
+        for spec_dict, reread_dict in zip(spec_file_list, reread):
+            if spec_dict["num_dropped_packets"] != reread_dict["num_dropped_packets"]:
+                mismatched += 1
+                print(
+                    "\nverify: {} dropped {} packets during capture, {} on reread.".format(
+                        spec_dict["file_path"],
+                        spec_dict["num_dropped_packets"],
+                        reread_dict["num_dropped_packets"],
+                    )
+                )
+        print("\nverify: {} of {} files disagree.".format(mismatched, len(reread)))
+
+        return mismatched
+
     def db_query(self, query: str) -> typing.Union[None, pd.DataFrame]:
         """document"""
         query_result = he6cres_db_query(query)
@@ -453,19 +561,27 @@ class LiveDAQ:
         print(f"Peak val = {peak_val_avg:4.1f} +/- {peak_val_err:4.2f}")
         print(f"Peak Bin = {peak_bin_avg:5.1f} +/- {peak_bin_err:4.2f}\n")
 
-    def check_packet_continuity(self, input_file, packets):
+    def check_packet_continuity(self, input_file, packets, chunk_packets=4096):
         gaps = -1
         data_gaps = []
+        n = 0
+        # Reuse one read buffer and inspect it through FDpacketViews so no
+        # per-packet copy of the payload is made.
+        chunk = bytearray(chunk_packets * FDpacket.BYTES_IN_PACKET)
         with open(input_file, "rb") as infile:
-            for n in range(packets):
-                bytestr = infile.read(FDpacket.BYTES_IN_PACKET)
-                packet = FDpacket.from_byte_string(bytestr)
-                if n == 0:
-                    prevPktNum = packet.pkt_in_batch - 1
-                if packet.pkt_in_batch - prevPktNum != 1:
-                    gaps += 1
-                    data_gaps.append(n)
-                prevPktNum = packet.pkt_in_batch
+            while n < packets:
+                to_read = min(chunk_packets, packets - n) * FDpacket.BYTES_IN_PACKET
+                n_bytes = infile.readinto(memoryview(chunk)[:to_read])
+                if n_bytes < FDpacket.BYTES_IN_PACKET:
+                    break
+                for packet in FDpacketView.iter_buffer(memoryview(chunk)[:n_bytes]):
+                    if n == 0:
+                        prevPktNum = packet.pkt_in_batch - 1
+                    if packet.pkt_in_batch - prevPktNum != 1:
+                        gaps += 1
+                        data_gaps.append(n)
+                    prevPktNum = packet.pkt_in_batch
+                    n += 1
             print(f"Number of packet gaps = {gaps}")
             print(data_gaps)
 
@@ -473,7 +589,7 @@ class LiveDAQ:
         with open(input_file, "rb") as infile:
             for n in range(packets):
                 bytestr = infile.read(FDpacket.BYTES_IN_PACKET)
-                packet = FDpacket.from_byte_string(bytestr)
+                packet = FDpacketView(bytestr)
                 print(packet.pkt_in_batch)
 
     def list_packet_number_bits(self, input_file, packets):
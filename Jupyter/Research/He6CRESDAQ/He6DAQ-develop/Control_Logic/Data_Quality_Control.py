@@ -12,6 +12,10 @@ import urllib.request
 
 # Local modules.
 from .PostgreSQL_Interface import he6cres_db_query
+from .Spec_File import SpecFile, load_summary
+from .Spec_Stats import parallel_spec_stats
+from .Spec_Summary import write_summaries
+from .Spec_Pyramid import open_pyramid, spec_snr
 
 # Note on this working with X11 forwarding (using these functions via ssh): 
 # You need to have the following in the daq .bashrc to enable X11 forwarding by sudo: 
@@ -42,52 +46,36 @@ def get_spec_file_info(run_id, file_in_acq=0):
 
 def spec_to_array(spec_path, freq_ch, slices=-1, start_packet=0):
     """
-    TODO: Document.
+    Read the first `slices` spectra of a .spec file into a (freq_ch, slices)
+    array. slices = -1 reads the whole file. The file is memory-mapped, so
+    only the requested slices are ever read from disk.
     This function should work for both 2^12 and 2^15 bitcodes.
-    """
-    if freq_ch == 4096:
-
-        BYTES_IN_PAYLOAD = freq_ch
-        BYTES_IN_HEADER = 32
-        BYTES_IN_PACKET = BYTES_IN_PAYLOAD + BYTES_IN_HEADER
 
-    elif freq_ch == 32768:
-        packets_per_slice = 4
-        BYTES_IN_PAYLOAD = freq_ch // packets_per_slice
-        BYTES_IN_HEADER = 32
-        BYTES_IN_PACKET = BYTES_IN_PAYLOAD + BYTES_IN_HEADER
-        slices = slices * packets_per_slice
-
-    else:
+    For 2^15 the four packets of each slice are put in order using the
+    chunk index in their headers, so there is no need to find the right
+    start_packet by eye any more; slices missing a packet are skipped.
+    start_packet is now only the packet to start reading from.
+    """
+    if freq_ch not in SpecFile.BYTES_IN_PACKET:
         raise ValueError("Function currently only works for freq_ch = 4096 or 32768.")
 
-    # def read_spec(spec_path, slices = -1):
-    if slices == -1:
-        spec_array = np.fromfile(spec_path, dtype="uint8", count=-1).reshape(
-            (-1, BYTES_IN_PACKET)
-        )[:, BYTES_IN_HEADER:]
-    else:
-        spec_array = np.fromfile(
-            spec_path, dtype="uint8", count=BYTES_IN_PACKET * slices
-        ).reshape((-1, BYTES_IN_PACKET))[:, BYTES_IN_HEADER:]
-
-    if freq_ch == 32768:
-
-        packets_per_slice = 4
-
-        spec_flat_list = [
-            spec_array[(start_packet + i) % packets_per_slice :: packets_per_slice]
-            for i in range(packets_per_slice)
-        ]
-        spec_flat = np.concatenate(spec_flat_list, axis=1)
-        spec_array = spec_flat
+    spec_file = SpecFile(spec_path, freq_ch)
+    # A fresh copy out of the read-only mapping; callers threshold the
+    # returned array in place.
+    spec_array = spec_file.spectra(start_packet, slices)
 
     return spec_array.T
 
 
-def show_sparse_spec(spec_array, snr_cut=5):
+def show_sparse_spec(spec_array, snr_cut=5, noise_floor=None):
+    """
+    Plot the pixels of spec_array over snr_cut times the noise floor:
+    per-bin, the mean over slices of spec_array unless given.
+    """
+    if noise_floor is None:
+        noise_floor = spec_array.mean(axis=1)
     cut_condition = np.array(
-        (spec_array > np.expand_dims(spec_array.mean(axis=1), axis=1) * snr_cut), dtype=int
+        (spec_array > np.expand_dims(noise_floor, axis=1) * snr_cut), dtype=int
     )
 
     fig, ax = plt.subplots(figsize=(12, 8))
@@ -109,11 +97,90 @@ def show_sparse_spec(spec_array, snr_cut=5):
     return None
 
 
-def show_noise_floor(spec_array):
+class SparseSpectrogram:
+    """
+    A spectrogram with every pixel under snr_cut times its bin's noise
+    floor set to 0, that can be re-thresholded without rereading or
+    renormalising the data (e.g. from a GUI slider).
+
+    The SNR of every pixel is taken once, as float32 (or given, e.g. the
+    max-pooled SNR of a pyramid level). On the first change of snr_cut the
+    pixels are bucketed by SNR in SNR_BUCKETS_PER_UNIT steps with a
+    counting sort, after which a new cut only rechecks the pixels in the
+    buckets between the old and new cut: O(pixels that change) per move.
+    """
+
+    SNR_BUCKETS_PER_UNIT = 16
+
+    def __init__(self, spec_array, noise_floor=None, snr_cut=5, snr=None):
+        """
+        ----------Parameters----------
+        spec_array (ndarray): (freq bins, slices) spectrogram, as from
+            spec_to_array. It is not modified.
+        noise_floor (ndarray): Per-bin noise floor. Default is the mean of
+            spec_array over slices, as in show_sparse_spec.
+        snr_cut (float): Initial cut.
+        snr (ndarray): SNR of each pixel, same shape as spec_array, used
+            instead of spec_array / noise_floor (e.g. SpecPyramid's "snr").
+        """
+        self.spec_array = np.ascontiguousarray(spec_array)
+        if snr is None:
+            if noise_floor is None:
+                noise_floor = spec_array.mean(axis=1)
+            snr = spec_snr(self.spec_array.T, noise_floor).T
+        self.snr = np.ascontiguousarray(snr, dtype=np.float32)
+
+        self.snr_cut = snr_cut
+        self.image = np.where(self.snr >= snr_cut, self.spec_array, 0).astype(
+            self.spec_array.dtype
+        )
+        self._order = None
+        self._bucket_starts = None
+
+    def _bucket(self, snr_cut):
+        return int(min(max(snr_cut, 0) * self.SNR_BUCKETS_PER_UNIT, 2**16 - 1))
+
+    def set_cut(self, snr_cut):
+        """
+        Re-threshold at snr_cut.
+
+        ------------Returns------------
+        image (ndarray): The thresholded spectrogram (updated in place).
+        """
+        snr = self.snr.reshape(-1)
+        if self._order is None:
+            buckets = np.minimum(
+                snr * self.SNR_BUCKETS_PER_UNIT, 2**16 - 1
+            ).astype(np.uint16)
+            # A stable sort of uint16 is a radix sort: O(pixels).
+            self._order = np.argsort(buckets, kind="stable").astype(np.int32)
+            self._bucket_starts = np.concatenate(
+                ([0], np.cumsum(np.bincount(buckets, minlength=2**16)))
+            )
+
+        # Only pixels in the buckets from the lower to the higher cut can
+        # change; those are rechecked against the exact cut.
+        low, high = sorted((self._bucket(self.snr_cut), self._bucket(snr_cut)))
+        changed = self._order[self._bucket_starts[low] : self._bucket_starts[high + 1]]
+        self.image.reshape(-1)[changed] = np.where(
+            snr[changed] >= snr_cut, self.spec_array.reshape(-1)[changed], 0
+        )
+        self.snr_cut = snr_cut
+
+        return self.image
+
+
+def show_noise_floor(spec_array=None, noise_floor=None):
+    """
+    Plot the mean over slices of spec_array, or an already computed
+    noise_floor (e.g. the mean from a summary sidecar).
+    """
+    if noise_floor is None:
+        noise_floor = spec_array.mean(axis=1)
 
     fig, ax = plt.subplots(figsize=(12, 8))
 
-    ax.plot(spec_array.mean(axis=1))
+    ax.plot(noise_floor)
 
     ax.set_title("mean noise floor")
     ax.set_xlabel("freq bin")
@@ -124,6 +191,57 @@ def show_noise_floor(spec_array):
     return None
 
 
+def get_run_spec_files(run_id):
+    """All spec file paths of a run, in file order, and its freq_ch."""
+
+    query = """SELECT file_path, freq_ch FROM he6cres_runs.spec_files
+               INNER JOIN he6cres_runs.run_log
+               ON spec_files.run_id = run_log.run_id
+               WHERE spec_files.run_id = {}
+               AND NOT spec_files.deleted
+               ORDER BY spec_files.file_in_acq
+           """.format(
+        run_id
+    )
+
+    results = he6cres_db_query(query)
+
+    return results.file_path.to_list(), int(results.freq_ch[0])
+
+
+def look_at_run_noise_floor(run_id, workers_per_disk=1, percentiles=(5, 50, 95)):
+    """
+    Plot the noise floor over every slice of every file in a run: the
+    per-bin mean with its +/- 1 std band and the given percentiles. The
+    files are streamed through Spec_Stats in bounded memory, one process
+    per disk (or workers_per_disk per disk).
+
+    ------------Returns------------
+    stats (SpecStats): The per-bin statistics, for further use.
+    """
+    spec_paths, freq_ch = get_run_spec_files(run_id)
+    stats, _ = parallel_spec_stats(spec_paths, freq_ch, workers_per_disk)
+
+    fig, ax = plt.subplots(figsize=(12, 8))
+
+    bins = np.arange(freq_ch)
+    ax.plot(bins, stats.mean, label="mean")
+    ax.fill_between(
+        bins, stats.mean - stats.std, stats.mean + stats.std, alpha=0.3, label="+/- 1 std"
+    )
+    for q, values in zip(percentiles, stats.percentiles(list(percentiles))):
+        ax.plot(bins, values, lw=0.5, label="{}th percentile".format(q))
+
+    ax.set_title("noise floor, run_id {} ({} slices)".format(run_id, stats.n))
+    ax.set_xlabel("freq bin")
+    ax.set_ylabel("arb. roach units")
+    ax.legend()
+
+    plt.show()
+
+    return stats
+
+
 def look_at_spec_file(
     run_id,
     file_in_acq=0,
@@ -135,13 +253,53 @@ def look_at_spec_file(
 ):
 
     spec_path, freq_ch = get_spec_file_info(run_id, file_in_acq)
-    spec_array = spec_to_array(
-        spec_path, freq_ch, slices=slices, start_packet=start_packet
-    )
+
+    # Use the summary sidecar's noise floor (over the whole file) if there
+    # is one, and only read the raw file for the sparse spectrogram.
+    summary = load_summary(spec_path)
+    spec_array = None
+    if sparse_spec or summary is None:
+        spec_array = spec_to_array(
+            spec_path, freq_ch, slices=slices, start_packet=start_packet
+        )
 
     if sparse_spec:
         show_sparse_spec(spec_array, snr_cut=snr_cut)
     if noise_floor:
-        show_noise_floor(spec_array)
+        if summary is not None:
+            show_noise_floor(noise_floor=summary["mean"])
+        else:
+            show_noise_floor(spec_array)
+
+    return None
+
+
+def write_run_summaries(run_id, workers_per_disk=1):
+    """Write (or refresh) the summary sidecar of every spec file in a run."""
+    spec_paths, freq_ch = get_run_spec_files(run_id)
+    return write_summaries(spec_paths, freq_ch, workers_per_disk)
+
+
+def look_at_spec_summary(run_id, file_in_acq=0, snr_cut=5, slices=1000):
+    """
+    Quick look at a whole spec file from its pyramid, without reading the
+    .spec file (the pyramid and summary are built first if missing): the
+    sparse spectrogram of the pyramid level about `slices` pixels across,
+    and the noise floor. A pooled pixel is lit if any slice and bin it
+    covers is over snr_cut times its bin's mean, as at full resolution.
+    """
+    spec_path, freq_ch = get_spec_file_info(run_id, file_in_acq)
+    pyramid = open_pyramid(spec_path, freq_ch)
+    try:
+        snr, _, _ = pyramid.viewport(
+            0, pyramid.n_slices, 0, freq_ch, pixels=(slices, slices), kind="snr"
+        )
+        noise_floor = pyramid.noise_floor
+    finally:
+        pyramid.close()
+
+    # The SNR is already normalised, so threshold it against a floor of 1.
+    show_sparse_spec(snr.T, snr_cut=snr_cut, noise_floor=np.ones(snr.shape[1]))
+    show_noise_floor(noise_floor=noise_floor)
 
     return None
@@ -6,12 +6,36 @@ import typing
 from typing import List
 import requests
 import urllib.request
+from time import time
+from concurrent.futures import ThreadPoolExecutor, wait
 
 # Local modules.
 from .PostgreSQL_Interface import he6cres_db_query
+from .RGA import RGAClient
 
 
 class EnvParams:
+
+    # Instrument sources polled by get() and the attributes each one sets.
+    SOURCES = {
+        "field": ("true_field",),
+        "monitor_status": ("monitor_on",),
+        "nmr_status": ("nmr_on",),
+        "rga_pressures": (
+            "rga_tot",
+            "rga_nitrogen",
+            "rga_helium",
+            "rga_c02",
+            "rga_hydrogen",
+            "rga_water",
+            "rga_oxygen",
+            "rga_krypton",
+            "rga_argon",
+            "rga_cf3",
+            "rga_ne19",
+        ),
+    }
+
     def __init__(self, roach_avg, analog_inputs, freq_ch, roach_nyquist, requant_gain):
 
         # Roach parameters. Get from initialization of CLI.
@@ -50,14 +74,58 @@ class EnvParams:
         # Parameter to keep track of slewing thread.
         self.slewing = None
 
-        return None
+        # Outcome of the last get() per source: status and latency_s.
+        # Not a run_log column.
+        self.source_status = None
 
-    def get(self):
+        # Keep-alive, caching client for the RGA flask app. Not a run_log
+        # column either.
+        self.rga_client = RGAClient()
+
+        return None
 
-        self.get_field()
-        self.get_monitor_status()
-        self.get_nmr_status()
-        self.get_rga_pressures()
+    def get(self, deadline_s=15):
+        """
+        Poll all instruments at once and return the parameters.
+
+        Every source runs in its own thread, so get() takes as long as the
+        slowest source, and never more than deadline_s. A source that fails
+        or misses the deadline leaves its parameters as None; what happened
+        to each source is in self.source_status, e.g.
+        {"field": {"status": "ok", "latency_s": 0.02}, ...}.
+
+        ----------Parameters----------
+        deadline_s (float): Longest time to wait for the instruments.
+
+        ------------Returns------------
+        params (dict): This object's attributes.
+        """
+        start = time()
+        pool = ThreadPoolExecutor(max_workers=len(self.SOURCES))
+        futures = {
+            source: pool.submit(self._timed_read, getattr(self, "read_" + source))
+            for source in self.SOURCES
+        }
+        done, _ = wait(futures.values(), timeout=deadline_s)
+        # Don't wait for a source that missed the deadline; its thread ends
+        # on its own (every source has its own timeout) and its result is
+        # dropped.
+        pool.shutdown(wait=False)
+
+        self.source_status = {}
+        for source, future in futures.items():
+            if future in done:
+                values, status, latency_s = future.result()
+            else:
+                values, status, latency_s = {}, "timeout", time() - start
+            for attr in self.SOURCES[source]:
+                setattr(self, attr, values.get(attr))
+            self.source_status[source] = {
+                "status": status,
+                "latency_s": round(latency_s, 3),
+            }
+            if status != "ok":
+                print("{}: {}".format(source, status))
 
         # Check to make sure slewing is on
         if self.trap_config is not None:
@@ -68,7 +136,36 @@ class EnvParams:
 
         return self.__dict__
 
+    @staticmethod
+    def _timed_read(read):
+        """Run one source; returns (values, status, latency_s)."""
+        start = time()
+        try:
+            values = read()
+            status = "ok"
+        except Exception as error:
+            values = {}
+            status = "error: {}".format(error)
+
+        return values, status, time() - start
+
     def get_field(self):
+        self.__dict__.update(self.read_field())
+        return None
+
+    def get_monitor_status(self):
+        self.__dict__.update(self.read_monitor_status())
+        return None
+
+    def get_nmr_status(self):
+        self.__dict__.update(self.read_nmr_status())
+        return None
+
+    def get_rga_pressures(self):
+        self.__dict__.update(self.read_rga_pressures())
+        return None
+
+    def read_field(self):
 
         # read field value from nmr probe
         sock = socket.socket()
@@ -77,20 +174,23 @@ class EnvParams:
         try:
             sock.connect(("10.66.192.40", 1234))
             true_field = sock.recv(128).decode("utf-8")
-            self.true_field = np.nan
+            field = np.nan
             if true_field:
                 if true_field[0] == "N":
                     print("Warning: NMR not locked.")
                 else:
-                    self.true_field = true_field[1:-1]
+                    field = true_field[1:-1]
 
         except socket.error as err:
             print("Error connecting to nmr_probe: {}".format(err))
-            self.true_field = None
+            field = None
 
-        return None
+        finally:
+            sock.close()
 
-    def get_monitor_status(self):
+        return {"true_field": field}
+
+    def read_monitor_status(self):
         monitor_query = """SELECT * FROM he6cres_runs.monitor 
                            ORDER BY monitor_id DESC LIMIT 1
                         """
@@ -107,13 +207,13 @@ class EnvParams:
 
         print("Last monitor rate recorded {} s ago.".format(time_diff_s))
 
-        self.monitor_on = str(time_diff_s < 60)
+        monitor_on = str(time_diff_s < 60)
 
-        print("monitor_on: {}".format(self.monitor_on))
+        print("monitor_on: {}".format(monitor_on))
 
-        return None
+        return {"monitor_on": monitor_on}
 
-    def get_nmr_status(self):
+    def read_nmr_status(self):
 
         nmr_query = """SELECT * FROM he6cres_runs.nmr 
                            ORDER BY nmr_id DESC LIMIT 1
@@ -133,13 +233,13 @@ class EnvParams:
 
         # Note that nmr_on will be true only if there was a probe measurement
         # in the last 60 s and the field was locked for that measurement.
-        self.nmr_on = str((time_diff_s < 60) & (nmr_locked))
+        nmr_on = str((time_diff_s < 60) & (nmr_locked))
 
-        print("nmr_on: {}".format(self.nmr_on))
+        print("nmr_on: {}".format(nmr_on))
 
-        return None
+        return {"nmr_on": nmr_on}
 
-    def get_rga_pressures(self):
+    def read_rga_pressures(self):
 
         species_list = [
             "Nitrogen",
@@ -158,53 +258,23 @@ class EnvParams:
         # for i, stuff in enumerate(zip(species_list, pressure_array)):
         #     print("pressure: ", i, ",", stuff)
 
-        self.rga_nitrogen = pressure_array[0]
-        self.rga_helium = pressure_array[1]
-        self.rga_c02 = pressure_array[2]
-        self.rga_hydrogen = pressure_array[3]
-        self.rga_water = pressure_array[4]
-        self.rga_oxygen = pressure_array[5]
-        self.rga_krypton = pressure_array[6]
-        self.rga_argon = pressure_array[7]
-        self.rga_cf3 = pressure_array[8]
-        self.rga_ne19 = pressure_array[9]
-
-        # Only sum the positive pressures.
-        self.rga_tot = pressure_array[pressure_array > 0].sum()
-
-        return None
+        return {
+            "rga_nitrogen": pressure_array[0],
+            "rga_helium": pressure_array[1],
+            "rga_c02": pressure_array[2],
+            "rga_hydrogen": pressure_array[3],
+            "rga_water": pressure_array[4],
+            "rga_oxygen": pressure_array[5],
+            "rga_krypton": pressure_array[6],
+            "rga_argon": pressure_array[7],
+            "rga_cf3": pressure_array[8],
+            "rga_ne19": pressure_array[9],
+            # Only sum the positive pressures.
+            "rga_tot": pressure_array[pressure_array > 0].sum(),
+        }
 
     def pressures(self, species_list: List[str]) -> np.ndarray:
 
-        pressure_list = []
-
-        for species in species_list:
-
-            try:
-                rga_url = "http://10.95.100.45:5000/"
-
-                # Grab output and split the string based on spaces.
-                response = requests.get(rga_url + species, timeout=10)
-                rga_out = response.text.split()
-                response.close()
-                time_since_write = float(rga_out[3])
-
-                # Verify the rga pressure is recent to within 60s
-                if time_since_write > 60.0:
-                    print(
-                        "The rga pressure was last written over 60s ago. \
-                        Are the rga and rga flask app running?"
-                    )
-                    pressure_list.append(0)
-                else:
-                    pressure = float(rga_out[0])
-                    pressure_list.append(pressure)
-
-            except Exception as error:
-
-                pressure_list = [0] * len(species_list)
-                print("RGA error: ", error)
-
-                break
-
-        return np.array(pressure_list)
+        # Parallel, cached and per-species: one failing species reads 0
+        # without zeroing the others.
+        return self.rga_client.pressures(species_list)
@@ -1,9 +1,90 @@
 #!/usr/bin/env python3
 
+import mmap
 from time import time
 from datetime import datetime
-from multiprocessing import Process, Queue
+from collections import deque
+from queue import Queue
+from threading import Condition, Thread
+from numpy import frombuffer, uint8, int64
+from .Frequency_Domain_Packet import FDpacket
 from .Frequency_Domain_Packet_Receiver import FDPreceiver
+from .Spec_File_Writer import SpecFileSequence
+from .Spec_Packet_Report import GapTracker
+
+# pkt_in_batch is a 20-bit counter and wraps during a long acquisition
+PKT_IN_BATCH_MODULUS = 2**20
+
+
+def pkt_in_batch(block):
+    """
+    The 20-bit pkt_in_batch field of every packet in a (N, bytes_in_packet)
+    uint8 block, read straight from header bytes 1-3 (no payload decoding).
+    """
+    header_data = block[:, 1:4].astype(int64)
+    return ((header_data[:, 0] & 0xF) << 16 | header_data[:, 1] << 8
+            | header_data[:, 2])
+
+
+class SpecBlockRing:
+    """
+    A fixed set of block buffers, each big enough for one output file, in a
+    single shared anonymous mmap. The capture thread takes free blocks and
+    fills them; writer threads hand them back once they are on disk. When
+    every block is waiting to be written, the capture thread waits: that is
+    the back-pressure bound on memory.
+    """
+
+    def __init__(self, n_blocks, packets_per_block,
+                 bytes_in_packet=FDpacket.BYTES_IN_PACKET):
+        """
+        ----------Parameters----------
+        n_blocks (int): Number of blocks in the ring.
+        packets_per_block (int): Packets per block (i.e. per output file).
+        bytes_in_packet (int): Size of one packet. Default is
+            FDpacket.BYTES_IN_PACKET.
+        """
+        self._mem = mmap.mmap(-1, n_blocks*packets_per_block*bytes_in_packet)
+        self.blocks = frombuffer(self._mem, dtype=uint8).reshape(
+            n_blocks, packets_per_block, bytes_in_packet)
+        self.n_blocks = n_blocks
+        self._free = deque(range(n_blocks))
+        self._cond = Condition()
+        self._aborted = False
+        self.high_water = 0
+
+    @property
+    def in_use(self):
+        with self._cond:
+            return self.n_blocks - len(self._free)
+
+    def acquire(self):
+        """
+        Wait for a free block and return its index. Raises RuntimeError if
+        the ring is aborted while (or before) waiting.
+        """
+        with self._cond:
+            while not self._free and not self._aborted:
+                self._cond.wait()
+            if self._aborted:
+                raise RuntimeError("SpecBlockRing aborted: a disk writer failed.")
+            idx = self._free.popleft()
+            self.high_water = max(self.high_water,
+                                  self.n_blocks - len(self._free))
+            return idx
+
+    def release(self, idx):
+        """Return block idx to the free list."""
+        with self._cond:
+            self._free.append(idx)
+            self._cond.notify()
+
+    def abort(self):
+        """Wake every waiting acquire() and make it (and later ones) raise."""
+        with self._cond:
+            self._aborted = True
+            self._cond.notify_all()
+
 
 class DAQ_SpecWriter:
     """
@@ -14,29 +95,72 @@ class DAQ_SpecWriter:
     for packet input
     """
 
+    OUT_DIRS = ("/mnt/sdb/data/", "/mnt/sdc/data/", "/mnt/sdd/data/")
+
     def __init__(self,  boffile = 'he6_cres_correlator_2021_Mar_23_1937.bof',
-                 dsoc_desc = ("0.0.0.0",4003)):
-        self.receiver = FDPreceiver(dsoc_desc)
+                 dsoc_desc = ("0.0.0.0",4003), rcvbuf_bytes = None):
+        self.receiver = FDPreceiver(dsoc_desc, rcvbuf_bytes = rcvbuf_bytes)
         self.output_file = ("/mnt/sdb/data/" +
                             "Freq_data_0000-00-00-00-00-00_0000000.spec")
+        self.stats = {}
+        self.udprx_output = []
+        self.spec_file_list = []
+        # Exceptions raised in the capture and writer threads of the current
+        # capture_files call, in the order they happened.
+        self.thread_errors = []
+
+    def capture_to_ring(self, ring, acquisitions, acq_length, disk_queues):
+        """
+        Fill ring blocks with packets from the receiver and hand each full
+        block to the disk writers in round-robin order. Runs in its own
+        thread so that receiving never waits on a disk.
+
+        ----------Parameters----------
+        ring (SpecBlockRing): The block ring to fill.
+        acquisitions (int): The number of blocks (files) to acquire.
+        acq_length (int): The number of packets in a block.
+        disk_queues (list): One Queue per writer; receives
+            (file_num, block_idx, packets) tuples and finally None.
+            None is sent even if capturing fails, so the writers always
+            finish; the error goes to self.thread_errors.
+        """
+        start = time()
+        try:
+            for file_num in range(acquisitions):
+                idx = ring.acquire()
+                packets = self.receiver.recv_into_array(
+                    ring.blocks[idx, :acq_length])
+                disk_queues[file_num % len(disk_queues)].put(
+                    (file_num, idx, packets))
+        except BaseException as error:
+            self.thread_errors.append(error)
+        finally:
+            for disk_queue in disk_queues:
+                disk_queue.put(None)
+            self.stats["capture_s"] = time() - start
 
-    def pipeline_to_disk (self, in_queue, baton, packets, out_dir,
-    out_file_name, out_file_ext):
+    def pipeline_to_disk (self, ring, disk_queue, file_nums, out_dir,
+    out_file_name, out_file_ext, disk_stats, direct_io=False,
+    write_chunk_bytes=4*2**20, preallocate=True):
         """
-        Write a given number of packets to binary files in a specified output
-        directory. This method supports the use of queues and can
-        simultaneously be run in multiple threads to acquire contiguous,
-        non-overlapping blocks of data and write interleaved file sets onto
-        separate disks.
+        Write the blocks handed to this disk by capture_to_ring to binary
+        files in a specified output directory. One of these runs per disk,
+        each in its own thread, so the disks are written in parallel while
+        the receiver keeps capturing into free blocks.
 
         ----------Parameters----------
-        in_queue (queue): The queue of blocks to acquire.
-        baton (queue): The single-item queue to indicate whether data is being
-            actively acquired by another thread running this method
-        packets (int): The number of packets in a block to be acquired
+        ring (SpecBlockRing): The ring the blocks live in.
+        disk_queue (Queue): Blocks to write, as (file_num, block_idx,
+            packets) tuples. None ends the writer.
+        file_nums (list): The file numbers this disk will receive, in order,
+            so the next file can be opened before its data arrives
         out_dir(char_string): The directory to write binary files to
         out_file_name (char_string): The common name that all files will have
         out_file_ext (char_string): the extension with which to name files
+        disk_stats (dict): Filled with files, bytes and write_s for this disk
+        direct_io (bool): Write with O_DIRECT (see SpecFileWriter)
+        write_chunk_bytes (int): Bytes handed to the kernel per write call
+        preallocate (bool): Reserve each file's full size with fallocate
 
         ------------Outputs------------
         Output will be a set of files to out_dir, each with out_file_name
@@ -50,41 +174,107 @@ class DAQ_SpecWriter:
         raw packet data. The number of packets per file is specified by the
         packets argument.
         """
-        # each pass will write one block of data to file
-        while not in_queue.empty():
-            # wait for other process(es) to finish getting packets
-            if not baton.empty():
-                # the 'baton' should be held by only one thread at a time
-                baton.get()
-                if (in_queue.empty()):  #this if statement prevents hanging
-                    baton.put(1)
-                    return 1
-                # get the number of the output file from the queue
-                file_num = in_queue.get()
-                file_num_str = "{:06}".format(file_num)
-                out_file = out_dir+out_file_name+file_num_str+out_file_ext
-                # get the specified # of packets
-                pkts = self.receiver.grab_packets(n = packets)
-                # "pass the baton" to any process waiting to get packets
-                baton.put(1)
-                # Pass "wb" to write a new file
-                with open(out_file, "wb") as binary_file:
-                    for line_num in range(packets):
-                        # Write packet to the file
-                        binary_file.write(pkts[line_num])
-                print("File {0} written".format(out_file))
-                self.output_file = out_file
-
-    def save_packets(self, acquisitions = 180, acq_length = 5000, descrip = ""):
+        disk_stats.update(files=0, bytes=0, write_s=0.0)
+        out_files = [out_dir+out_file_name+"{:06}".format(file_num)+out_file_ext
+                     for file_num in file_nums]
+        file_bytes = ring.blocks[0].nbytes if preallocate else None
+        idx = None
+        done = False
+        try:
+            with SpecFileSequence(out_files, chunk_bytes=write_chunk_bytes,
+                                  direct=direct_io,
+                                  preallocate_bytes=file_bytes) as files:
+                while True:
+                    item = disk_queue.get()
+                    if item is None:
+                        done = True
+                        return
+                    file_num, idx, packets = item
+                    block = ring.blocks[idx, :packets]
+                    # Gap statistics come from the block while it is still
+                    # in memory, so the file never has to be read back.
+                    gaps = GapTracker(modulus=PKT_IN_BATCH_MODULUS)
+                    gaps.update(pkt_in_batch(block))
+                    start = time()
+                    binary_file = files.next_writer()
+                    binary_file.write(block)
+                    files.retire(binary_file)
+                    disk_stats["write_s"] += time() - start
+                    disk_stats["bytes"] += block.nbytes
+                    disk_stats["files"] += 1
+                    ring.release(idx)
+                    idx = None
+                    out_file = binary_file.path
+                    # same line format udprx prints, for format_udprx_output
+                    self.udprx_output[file_num] = (
+                        "file_path:{0},packets:{1},file_size_mb:{2}".format(
+                        out_file, packets, block.nbytes // 1000000))
+                    self.spec_file_list[file_num] = self.spec_dict(
+                        file_num, out_file, block.nbytes, gaps)
+                    print("File {0} written".format(out_file))
+                    self.output_file = out_file
+
+        except BaseException as error:
+            # Disk full, EIO, ...: stop the capture and give back every
+            # block this writer holds or is still sent, so nothing waits on
+            # it. save_packets re-raises the error after the joins.
+            self.thread_errors.append(error)
+            ring.abort()
+            if idx is not None:
+                ring.release(idx)
+            while not done:
+                item = disk_queue.get()
+                if item is None:
+                    done = True
+                else:
+                    ring.release(item[1])
+
+    @staticmethod
+    def spec_dict(file_in_acq, file_path, file_bytes, gaps):
+        """
+        Metadata for one written file, with the same keys packet_report
+        fills in, so it can go straight to fill_he6cres_db.
+
+        ----------Parameters----------
+        file_in_acq (int): Position of the file in the acquisition
+        file_path (char_string): Where the file was written
+        file_bytes (int): Bytes written
+        gaps (GapTracker): Gap statistics of the file's packets
+
+        ------------Returns------------
+        spec_dict (dict)
+        """
+        (packets, num_dropped_packets, frac_of_packets_dropped, num_gaps,
+         neg_gaps, mean_gap, std_gap, max_gap) = gaps.report()
+        return {
+            "file_in_acq": file_in_acq,
+            "file_size_mb": file_bytes // 1000000,
+            "packets": packets,
+            "file_path": file_path,
+            "num_dropped_packets": num_dropped_packets,
+            "frac_of_packets_dropped": frac_of_packets_dropped,
+            "num_gaps": num_gaps,
+            "neg_gaps": neg_gaps,
+            "mean_gap": mean_gap,
+            "std_gap": std_gap,
+            "max_gap": max_gap,
+            "deleted": False,
+        }
+
+    def save_packets(self, acquisitions = 180, acq_length = 5000, descrip = "",
+                     out_dirs = OUT_DIRS, ring_blocks = None,
+                     direct_io = False, write_chunk_bytes = 4*2**20,
+                     preallocate = True):
         """
         Write a given number of binary files, each containing a given
-        number of raw packets.
+        number of raw packets, along with a text file of notes on the data.
 
         ----------Parameters----------
         acquisitions (int): The number of files to save
         acq_length (int): The number of packets in an output file
-        out_file_name (char_string): The common name that all files will have
-        out_file_ext (char_string): the extension with which to name files
+        descrip (char_string): Comma-separated notes on what the data is for
+        out_dirs, ring_blocks, direct_io, write_chunk_bytes, preallocate:
+            see capture_files
 
         ------------Outputs------------
         Output will be a set of files to out_dir, each with out_file_name
@@ -96,6 +286,9 @@ class DAQ_SpecWriter:
         to /mnt/sdc/data/. Each file will be in binary format containing
         raw packet data. The number of packets per file is specified by the
         packets argument.
+
+        ------------Returns------------
+        stats (dict): see capture_files
         """
 
         if descrip == (""):
@@ -105,7 +298,7 @@ class DAQ_SpecWriter:
             return
 
         descrip_strings = descrip.split(',')
-        descrip_file_dir = "/mnt/sdb/data/"
+        descrip_file_dir = out_dirs[0]
         descrip_file_name = "Env_conditions_{:%Y-%m-%d-%H-%M-%S_}".format(datetime.now())
         descrip_file_ext = ".txt"
         descrip_file = descrip_file_dir+descrip_file_name+descrip_file_ext
@@ -114,39 +307,97 @@ class DAQ_SpecWriter:
                 dfile.write(descrip_strings[i])
                 dfile.write("\n")
 
-        in_queue = Queue()
-        for i in range(acquisitions):
-            in_queue.put(i)
+        return self.capture_files(acquisitions, acq_length, out_dirs,
+                                  ring_blocks, direct_io, write_chunk_bytes,
+                                  preallocate)
+
+    def capture_files(self, acquisitions = 180, acq_length = 5000,
+                      out_dirs = OUT_DIRS, ring_blocks = None,
+                      direct_io = False, write_chunk_bytes = 4*2**20,
+                      preallocate = True,
+                      bytes_in_packet = FDpacket.BYTES_IN_PACKET,
+                      drain = True):
+        """
+        Capture acquisitions files of acq_length packets each, dealt to
+        out_dirs in round-robin order.
+
+        ----------Parameters----------
+        acquisitions (int): The number of files to save
+        acq_length (int): The number of packets in an output file
+        out_dirs (tuple): One output directory per disk; files are dealt to
+            them in round-robin order
+        ring_blocks (int): Number of file-sized blocks held in memory.
+            Default is two per disk.
+        direct_io (bool): Bypass the page cache with O_DIRECT writes
+        write_chunk_bytes (int): Bytes per write call, default 4 MiB
+        preallocate (bool): Reserve each file's full size up front with
+            fallocate; short files are truncated when closed
+        bytes_in_packet (int): 8224 for 32768 channels, 4128 for 4096
+        drain (bool): Discard whatever is already queued on the socket
+            before capturing, so the first file does not start with stale
+            packets followed by a gap. Default True.
+
+        ------------Returns------------
+        stats (dict): Capture time, ring high-water mark and per-disk
+            files, bytes, write time and MB/s. Also kept in self.stats.
+
+        If the capture or a writer thread fails, the others are stopped and
+        the first error is raised here once every thread has finished.
+
+        One udprx-style "file_path:...,packets:...,file_size_mb:..." line per
+        file is left in self.udprx_output, in file order, ready for
+        PostgreSQL_Interface.format_udprx_output. self.spec_file_list holds
+        the same files as packet_report-style dicts, with gap statistics
+        taken from the 20-bit pkt_in_batch counter during capture.
+        """
 
-        baton = Queue()
-        baton.put(1)
+        if ring_blocks is None:
+            ring_blocks = 2*len(out_dirs)
+        ring = SpecBlockRing(ring_blocks, acq_length, bytes_in_packet)
 
         start = time()
 
         out_file_name = "Freq_data_{:%Y-%m-%d-%H-%M-%S_}".format(datetime.now())
         out_file_ext = ".spec"
 
-        out_dir_b = "/mnt/sdb/data/"
-        line_b = Process(target = self.pipeline_to_disk,
-        args=(in_queue, baton, acq_length, out_dir_b,
-        out_file_name, out_file_ext))
+        self.stats = {"disks": {}}
+        self.udprx_output = [None] * acquisitions
+        self.spec_file_list = [None] * acquisitions
+        self.thread_errors = []
+        disk_queues = []
+        writers = []
+        for disk_num, out_dir in enumerate(out_dirs):
+            disk_queue = Queue()
+            disk_stats = self.stats["disks"].setdefault(out_dir, {})
+            file_nums = range(disk_num, acquisitions, len(out_dirs))
+            writers.append(Thread(target = self.pipeline_to_disk,
+            args=(ring, disk_queue, file_nums, out_dir, out_file_name,
+            out_file_ext, disk_stats, direct_io, write_chunk_bytes,
+            preallocate)))
+            disk_queues.append(disk_queue)
 
-        out_dir_c = "/mnt/sdc/data/"
-        line_c = Process(target = self.pipeline_to_disk,
-        args=(in_queue, baton, acq_length, out_dir_c,
-        out_file_name, out_file_ext))
+        capture = Thread(target = self.capture_to_ring,
+        args=(ring, acquisitions, acq_length, disk_queues))
 
-        out_dir_d = "/mnt/sdd/data/"
-        line_d = Process(target = self.pipeline_to_disk,
-        args=(in_queue, baton, acq_length, out_dir_d,
-        out_file_name, out_file_ext))
+        if drain:
+            self.stats["drained"] = self.receiver.drain(bytes_in_packet)
+        for writer in writers:
+            writer.start()
+        capture.start()
 
-        line_b.start()
-        line_c.start()
-        line_d.start()
+        capture.join()
+        for writer in writers:
+            writer.join()
+        if self.thread_errors:
+            raise self.thread_errors[0]
 
-        line_b.join()
-        line_c.join()
-        line_d.join()
+        for disk_stats in self.stats["disks"].values():
+            if disk_stats["write_s"] > 0:
+                disk_stats["MB_per_s"] = (disk_stats["bytes"] / 1e6
+                                          / disk_stats["write_s"])
+        self.stats["total_s"] = time() - start
+        self.stats["ring_blocks"] = ring_blocks
+        self.stats["ring_high_water"] = ring.high_water
 
         #print('Total time: {:2.2f} seconds'.format(time()-start))
+        return self.stats
@@ -1,8 +1,9 @@
 #!/usr/bin/env python3
 
-from struct import unpack
 from numpy import (
     array,
+    dtype,
+    frombuffer,
     int8,
     uint64,
     uint32,
@@ -20,6 +21,19 @@ class FDpacket:
     BYTES_IN_HEADER = 32
     BYTES_IN_PACKET = BYTES_IN_PAYLOAD + BYTES_IN_HEADER
 
+    # decoded header fields, one row per packet (see decode_many)
+    HEADER_DTYPE = dtype([
+        ("unix_time", uint32),
+        ("pkt_in_batch", uint32),
+        ("digital_id", uint8),
+        ("if_id", uint8),
+        ("user_data_0", uint32),
+        ("user_data_1", uint32),
+        ("reserved_0", uint64),
+        ("reserved_1", uint64),
+        ("freq_not_time", bool),
+        ])
+
 #    @property
 #    def bytes_in_payload(self):
 #        return self.bytes_in_payload
@@ -95,6 +109,79 @@ class FDpacket:
         x = array(self.data, dtype = uint8)
         return x
 
+    @classmethod
+    def packet_dtype(cls, bytes_in_payload=None):
+        """
+        Structured dtype of one packet as it sits on the wire: four
+        big-endian 64-bit header words followed by the raw payload bytes.
+        """
+        if bytes_in_payload is None:
+            bytes_in_payload = cls.BYTES_IN_PAYLOAD
+        return dtype([
+            ("header", ">u8", (cls.BYTES_IN_HEADER//8,)),
+            ("payload", uint8, (bytes_in_payload,)),
+            ])
+
+    @classmethod
+    def decode_many(cls, buffer, bytes_in_payload=None, reorder=True):
+        """
+        Decode a contiguous block of N packets in one pass, without a
+        per-packet or per-byte Python loop.
+
+        ----------Parameters----------
+        buffer (bytes, bytearray, memoryview or ndarray): N packets laid out
+            back to back, exactly as received or as stored in a .spec file.
+        bytes_in_payload (int): Payload length of each packet, a multiple
+            of 8 bytes. Default is FDpacket.BYTES_IN_PAYLOAD.
+        reorder (bool): If True (default) the payload bytes are reordered
+            within each 64-bit word exactly as from_byte_string does. If
+            False the raw wire-order payload is returned as a zero-copy view
+            of buffer.
+
+        ------------Returns------------
+        header_table (ndarray): N records of dtype FDpacket.HEADER_DTYPE.
+        payload_matrix (ndarray): (N, bytes_in_payload) uint8 array.
+        """
+        if bytes_in_payload is None:
+            bytes_in_payload = cls.BYTES_IN_PAYLOAD
+        if bytes_in_payload % 8:
+            raise ValueError(
+            "Payload length is {0} bytes, should be a multiple of 8 bytes".format(
+            bytes_in_payload))
+
+        pkt_dtype = cls.packet_dtype(bytes_in_payload)
+        len_bytes = memoryview(buffer).nbytes
+        if len_bytes % pkt_dtype.itemsize:
+            raise ValueError(
+            "Buffer length is {0} bytes, not a multiple of {1} bytes".format(
+            len_bytes,pkt_dtype.itemsize))
+
+        packets = frombuffer(buffer, dtype=pkt_dtype)
+        hdr = packets["header"]
+
+        header_table = zeros(len(packets), dtype=cls.HEADER_DTYPE)
+        header_table["unix_time"] = hdr[:,0] & uint64(0xFFFFFFFF)
+        header_table["pkt_in_batch"] = (hdr[:,0]>>uint64(32)) & uint64(0xFFFFF)
+        header_table["digital_id"] = (hdr[:,0]>>uint64(52)) & uint64(0x3F)
+        header_table["if_id"] = (hdr[:,0]>>uint64(58)) & uint64(0x3F)
+        header_table["user_data_1"] = hdr[:,1] & uint64(0xFFFFFFFF)
+        header_table["user_data_0"] = (hdr[:,1]>>uint64(32)) & uint64(0xFFFFFFFF)
+        header_table["reserved_0"] = hdr[:,2]
+        header_table["reserved_1"] = hdr[:,3] & uint64(0x7FFFFFFFFFFFFFFF)
+        header_table["freq_not_time"] = (hdr[:,3]>>uint64(63)) != 0
+
+        payload = packets["payload"]
+        if reorder:
+            # from_byte_string reads each payload word big-endian and then
+            #peels its bytes off least-significant first, i.e. it reverses
+            #the byte order within every 64-bit word. Converting the words
+            #to little-endian does the same thing in a single copy.
+            n_words = payload.shape[1]//8
+            payload = (payload.view(">u8").reshape(len(packets), n_words)
+                .astype("<u8").view(uint8))
+
+        return header_table, payload
+
     @classmethod
     def from_byte_string(cls,bytestr):
         """
@@ -108,33 +195,122 @@ class FDpacket:
             "Packet length is {0} bytes, should have {1} bytes".format(
             len_bytes,cls.BYTES_IN_PACKET))
 
-        # unpack header
-        hdr = unpack(">{0}Q".format(cls.BYTES_IN_HEADER//8),
-        bytestr[:cls.BYTES_IN_HEADER])
+        header_table, payload = cls.decode_many(bytestr)
+        hdr = header_table[0]
 
-        ut = uint32(hdr[0] & 0xFFFFFFFF)
-        pktnum = uint32((hdr[0]>>uint32(32)) & 0xFFFFF)
-        did = uint8(hdr[0]>>uint32(52) & 0x3F)
-        ifid = uint8(hdr[0]>>uint32(58) & 0x3F)
-        ud1 = uint32(hdr[1] & 0xFFFFFFFF)
-        ud0 = uint32((hdr[1]>>uint32(32)) & 0xFFFFFFFF)
-        res0 = uint64(hdr[2])
-        res1 = uint64(hdr[3]&0x7FFFFFFFFFFFFFFF)
-        fnt = not (hdr[3]&0x8000000000000000 == 0)
+        return FDpacket(hdr["unix_time"],hdr["pkt_in_batch"],
+        hdr["digital_id"],hdr["if_id"],hdr["user_data_0"],hdr["user_data_1"],
+        hdr["reserved_0"],hdr["reserved_1"],bool(hdr["freq_not_time"]),
+        payload[0])
 
 
-        # pre-allocate data array long enough to hold 8192-byte payload as
-        #8-bit integer numbers
-        data = zeros(cls.BYTES_IN_PAYLOAD,dtype=uint8)
+class FDpacketView:
+    """
+    Lightweight, read-only view of one packet inside a larger receive or
+    file buffer. Nothing is copied when the view is made; header fields are
+    decoded from the underlying bytes only when they are accessed.
 
-        # use a holder array of 64-bit data because struct.unpack requires
-        #the payload to be unpacked in 64-bit words
-        data_64bit = array(unpack(">{0}Q".format(cls.BYTES_IN_PAYLOAD//8),
-        bytestr[cls.BYTES_IN_HEADER:]),dtype=uint64)
+    Exposes the same attributes as FDpacket, so it can stand in for one
+    wherever packets are only being inspected.
+    """
 
-        #fill data array word by word from data_64bit
-        for i in range(len(data_64bit)):
-            for j in range(8):
-                data[i*8+j] = uint8((data_64bit[i]>>uint64(8*j))&uint64(0xFF))
+    __slots__ = ("_buffer",)
 
-        return FDpacket(ut,pktnum,did,ifid,ud0,ud1,res0,res1,fnt,data)
+    BYTES_IN_PAYLOAD = FDpacket.BYTES_IN_PAYLOAD
+    BYTES_IN_HEADER = FDpacket.BYTES_IN_HEADER
+    BYTES_IN_PACKET = FDpacket.BYTES_IN_PACKET
+
+    def __init__(self, buffer, offset=0):
+        """
+        ----------Parameters----------
+        buffer (bytes, bytearray, memoryview or ndarray): Buffer holding the
+            packet. It is referenced, not copied, so it must stay unchanged
+            for as long as the view is in use.
+        offset (int): Byte offset of the packet within buffer. Default is 0.
+        """
+        mv = memoryview(buffer).cast("B")[offset:offset+self.BYTES_IN_PACKET]
+        if not mv.nbytes == self.BYTES_IN_PACKET:
+            raise ValueError(
+            "Packet length is {0} bytes, should have {1} bytes".format(
+            mv.nbytes,self.BYTES_IN_PACKET))
+        self._buffer = mv
+
+    @classmethod
+    def iter_buffer(cls, buffer):
+        """
+        Yield one FDpacketView per packet in a buffer of back-to-back packets.
+        """
+        n_packets = memoryview(buffer).nbytes // cls.BYTES_IN_PACKET
+        for i in range(n_packets):
+            yield cls(buffer, i*cls.BYTES_IN_PACKET)
+
+    def _word(self, i):
+        return int.from_bytes(self._buffer[8*i:8*i+8], "big")
+
+    @property
+    def unix_time(self):
+        return uint32(self._word(0) & 0xFFFFFFFF)
+
+    @property
+    def pkt_in_batch(self):
+        return uint32((self._word(0)>>32) & 0xFFFFF)
+
+    @property
+    def digital_id(self):
+        return uint8((self._word(0)>>52) & 0x3F)
+
+    @property
+    def if_id(self):
+        return uint8((self._word(0)>>58) & 0x3F)
+
+    @property
+    def user_data_1(self):
+        return uint32(self._word(1) & 0xFFFFFFFF)
+
+    @property
+    def user_data_0(self):
+        return uint32((self._word(1)>>32) & 0xFFFFFFFF)
+
+    @property
+    def reserved_0(self):
+        return uint64(self._word(2))
+
+    @property
+    def reserved_1(self):
+        return uint64(self._word(3) & 0x7FFFFFFFFFFFFFFF)
+
+    @property
+    def freq_not_time(self):
+        return not (self._word(3) & 0x8000000000000000 == 0)
+
+    @property
+    def payload(self):
+        """
+        Zero-copy uint8 view of the payload in wire byte order.
+        """
+        return frombuffer(self._buffer, dtype=uint8,
+        offset=self.BYTES_IN_HEADER)
+
+    @property
+    def data(self):
+        """
+        Payload in the same byte order as FDpacket.data. The 64-bit word
+        byte reversal cannot be expressed as a strided view, so this is
+        built on demand; use payload when the raw bytes are enough.
+        """
+        return self.payload.view(">u8").astype("<u8").view(uint8)
+
+    def interpret_data(self):
+        """
+        Returns
+        -------
+        x : ndarray
+            real-valued array represented by the data.
+        """
+        return self.data
+
+    def to_packet(self):
+        """
+        Return an independent FDpacket holding a copy of this packet.
+        """
+        return FDpacket.from_byte_string(self._buffer)
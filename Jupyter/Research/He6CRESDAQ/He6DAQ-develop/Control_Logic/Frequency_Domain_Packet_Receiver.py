@@ -1,11 +1,172 @@
 #!/usr/bin/env python2
 
-from .Frequency_Domain_Packet import FDpacket
-from socket import socket, AF_INET, SOCK_DGRAM
+import ctypes
+import ctypes.util
+import mmap
+import os
+from errno import EAGAIN, EINTR, EWOULDBLOCK
+from numpy import frombuffer, uint8
+from .Frequency_Domain_Packet import FDpacket, FDpacketView
+from socket import socket, AF_INET, SOCK_DGRAM, SOL_SOCKET, SO_RCVBUF, MSG_DONTWAIT
+
+# Linux only: set SO_RCVBUF past net.core.rmem_max (needs CAP_NET_ADMIN)
+SO_RCVBUFFORCE = 33
+
+
+# recvmmsg(2) lets one syscall return a whole batch of datagrams. It is
+# Linux-only and not wrapped by the socket module, so reach it through ctypes
+# and fall back to socket.recv_into when it is not available.
+MSG_TRUNC = 0x20
+MSG_WAITFORONE = 0x10000
+
+
+class _iovec(ctypes.Structure):
+    _fields_ = [("iov_base", ctypes.c_void_p),
+                ("iov_len", ctypes.c_size_t)]
+
+
+class _msghdr(ctypes.Structure):
+    _fields_ = [("msg_name", ctypes.c_void_p),
+                ("msg_namelen", ctypes.c_uint32),
+                ("msg_iov", ctypes.POINTER(_iovec)),
+                ("msg_iovlen", ctypes.c_size_t),
+                ("msg_control", ctypes.c_void_p),
+                ("msg_controllen", ctypes.c_size_t),
+                ("msg_flags", ctypes.c_int)]
+
+
+class _mmsghdr(ctypes.Structure):
+    _fields_ = [("msg_hdr", _msghdr),
+                ("msg_len", ctypes.c_uint)]
+
+
+try:
+    _libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    _recvmmsg = _libc.recvmmsg
+    _recvmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(_mmsghdr),
+                          ctypes.c_uint, ctypes.c_int, ctypes.c_void_p]
+    _recvmmsg.restype = ctypes.c_int
+except (OSError, AttributeError, TypeError):
+    _recvmmsg = None
+
+
+class _MmsgVector:
+    """
+    Preallocated recvmmsg message headers, one per row of a 2D uint8 array,
+    each pointing straight at its row so datagrams land in place.
+    """
+
+    def __init__(self, rows):
+        self.rows = rows
+        n_rows, row_bytes = rows.shape
+        self.iov = (_iovec * n_rows)()
+        self.msgs = (_mmsghdr * n_rows)()
+        base = rows.ctypes.data
+        for i in range(n_rows):
+            self.iov[i].iov_base = base + i*rows.strides[0]
+            self.iov[i].iov_len = row_bytes
+            self.msgs[i].msg_hdr.msg_iov = ctypes.pointer(self.iov[i])
+            self.msgs[i].msg_hdr.msg_iovlen = 1
+
+    def receive(self, fd, start, count):
+        """
+        Receive up to count datagrams into rows [start, start+count).
+        Blocks for the first datagram only. Returns the message count.
+        """
+        msgs = ctypes.cast(
+            ctypes.addressof(self.msgs) + start*ctypes.sizeof(_mmsghdr),
+            ctypes.POINTER(_mmsghdr))
+        while True:
+            n = _recvmmsg(fd, msgs, count, MSG_WAITFORONE, None)
+            if n >= 0:
+                return n
+            err = ctypes.get_errno()
+            if err == EINTR:
+                continue
+            if err in (EAGAIN, EWOULDBLOCK):
+                return 0
+            raise OSError(err, "recvmmsg failed")
+
+    def good(self, start, n):
+        """
+        Flags for the last n messages from start: True if the datagram was
+        exactly one row long.
+        """
+        row_bytes = self.rows.shape[1]
+        return [self.msgs[i].msg_len == row_bytes and
+                not self.msgs[i].msg_hdr.msg_flags & MSG_TRUNC
+                for i in range(start, start+n)]
+
+
+class PacketRing:
+    """
+    Fixed number of packet-sized slots in one page-aligned block of memory,
+    filled at the head by the receiver and released at the tail by whoever
+    consumes the packets.
+    """
+
+    def __init__(self, slots, bytes_in_packet=FDpacket.BYTES_IN_PACKET):
+        """
+        ----------Parameters----------
+        slots (int): Number of packets the ring can hold.
+        bytes_in_packet (int): Size of one slot. Default is
+            FDpacket.BYTES_IN_PACKET.
+        """
+        # anonymous mmaps are always page aligned
+        self._mem = mmap.mmap(-1, slots*bytes_in_packet)
+        self.slots = frombuffer(self._mem, dtype=uint8).reshape(
+            slots, bytes_in_packet)
+        self.n_slots = slots
+        self.head = 0
+        self.tail = 0
+        self.high_water = 0
+
+    @property
+    def occupancy(self):
+        return self.head - self.tail
+
+    @property
+    def free(self):
+        return self.n_slots - self.occupancy
+
+    def writable(self, n):
+        """
+        Return (start, count): the slot index where the next packet goes
+        and how many of the next n packets fit there without wrapping or
+        overwriting unreleased slots.
+        """
+        start = self.head % self.n_slots
+        return start, min(n, self.free, self.n_slots - start)
+
+    def commit(self, n):
+        """Mark n more slots at the head as filled."""
+        self.head += n
+        self.high_water = max(self.high_water, self.occupancy)
+
+    def filled(self, n=None):
+        """
+        Zero-copy (N, bytes_in_packet) view of the oldest filled slots, up
+        to n of them. Stops at the end of the ring, so call again after
+        release() to reach slots that wrapped around.
+        """
+        start = self.tail % self.n_slots
+        count = min(self.occupancy, self.n_slots - start)
+        if n is not None:
+            count = min(count, n)
+        return self.slots[start:start+count]
+
+    def release(self, n):
+        """Hand the n oldest filled slots back to the receiver."""
+        if n > self.occupancy:
+            raise ValueError(
+            "Cannot release {0} slots, only {1} are filled".format(
+            n,self.occupancy))
+        self.tail += n
+
 
 class FDPreceiver:
 
-    def __init__(self, dsoc_desc=None):
+    def __init__(self, dsoc_desc=None, ring_slots=0, rcvbuf_bytes=None):
         """
         Initialize an FDPreceiver object; open a socket for receiving packets
 
@@ -16,8 +177,18 @@ class FDPreceiver:
             documentation of that class for details. In this case a
             socket is opened and bound to the given address. If None, then
             the data socket is not opened. Default is None.
+        ring_slots (int): If nonzero, allocate a PacketRing of this many
+            packets for grab_into_ring(). Default is 0 (no ring).
+        rcvbuf_bytes (int): If not None, ask the kernel for a socket receive
+            buffer of this many bytes. The usable size actually granted is
+            kept in self.rcvbuf_granted. Default is None (system default).
         """
         self._data_socket = socket(AF_INET,SOCK_DGRAM)
+        self.rcvbuf_requested = rcvbuf_bytes
+        if rcvbuf_bytes is not None:
+            self.set_rcvbuf(rcvbuf_bytes)
+        self.rcvbuf_granted = self._data_socket.getsockopt(
+            SOL_SOCKET, SO_RCVBUF) // 2
         if not dsoc_desc is None:
             try:
                 self._data_socket.bind(dsoc_desc)
@@ -26,6 +197,15 @@ class FDPreceiver:
                 "Error: Unable to open data socket at {0}".format(dsoc_desc))
         print("Opened high-rate data socket at {0}".format(dsoc_desc))
 
+        self.received = 0
+        self.bad_length = 0
+        self.ring = None
+        self._ring_mmsg = None
+        if ring_slots:
+            self.ring = PacketRing(ring_slots)
+            if _recvmmsg is not None:
+                self._ring_mmsg = _MmsgVector(self.ring.slots)
+
     def one_packet_payload(self):
         """
         Get 1 packet using open data socket, remove header and interpret
@@ -54,9 +234,199 @@ class FDPreceiver:
             output.append(self._data_socket.recv(FDpacket.BYTES_IN_PACKET))
         return output
 
+    def _recv_batch(self, rows, start, count, mmsg=None):
+        """
+        Receive up to count packets into rows[start:start+count], one
+        recvmmsg call if possible. Datagrams of the wrong size are dropped
+        and the good ones packed to the front. Returns the number kept.
+        """
+        bytes_in_packet = rows.shape[1]
+        # recvmmsg needs a blocking fd; a socket with a timeout is
+        # non-blocking underneath, so use recv_into there instead
+        if (_recvmmsg is not None and
+                self._data_socket.gettimeout() is None):
+            if mmsg is None:
+                mmsg = _MmsgVector(rows)
+            n = mmsg.receive(self._data_socket.fileno(), start, count)
+            good = mmsg.good(start, n)
+        else:
+            n = 0
+            good = []
+            for i in range(start, start+count):
+                try:
+                    n_bytes = self._data_socket.recv_into(memoryview(rows[i]))
+                except (BlockingIOError, TimeoutError):
+                    break
+                good.append(n_bytes == bytes_in_packet)
+                n += 1
+
+        kept = sum(good)
+        if kept < n:
+            rows[start:start+kept] = rows[start:start+n][good]
+        self.received += kept
+        self.bad_length += n - kept
+        return kept
+
+    def recv_into_array(self, out):
+        """
+        Fill a preallocated (N, BYTES_IN_PACKET) uint8 array with the next
+        N packets, taking as many per syscall as the socket has queued.
+
+        ----------Parameters----------
+        out (ndarray): C-contiguous (N, BYTES_IN_PACKET) uint8 array.
+
+        ------------Returns------------
+        n (int): Number of packets written to out. Less than N only if the
+            socket timed out.
+        """
+        mmsg = _MmsgVector(out) if _recvmmsg is not None else None
+        got = 0
+        while got < len(out):
+            k = self._recv_batch(out, got, len(out) - got, mmsg)
+            if k == 0 and self._data_socket.gettimeout() is not None:
+                break
+            got += k
+        return got
+
+    def grab_into_ring(self, n):
+        """
+        Receive up to n packets into the receiver's PacketRing. Read them
+        back with self.ring.filled() and free them with self.ring.release().
+
+        ----------Parameters----------
+        n (int): Number of packets to grab.
+
+        ------------Returns------------
+        got (int): Number of packets received. Less than n if the ring
+            filled up or the socket timed out.
+        """
+        if self.ring is None:
+            raise RuntimeError(
+            "Receiver was opened without a ring; pass ring_slots")
+        got = 0
+        while got < n:
+            start, count = self.ring.writable(n - got)
+            if count == 0:
+                break
+            k = self._recv_batch(self.ring.slots, start, count,
+                                 self._ring_mmsg)
+            self.ring.commit(k)
+            got += k
+            if k == 0 and self._data_socket.gettimeout() is not None:
+                break
+        return got
+
+    def drain(self, bytes_in_packet=FDpacket.BYTES_IN_PACKET):
+        """
+        Throw away the datagrams already queued on the socket (e.g. ones
+        that arrived while the DAQ was busy between captures), so the next
+        read starts on fresh, continuous data. At most as many datagrams as
+        the receive buffer can hold are read, so this returns even while
+        the ROACH keeps streaming.
+
+        ------------Returns------------
+        drained (int): Number of datagrams discarded.
+        """
+        scratch = bytearray(bytes_in_packet)
+        # The kernel charges each datagram at least its size against the
+        # full (doubled) buffer, so no more than this can be queued.
+        max_datagrams = 2*self.rcvbuf_granted // bytes_in_packet + 1
+        drained = 0
+        while drained < max_datagrams:
+            try:
+                self._data_socket.recv_into(scratch, bytes_in_packet,
+                                            MSG_DONTWAIT)
+            except (BlockingIOError, InterruptedError):
+                break
+            drained += 1
+        return drained
+
+    def ring_stats(self):
+        """
+        ------------Returns------------
+        stats (dict): Packets received and dropped for bad length by this
+            receiver, plus the ring's current occupancy, size and
+            high-water mark.
+        """
+        stats = {
+            "received": self.received,
+            "bad_length": self.bad_length,
+        }
+        if self.ring is not None:
+            stats["ring_occupancy"] = self.ring.occupancy
+            stats["ring_slots"] = self.ring.n_slots
+            stats["ring_high_water"] = self.ring.high_water
+        return stats
+
+    def set_rcvbuf(self, n_bytes):
+        """
+        Request a socket receive buffer of n_bytes. SO_RCVBUF is capped at
+        net.core.rmem_max, so if the kernel grants less than asked, try
+        SO_RCVBUFFORCE, which works when running as root.
+
+        ----------Parameters----------
+        n_bytes (int): Requested receive buffer size in bytes.
+
+        ------------Returns------------
+        granted (int): Usable buffer size. Linux reports double the usable
+            size to account for its bookkeeping, so this is half of what
+            getsockopt returns.
+        """
+        self.rcvbuf_requested = n_bytes
+        self._data_socket.setsockopt(SOL_SOCKET, SO_RCVBUF, n_bytes)
+        reported = self._data_socket.getsockopt(SOL_SOCKET, SO_RCVBUF)
+        if reported < 2*n_bytes:
+            try:
+                self._data_socket.setsockopt(SOL_SOCKET, SO_RCVBUFFORCE,
+                                             n_bytes)
+                reported = self._data_socket.getsockopt(SOL_SOCKET, SO_RCVBUF)
+            except OSError:
+                pass
+        granted = reported // 2
+        if granted < n_bytes:
+            print("Warning: asked for a {0} byte receive buffer, kernel "
+                  "granted {1}. Raise net.core.rmem_max.".format(
+                  n_bytes,granted))
+        self.rcvbuf_granted = granted
+        return granted
+
+    def socket_stats(self):
+        """
+        Kernel-side counters for the data socket, read from /proc/net/udp.
+        kernel_drops counts datagrams the kernel threw away because the
+        receive buffer was full, i.e. before they ever reached this process;
+        compare with the sequence gaps found in the written files.
+
+        ------------Returns------------
+        stats (dict): rcvbuf_requested, rcvbuf_granted, rx_queue_bytes
+            (bytes waiting to be read) and kernel_drops. The last two are
+            None if /proc/net/udp is unavailable.
+        """
+        stats = {
+            "rcvbuf_requested": self.rcvbuf_requested,
+            "rcvbuf_granted": self.rcvbuf_granted,
+            "rx_queue_bytes": None,
+            "kernel_drops": None,
+        }
+        try:
+            inode = str(os.fstat(self._data_socket.fileno()).st_ino)
+            with open("/proc/net/udp") as proc_udp:
+                next(proc_udp)
+                for line in proc_udp:
+                    fields = line.split()
+                    if fields[9] == inode:
+                        rx_queue = fields[4].split(":")[1]
+                        stats["rx_queue_bytes"] = int(rx_queue, 16)
+                        stats["kernel_drops"] = int(fields[12])
+                        break
+        except (OSError, IndexError, ValueError):
+            pass
+        return stats
+
     def crack_packets(self, block, n=1):
         """
-        Interpret a block of packets using he6daq_packet.from_byte_string.
+        Interpret a block of packets as FDpacketView objects. The views
+        reference the received bytes directly, so no payload is copied.
 
         ----------Parameters----------
         block (list): A list of bitstrings returned from _data_socket.recv
@@ -64,11 +434,11 @@ class FDPreceiver:
         n (int): Number of packets in block, default is 1.
 
         ------------Returns------------
-        output (list): A list of n he6daq_packet objects
+        output (list): A list of n FDpacketView objects
         """
         output = []
         for x in range(n):
-            output.append(FDpacket.from_byte_string(block[x]))
+            output.append(FDpacketView(block[x]))
         return output
 
     def __del__(self):
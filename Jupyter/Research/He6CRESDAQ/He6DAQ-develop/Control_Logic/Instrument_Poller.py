@@ -0,0 +1,286 @@
+import atexit
+from time import monotonic
+from datetime import datetime, timezone
+from threading import Condition, Lock, Thread
+from concurrent.futures import ThreadPoolExecutor
+
+# Local modules.
+from . import PostgreSQL_Interface as he6db
+
+
+class PeriodicTask:
+    """
+    One instrument read scheduled by an InstrumentPoller, with its timing
+    metrics.
+    """
+
+    def __init__(self, name, interval_s, read, table=None, columns=()):
+        """
+        ----------Parameters----------
+        name (str): Unique task name, e.g. "monitor".
+        interval_s (float): Time between reads.
+        read (callable): Takes no arguments and returns a row of values
+            for columns, or None if there is nothing to record this tick.
+        table (str): he6cres_runs table the rows go to. None for a task
+            that is only run for its side effects (e.g. keeping an
+            RGAClient's cache warm).
+        columns (tuple): Columns of table that read() fills. created_at is
+            added with the time the read started.
+        """
+        self.name = name
+        self.interval_s = interval_s
+        self.read = read
+        self.table = table
+        self.columns = tuple(columns)
+
+        self.next_due = monotonic() + interval_s
+        self.running = False
+
+        self.ticks = 0
+        self.errors = 0
+        self.skipped = 0
+        self.last_latency_s = None
+        self._last_start = None
+        self._interval_sum = 0.0
+        # Running mean and sum of squares of how late each tick started.
+        self._lateness_mean = 0.0
+        self._lateness_m2 = 0.0
+        self._last_lateness = 0.0
+
+    def record_start(self, now, lateness):
+        if self._last_start is not None:
+            self._interval_sum += now - self._last_start
+        self._last_start = now
+        self.ticks += 1
+        delta = lateness - self._lateness_mean
+        self._lateness_mean += delta / self.ticks
+        self._lateness_m2 += delta * (lateness - self._lateness_mean)
+        self._last_lateness = lateness
+
+    def metrics(self):
+        """
+        ------------Returns------------
+        metrics (dict): interval_s (set), mean_interval_s (measured between
+            tick starts), jitter_s (std of how late ticks start), drift_s
+            (how late the last tick started), last_latency_s (duration of
+            the last read), ticks, errors and skipped (ticks dropped because
+            the previous read was still running).
+        """
+        return {
+            "interval_s": self.interval_s,
+            "mean_interval_s": (
+                self._interval_sum / (self.ticks - 1) if self.ticks > 1 else None
+            ),
+            "jitter_s": (
+                (self._lateness_m2 / self.ticks) ** 0.5 if self.ticks else None
+            ),
+            "drift_s": self._last_lateness,
+            "last_latency_s": self.last_latency_s,
+            "ticks": self.ticks,
+            "errors": self.errors,
+            "skipped": self.skipped,
+        }
+
+
+class InstrumentPoller:
+    """
+    One scheduler thread for all periodic instrument reads (beta monitor,
+    NMR probe, RGA), replacing a threading.Timer per tick per instrument.
+
+    Reads run on a small worker pool so a slow instrument does not hold up
+    the others. Ticks are scheduled on a fixed grid (start + k * interval),
+    so timing errors do not accumulate; if a read is still running when its
+    next tick comes due, that tick is skipped and counted.
+
+    Rows are buffered per table and written every flush_interval_s with one
+    multi-row INSERT. Each row carries the time it was read as created_at
+    (timezone aware UTC, so it is stored correctly whatever the session
+    TimeZone), so buffering does not shift the timestamps. Keep
+    flush_interval_s well under the 60 s freshness checks in EnvParams.
+    Rows still buffered when the process exits are written by stop(),
+    which is registered with atexit while the scheduler runs.
+    """
+
+    def __init__(self, flush_interval_s=10, max_workers=4, max_buffered_rows=10000):
+        """
+        ----------Parameters----------
+        flush_interval_s (float): Time between batched inserts.
+        max_workers (int): Reads that can run at once.
+        max_buffered_rows (int): Rows kept per table while the database is
+            unreachable; the oldest are dropped beyond this.
+        """
+        self.flush_interval_s = flush_interval_s
+        self.max_buffered_rows = max_buffered_rows
+
+        self._tasks = {}
+        self._cond = Condition()
+        self._buffer_lock = Lock()
+        self._buffers = {}
+        self.max_workers = max_workers
+        self._pool = ThreadPoolExecutor(max_workers=max_workers)
+        self._thread = None
+        self._stopping = False
+
+        self.flushes = 0
+        self.rows_flushed = 0
+        self.last_flush_s = None
+
+    def add_task(self, name, interval_s, read, table=None, columns=()):
+        """
+        Schedule read every interval_s, replacing any task with the same
+        name. The first read happens one interval from now. Starts the
+        scheduler thread if it is not running. See PeriodicTask for the
+        arguments.
+        """
+        task = PeriodicTask(name, interval_s, read, table, columns)
+        with self._cond:
+            self._tasks[name] = task
+            if self._thread is None:
+                self._stopping = False
+                self._thread = Thread(target=self._run, daemon=True)
+                self._thread.start()
+                atexit.register(self.stop)
+            self._cond.notify()
+
+        return task
+
+    def remove_task(self, name):
+        """Stop scheduling task name. Its buffered rows are still written."""
+        with self._cond:
+            self._tasks.pop(name, None)
+            self._cond.notify()
+
+        return None
+
+    def metrics(self):
+        """Timing metrics per task, plus the flush counters under "flush"."""
+        with self._cond:
+            metrics = {name: task.metrics() for name, task in self._tasks.items()}
+        with self._buffer_lock:
+            pending = sum(len(rows) for _, rows in self._buffers.values())
+        metrics["flush"] = {
+            "flush_interval_s": self.flush_interval_s,
+            "flushes": self.flushes,
+            "rows_flushed": self.rows_flushed,
+            "rows_pending": pending,
+            "last_flush_s": self.last_flush_s,
+        }
+
+        return metrics
+
+    def _run(self):
+        next_flush = monotonic() + self.flush_interval_s
+        with self._cond:
+            while not self._stopping:
+                now = monotonic()
+                for task in self._tasks.values():
+                    if task.next_due <= now:
+                        self._launch(task, now)
+                if now >= next_flush:
+                    self._pool.submit(self.flush)
+                    next_flush += self.flush_interval_s * (
+                        1 + (now - next_flush) // self.flush_interval_s
+                    )
+
+                wake = min(
+                    [task.next_due for task in self._tasks.values()] + [next_flush]
+                )
+                self._cond.wait(max(0.0, wake - monotonic()))
+
+    def _launch(self, task, now):
+        lateness = now - task.next_due
+        # Stay on the task's grid: skip every tick that is already past.
+        missed = int(lateness // task.interval_s)
+        task.next_due += (missed + 1) * task.interval_s
+        task.skipped += missed
+        if task.running:
+            task.skipped += 1
+            return
+        task.record_start(now, lateness)
+        task.running = True
+        self._pool.submit(self._tick, task)
+
+    def _tick(self, task):
+        start = monotonic()
+        read_at = datetime.now(timezone.utc)
+        try:
+            row = task.read()
+            if row is not None and task.table is not None:
+                self._buffer(task, (read_at,) + tuple(row))
+
+        except Exception as error:
+            task.errors += 1
+            print("{} read error: {}".format(task.name, error))
+
+        finally:
+            task.last_latency_s = monotonic() - start
+            task.running = False
+
+    def _buffer(self, task, row):
+        with self._buffer_lock:
+            columns, rows = self._buffers.setdefault(
+                task.table, (("created_at",) + task.columns, [])
+            )
+            rows.append(row)
+            del rows[: -self.max_buffered_rows]
+
+    def flush(self):
+        """Write all buffered rows, one INSERT per table."""
+        start = monotonic()
+        with self._buffer_lock:
+            buffers, self._buffers = self._buffers, {}
+
+        for table, (columns, rows) in buffers.items():
+            if not rows:
+                continue
+            insert_statement = "INSERT INTO he6cres_runs.{} ({}) VALUES %s".format(
+                table, ", ".join(columns)
+            )
+            try:
+                with he6db.he6cres_db_session() as connection, connection.cursor() as cursor:
+                    he6db.execute_values(cursor, insert_statement, rows)
+
+            except Exception as error:
+                print("Error while connecting to he6cres_db", error)
+                # Put the rows back in front of anything read since.
+                with self._buffer_lock:
+                    _, newer = self._buffers.setdefault(table, (columns, []))
+                    newer[:0] = rows
+                    del newer[: -self.max_buffered_rows]
+                continue
+
+            self.rows_flushed += len(rows)
+            print("Inserted {} rows into he6cres_runs.{}.".format(len(rows), table))
+
+        self.flushes += 1
+        self.last_flush_s = monotonic() - start
+
+        return None
+
+    def stop(self):
+        """Stop the scheduler, let running reads finish and flush."""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join()
+            atexit.unregister(self.stop)
+        self._pool.shutdown(wait=True)
+        self._pool = ThreadPoolExecutor(max_workers=self.max_workers)
+        self.flush()
+
+        return None
+
+
+_default_poller = None
+_default_poller_lock = Lock()
+
+
+def default_poller():
+    """The process-wide InstrumentPoller shared by Monitor, NMR and the RGA."""
+    global _default_poller
+    with _default_poller_lock:
+        if _default_poller is None:
+            _default_poller = InstrumentPoller()
+        return _default_poller
@@ -4,12 +4,12 @@ import pandas as pd
 import socket
 import typing
 from typing import List
-from threading import Timer
 import requests
 import urllib.request
 
 # Local modules.
 from . import PostgreSQL_Interface as he6db
+from .Instrument_Poller import default_poller
 
 
 class Monitor:
@@ -18,21 +18,33 @@ class Monitor:
 
         self.monitor_rate = None
         self.interval_s = interval_s
-        self.monitor_thread = None
+        self.poller = None
+        # Keep-alive connection to the monitor's web page.
+        self.session = requests.Session()
 
         return None
 
-    def start(self): 
-
-        self.monitor_thread = RepeatedCall(self.interval_s, self.get_and_fill)
+    def start(self, poller=None):
+        """
+        Read the rate every interval_s on the shared InstrumentPoller (or
+        the one given), which batches the rows into he6cres_runs.monitor.
+        """
+        self.poller = poller if poller is not None else default_poller()
+        self.poller.add_task(
+            "monitor", self.interval_s, self.read, table="monitor", columns=("rate",)
+        )
         return None
 
-    def stop(self): 
+    def stop(self):
 
-        self.monitor_thread.stop()
+        self.poller.remove_task("monitor")
 
         return None
 
+    def read(self):
+        self.get_monitor_rate()
+        return (self.monitor_rate,)
+
     def get_and_fill(self): 
         self.get_monitor_rate()
         self.fill_monitor_table()
@@ -43,9 +55,8 @@ class Monitor:
         rate_url = "http://10.66.192.46"
 
         try:
-            response = requests.get(rate_url)
-            rate = float(response.text.split()[3])
-            response.close()
+            with self.session.get(rate_url, timeout=10) as response:
+                rate = float(response.text.split()[3])
 
         except Exception as error:
             print("Monitor error: ", error)
@@ -57,61 +68,19 @@ class Monitor:
 
     def fill_monitor_table(self):
 
-        connection = False
         try:
 
-            connection = he6db.he6cres_db_connection()
+            with he6db.he6cres_db_session() as connection, connection.cursor() as cursor:
 
-            # Create a cursor to perform database operations
-            cursor = connection.cursor()
-            print("\nConnected to he6cres_db.\n")
+                insert_statement = "INSERT INTO he6cres_runs.monitor (rate) Values (%s) RETURNING monitor_id"
 
-            insert_statement = "INSERT INTO he6cres_runs.monitor (rate) Values ({}) RETURNING monitor_id".format(
-                self.monitor_rate
-            )
-
-            cursor.execute(insert_statement)
-            connection.commit()
+                cursor.execute(insert_statement, (self.monitor_rate,))
+                monitor_id = cursor.fetchone()[0]
 
             print("Inserted rate into he6cres_runs.monitor.\n")
-            monitor_id = cursor.fetchone()[0]
-
             print("Assigned monitor_id:", monitor_id)
 
         except Exception as error:
             print("Error while connecting to he6cres_db", error)
 
-        finally:
-            if connection:
-                cursor.close()
-                connection.close()
-                print("\nConnection to he6cres_db closed.")
-
         return None
-
-
-
-class RepeatedCall(object):
-    def __init__(self, interval, function, *args, **kwargs):
-        self._timer     = None
-        self.interval   = interval
-        self.function   = function
-        self.args       = args
-        self.kwargs     = kwargs
-        self.is_running = False
-        self.start()
-
-    def _run(self):
-        self.is_running = False
-        self.start()
-        self.function(*self.args, **self.kwargs)
-
-    def start(self):
-        if not self.is_running:
-            self._timer = Timer(self.interval, self._run)
-            self._timer.start()
-            self.is_running = True
-
-    def stop(self):
-        self._timer.cancel()
-        self.is_running = False
\ No newline at end of file
@@ -4,12 +4,12 @@ import pandas as pd
 import socket
 import typing
 from typing import List
-from threading import Timer
 import requests
 import urllib.request
 
 # Local modules.
 from . import PostgreSQL_Interface as he6db
+from .Instrument_Poller import default_poller
 
 
 class NMR:
@@ -18,21 +18,33 @@ class NMR:
         self.field = None
         self.locked = None
         self.interval_s = interval_s
-        self.nmr_thread = None
+        self.poller = None
 
         return None
 
-    def start(self):
-
-        self.nmr_thread = RepeatedCall(self.interval_s, self.get_and_fill)
+    def start(self, poller=None):
+        """
+        Read the probe every interval_s on the shared InstrumentPoller (or
+        the one given), which batches the rows into he6cres_runs.nmr.
+        """
+        self.poller = poller if poller is not None else default_poller()
+        self.poller.add_task(
+            "nmr", self.interval_s, self.read, table="nmr", columns=("field", "locked")
+        )
         return None
 
     def stop(self):
 
-        self.nmr_thread.stop()
+        self.poller.remove_task("nmr")
 
         return None
 
+    def read(self):
+        self.get_nmr_field()
+        if self.field != None:
+            return (self.field, self.locked)
+        return None
+
     def get_and_fill(self):
         self.get_nmr_field()
         if self.field != None:
@@ -69,60 +81,19 @@ class NMR:
 
     def fill_nmr_table(self):
 
-        connection = False
         try:
 
-            connection = he6db.he6cres_db_connection()
-
-            # Create a cursor to perform database operations
-            cursor = connection.cursor()
-            print("\nConnected to he6cres_db.\n")
+            with he6db.he6cres_db_session() as connection, connection.cursor() as cursor:
 
-            insert_statement = "INSERT INTO he6cres_runs.nmr (field, locked) Values ({},{}) RETURNING nmr_id".format(
-                self.field, self.locked
-            )
+                insert_statement = "INSERT INTO he6cres_runs.nmr (field, locked) Values (%s,%s) RETURNING nmr_id"
 
-            cursor.execute(insert_statement)
-            connection.commit()
+                cursor.execute(insert_statement, (self.field, self.locked))
+                nmr_id = cursor.fetchone()[0]
 
             print("Inserted field and locked status into he6cres_runs.nmr.\n")
-            nmr_id = cursor.fetchone()[0]
-
             print("Assigned nmr_id:", nmr_id)
 
         except Exception as error:
             print("Error while connecting to he6cres_db", error)
 
-        finally:
-            if connection:
-                cursor.close()
-                connection.close()
-                print("\nConnection to he6cres_db closed.")
-
         return None
-
-
-class RepeatedCall(object):
-    def __init__(self, interval, function, *args, **kwargs):
-        self._timer = None
-        self.interval = interval
-        self.function = function
-        self.args = args
-        self.kwargs = kwargs
-        self.is_running = False
-        self.start()
-
-    def _run(self):
-        self.is_running = False
-        self.start()
-        self.function(*self.args, **self.kwargs)
-
-    def start(self):
-        if not self.is_running:
-            self._timer = Timer(self.interval, self._run)
-            self._timer.start()
-            self.is_running = True
-
-    def stop(self):
-        self._timer.cancel()
-        self.is_running = False
@@ -2,55 +2,459 @@ import pandas as pd
 import numpy as np
 import typing
 from typing import List
+import os
+import csv
+import gzip
+import json
+from time import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import BoundedSemaphore, Lock
+from contextlib import contextmanager
+from itertools import count
 import psycopg2
-from psycopg2.extensions import register_adapter, AsIs
-from datetime import datetime
+from psycopg2.extensions import register_adapter, AsIs, TRANSACTION_STATUS_IDLE
+from psycopg2.extras import execute_values
+from psycopg2.pool import ThreadedConnectionPool
+from datetime import datetime, timezone
 from pathlib import Path
+from weakref import WeakKeyDictionary
 
 
 psycopg2.extensions.register_adapter(np.int64, AsIs)
 
+HE6CRES_DB = {
+    "user": "postgres",
+    "password": "chirality",
+    "host": "10.66.192.47",
+    "port": "5432",
+    "database": "he6cres_db",
+}
+
 
 def he6cres_db_connection():
 
     # Connect to the he6cres_db
-    connection = psycopg2.connect(
-        user="postgres",
-        password="chirality",
-        host="10.66.192.47",
-        port="5432",
-        database="he6cres_db",
-    )
+    connection = psycopg2.connect(**HE6CRES_DB)
     return connection
 
 
-def he6cres_db_query(query: str) -> typing.Union[None, pd.DataFrame]:
-    connection = False
+class He6cresDBPool:
+    """
+    Process-wide pool of he6cres_db connections, shared by every helper in
+    this module (and through them by the monitor, NMR, EnvParams and the
+    GUI), so a query does not pay for a new TCP connection and login.
+
+    Borrowing blocks while all maxconn connections are in use. A connection
+    that has been idle for longer than health_check_s is pinged with
+    SELECT 1 before it is handed out, and one that is closed or fails the
+    ping is thrown away and replaced.
+    """
+
+    def __init__(self, minconn=1, maxconn=8, health_check_s=60):
+        """
+        ----------Parameters----------
+        minconn (int): Connections opened up front and kept open.
+        maxconn (int): Most connections open at once.
+        health_check_s (float): Idle time after which a connection is pinged
+            before reuse.
+        """
+        self.maxconn = maxconn
+        self.health_check_s = health_check_s
+        self._pool = ThreadedConnectionPool(minconn, maxconn, **HE6CRES_DB)
+        self._slots = BoundedSemaphore(maxconn)
+        # Keyed by the connection itself, so a closed and freed
+        # connection's entry cannot be picked up by a new one.
+        self._last_used = WeakKeyDictionary()
+
+    def _healthy(self, connection):
+        if connection.closed:
+            return False
+        if time() - self._last_used.get(connection, 0) < self.health_check_s:
+            return True
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            connection.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def getconn(self):
+        """Borrow a healthy connection; blocks if the pool is exhausted."""
+        self._slots.acquire()
+        try:
+            while True:
+                connection = self._pool.getconn()
+                if self._healthy(connection):
+                    return connection
+                self._last_used.pop(connection, None)
+                self._pool.putconn(connection, close=True)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def putconn(self, connection, close=False):
+        """Return a borrowed connection, closing it if it is no longer usable."""
+        close = (
+            close
+            or connection.closed
+            or connection.get_transaction_status() != TRANSACTION_STATUS_IDLE
+        )
+        if close:
+            self._last_used.pop(connection, None)
+        else:
+            self._last_used[connection] = time()
+        try:
+            self._pool.putconn(connection, close=close)
+        finally:
+            self._slots.release()
+
+    def closeall(self):
+        self._pool.closeall()
+        self._last_used.clear()
+
+
+_he6cres_db_pool = None
+_he6cres_db_pool_lock = Lock()
+_he6cres_db_pool_config = {"minconn": 1, "maxconn": 8, "health_check_s": 60}
+# Pools inherited from the parent by a forked child (e.g. a packet report
+# worker). The child must not use the parent's sockets, nor let them be
+# finalized: freeing a connection sends the server a terminate message and
+# would end the parent's session. So they are kept here and never closed.
+_inherited_db_pools = []
+
+
+def _reset_db_pool_in_child():
+    global _he6cres_db_pool, _he6cres_db_pool_lock
+    if _he6cres_db_pool is not None:
+        _inherited_db_pools.append(_he6cres_db_pool)
+    _he6cres_db_pool = None
+    # The lock may have been held by another thread at the fork.
+    _he6cres_db_pool_lock = Lock()
+
+
+os.register_at_fork(after_in_child=_reset_db_pool_in_child)
+
+
+def configure_he6cres_db_pool(minconn=1, maxconn=8, health_check_s=60):
+    """
+    Set the size and health-check interval of the shared pool. Any existing
+    pool is closed; the next query opens a new one with these settings.
+    """
+    global _he6cres_db_pool
+    with _he6cres_db_pool_lock:
+        _he6cres_db_pool_config.update(
+            minconn=minconn, maxconn=maxconn, health_check_s=health_check_s
+        )
+        if _he6cres_db_pool is not None:
+            _he6cres_db_pool.closeall()
+        _he6cres_db_pool = None
+
+    return None
+
+
+def he6cres_db_pool():
+    """The shared He6cresDBPool, created on first use."""
+    global _he6cres_db_pool
+    with _he6cres_db_pool_lock:
+        if _he6cres_db_pool is None:
+            _he6cres_db_pool = He6cresDBPool(**_he6cres_db_pool_config)
+        return _he6cres_db_pool
+
+
+@contextmanager
+def he6cres_db_session():
+    """
+    Borrow a connection from the shared pool for one transaction:
+
+        with he6cres_db_session() as connection:
+            with connection.cursor() as cursor:
+                cursor.execute(...)
+
+    Commits if the block finishes and rolls back if it raises (or, for a
+    generator, is closed early); the connection goes back to the pool
+    either way (or is discarded if the error left it unusable).
+    """
+    pool = he6cres_db_pool()
+    connection = pool.getconn()
+    broken = False
     try:
+        yield connection
+        connection.commit()
+    except BaseException as error:
+        broken = isinstance(error, (psycopg2.OperationalError, psycopg2.InterfaceError))
+        if not connection.closed:
+            try:
+                connection.rollback()
+            except psycopg2.Error:
+                broken = True
+        raise
+    finally:
+        pool.putconn(connection, close=broken)
 
-        connection = he6cres_db_connection()
 
-        # Create a cursor to perform database operations
-        cursor = connection.cursor()
+def he6cres_db_query(query: str) -> typing.Union[None, pd.DataFrame]:
+    try:
+
+        with he6cres_db_session() as connection:
+            # Create a cursor to perform database operations
+            with connection.cursor() as cursor:
 
-        # Execute a sql_command
-        cursor.execute(query)
-        cols = [desc[0] for desc in cursor.description]
-        query_result = pd.DataFrame(cursor.fetchall(), columns=cols)
+                # Execute a sql_command
+                cursor.execute(query)
+                cols = [desc[0] for desc in cursor.description]
+                query_result = pd.DataFrame(cursor.fetchall(), columns=cols)
 
     except Exception as error:
         print("Error while connecting to he6cres_db", error)
         query_result = None
 
-    finally:
-        if connection:
-            cursor.close()
-            connection.close()
-            #print("Connection to he6cres_db is closed")
-
     return query_result
 
 
+_stream_ids = count()
+
+# Arrow types for the PostgreSQL type oids we store, so every batch of a
+# stream gets the same schema even when a column is all NULL in one batch.
+# Any other type is written as text (see _arrow_values).
+_ARROW_TYPES = {
+    16: "bool_",
+    20: "int64",
+    21: "int16",
+    23: "int32",
+    700: "float32",
+    701: "float64",
+    1700: "float64",
+    25: "string",
+    1043: "string",
+    1082: "date32",
+    1114: "timestamp",
+    1184: "timestamp_utc",
+}
+
+
+# numpy kinds for the same oids (plus numeric). Every numeric and boolean
+# column is float64 with nan for NULL, so a column has the same dtype in
+# every batch whether or not that batch has NULLs in it (ids and counts
+# are exact up to 2**53).
+_NUMPY_KINDS = {
+    16: "float",
+    20: "float",
+    21: "float",
+    23: "float",
+    700: "float",
+    701: "float",
+    1700: "float",
+    1082: "date",
+    1114: "timestamp",
+    1184: "timestamp",
+}
+
+
+def _column_array(values: list, type_code: int) -> np.ndarray:
+    """
+    One column of a batch as a numpy array, with the dtype set by the
+    column's type oid (see _NUMPY_KINDS): float64 (nan for NULL),
+    datetime64[us] / datetime64[D] (NaT for NULL) or, for anything else
+    such as text, an object array.
+    """
+    kind = _NUMPY_KINDS.get(type_code)
+    if kind == "float":
+        return np.array(
+            [np.nan if v is None else float(v) for v in values], dtype=float
+        )
+    if kind == "timestamp":
+        return np.array(
+            [
+                np.datetime64("NaT")
+                if v is None
+                else np.datetime64(
+                    v.astimezone(timezone.utc).replace(tzinfo=None)
+                    if v.tzinfo is not None
+                    else v,
+                    "us",
+                )
+                for v in values
+            ],
+            dtype="datetime64[us]",
+        )
+    if kind == "date":
+        return np.array(
+            [np.datetime64("NaT") if v is None else np.datetime64(v, "D") for v in values],
+            dtype="datetime64[D]",
+        )
+    column = np.empty(len(values), dtype=object)
+    column[:] = values
+    return column
+
+
+def _fetch_batches(query: str, params, fetch_size: int):
+    """
+    Run query on a named (server-side) cursor. Yields cursor.description
+    first (also for an empty result), then lists of at most fetch_size rows.
+    """
+    with he6cres_db_session() as connection:
+        cursor_name = "he6cres_stream_{}_{}".format(os.getpid(), next(_stream_ids))
+        with connection.cursor(name=cursor_name) as cursor:
+            cursor.itersize = fetch_size
+            cursor.execute(query, params)
+            # A named cursor only has a description after its first fetch.
+            rows = cursor.fetchmany(fetch_size)
+            yield cursor.description
+            while rows:
+                yield rows
+                rows = cursor.fetchmany(fetch_size)
+
+
+def he6cres_db_stream(
+    query: str, params=None, fetch_size: int = 10000, arrow: bool = False
+):
+    """
+    Run query on a named (server-side) cursor and yield the result in
+    batches of at most fetch_size rows, so only one batch is ever held in
+    memory no matter how many rows the query returns.
+
+    ----------Parameters----------
+    query (str): SQL query, optionally with %s placeholders.
+    params (tuple): Values for the placeholders.
+    fetch_size (int): Rows per batch (and per round trip).
+    arrow (bool): Yield pyarrow.RecordBatch objects instead of dicts of
+        numpy arrays. Needs pyarrow.
+
+    ------------Yields------------
+    batch (dict or pyarrow.RecordBatch): {column name: numpy array}, or the
+        equivalent record batch. Column dtypes (or the arrow schema) come
+        from the column types, so they are the same in every batch.
+    """
+    if arrow:
+        import pyarrow as pa
+
+    batches = _fetch_batches(query, params, fetch_size)
+    description = next(batches)
+    if arrow:
+        schema = _arrow_schema(pa, description)
+    for rows in batches:
+        if arrow:
+            yield _arrow_batch(pa, schema, description, rows)
+        else:
+            yield {
+                desc[0]: _column_array([row[i] for row in rows], desc[1])
+                for i, desc in enumerate(description)
+            }
+
+
+def _arrow_values(values: list, type_code: int) -> list:
+    """
+    One column of a batch in the form pyarrow takes for its _ARROW_TYPES
+    type: numeric (Decimal) as float, and any unmapped type as text.
+    """
+    if type_code == 1700:
+        return [None if v is None else float(v) for v in values]
+    if type_code not in _ARROW_TYPES:
+        return [
+            None
+            if v is None
+            else json.dumps(v, default=str)
+            if isinstance(v, (dict, list))
+            else str(v)
+            for v in values
+        ]
+    return values
+
+
+def _arrow_schema(pa, description):
+    """
+    Arrow schema from the column type oids, with string for any type not
+    in _ARROW_TYPES, so it never depends on the values in a batch.
+    """
+    arrow_types = {
+        "bool_": pa.bool_(),
+        "int64": pa.int64(),
+        "int16": pa.int16(),
+        "int32": pa.int32(),
+        "float32": pa.float32(),
+        "float64": pa.float64(),
+        "string": pa.string(),
+        "date32": pa.date32(),
+        "timestamp": pa.timestamp("us"),
+        "timestamp_utc": pa.timestamp("us", tz="UTC"),
+    }
+    fields = []
+    for desc in description:
+        name = desc[0]
+        arrow_type = arrow_types[_ARROW_TYPES.get(desc[1], "string")]
+        fields.append(pa.field(name, arrow_type))
+
+    return pa.schema(fields)
+
+
+def _arrow_batch(pa, schema, description, rows):
+    """One batch of rows as a pyarrow.RecordBatch with the given schema."""
+    return pa.RecordBatch.from_pydict(
+        {
+            desc[0]: _arrow_values([row[i] for row in rows], desc[1])
+            for i, desc in enumerate(description)
+        },
+        schema=schema,
+    )
+
+
+def he6cres_db_to_csv(
+    query: str, csv_path, params=None, fetch_size: int = 10000
+) -> int:
+    """
+    Stream the result of query into a CSV file (header row, then one row
+    per result row, as DataFrame.to_csv(index=False)) one batch at a time.
+
+    ------------Returns------------
+    rows (int): Number of rows written.
+    """
+    rows = 0
+    batches = _fetch_batches(query, params, fetch_size)
+    description = next(batches)
+    columns = [desc[0] for desc in description]
+    with open(csv_path, "w", newline="") as csv_file:
+        writer = csv.writer(csv_file)
+        # Header first, so an empty result still gives a valid CSV.
+        writer.writerow(columns)
+        for batch in batches:
+            # Values are written as fetched (NULL as an empty field), so a
+            # column is formatted the same in every batch.
+            writer.writerows(
+                ["" if value is None else value for value in row] for row in batch
+            )
+            rows += len(batch)
+
+    return rows
+
+
+def he6cres_db_to_parquet(
+    query: str, parquet_path, params=None, fetch_size: int = 10000
+) -> int:
+    """
+    Stream the result of query into a Parquet file, one row group per
+    batch. Needs pyarrow.
+
+    ------------Returns------------
+    rows (int): Number of rows written.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    rows = 0
+    batches = _fetch_batches(query, params, fetch_size)
+    description = next(batches)
+    schema = _arrow_schema(pa, description)
+    # The schema comes from the column types, so an empty result still
+    # gives a valid file with no rows.
+    with pq.ParquetWriter(str(parquet_path), schema) as writer:
+        for batch in batches:
+            writer.write_batch(_arrow_batch(pa, schema, description, batch))
+            rows += len(batch)
+
+    return rows
+
+
 def format_udprx_output(udprx_output: str) -> List[dict]:
 
     # output = udprx_output.decode("utf-8").splitlines()
@@ -75,82 +479,105 @@ def format_udprx_output(udprx_output: str) -> List[dict]:
     return spec_file_list
 
 
-def fill_he6cres_db(env_parameters: dict, spec_file_list: List[dict]) -> None:
+# EnvParams attributes that are bookkeeping, not run_log columns.
+NOT_RUN_LOG_COLUMNS = ("slewing", "source_status", "rga_client")
+
+SPEC_FILE_COLUMNS = (
+    "file_in_acq",
+    "packets",
+    "file_size_mb",
+    "file_path",
+    "num_dropped_packets",
+    "frac_of_packets_dropped",
+    "num_gaps",
+    "neg_gaps",
+    "mean_gap",
+    "std_gap",
+    "max_gap",
+    "deleted",
+)
+
+
+def spec_file_row(run_id: int, spec_file_dict: dict) -> tuple:
+    """One he6cres_runs.spec_files row: run_id then SPEC_FILE_COLUMNS."""
+    return (
+        run_id,
+        int(spec_file_dict["file_in_acq"]),
+        int(spec_file_dict["packets"]),
+        int(spec_file_dict["file_size_mb"]),
+        spec_file_dict["file_path"],
+        int(spec_file_dict["num_dropped_packets"]),
+        spec_file_dict["frac_of_packets_dropped"],
+        spec_file_dict["num_gaps"],
+        spec_file_dict["neg_gaps"],
+        spec_file_dict["mean_gap"],
+        spec_file_dict["std_gap"],
+        spec_file_dict["max_gap"],
+        bool(spec_file_dict["deleted"]),
+    )
 
-    env_param_db = {k: v for k, v in env_parameters.items() if k != "slewing"}
 
-    connection = False
-    try:
+def fill_he6cres_db(
+    env_parameters: dict, spec_file_list: List[dict], page_size: int = 1000
+) -> typing.Union[None, List[int]]:
+    """
+    Insert a run into he6cres_runs.run_log and its files into
+    he6cres_runs.spec_files, all in one transaction: either the whole run
+    is registered or none of it is. The files go in with multi-row INSERTs
+    (execute_values), page_size rows per statement, so a large acquisition
+    costs a handful of round trips rather than one per file.
 
-        connection = he6cres_db_connection()
+    ------------Returns------------
+    spec_ids (list): The spec_id of each file, in file order, or None if
+        the insert failed (in which case nothing was written).
+    """
 
-        # Create a cursor to perform database operations
-        cursor = connection.cursor()
-        print("\nConnected to he6cres_db.\n")
+    env_param_db = {
+        k: v for k, v in env_parameters.items() if k not in NOT_RUN_LOG_COLUMNS
+    }
 
-        env_param_db["num_spec_acq"] = len(spec_file_list)
-        columns = env_param_db.keys()
-        values = env_param_db.values()
+    try:
 
-        insert_statement = (
-            "INSERT INTO he6cres_runs.run_log (%s) Values %s RETURNING run_id"
-        )
+        with he6cres_db_session() as connection, connection.cursor() as cursor:
 
-        query = cursor.mogrify(
-            insert_statement, (AsIs(",".join(columns)), tuple(values))
-        )
-        cursor.execute(query)
-        connection.commit()
+            env_param_db["num_spec_acq"] = len(spec_file_list)
+            columns = env_param_db.keys()
+            values = env_param_db.values()
 
-        print("Inserted env_parameters into he6cres_runs.run_log.\n")
-        run_id = cursor.fetchone()[0]
+            insert_statement = (
+                "INSERT INTO he6cres_runs.run_log (%s) Values %s RETURNING run_id"
+            )
 
-        print("Assigned run_id:", run_id)
+            query = cursor.mogrify(
+                insert_statement, (AsIs(",".join(columns)), tuple(values))
+            )
+            cursor.execute(query)
+            run_id = cursor.fetchone()[0]
 
-        for file_in_acq, spec_file_dict in enumerate(spec_file_list):
+            print("Assigned run_id:", run_id)
 
-            spec_file_dict["file_in_acq"] = file_in_acq
+            for file_in_acq, spec_file_dict in enumerate(spec_file_list):
+                spec_file_dict["file_in_acq"] = file_in_acq
 
             insert_statement = """INSERT INTO he6cres_runs.spec_files
-                                (run_id, 
-                                file_in_acq, 
-                                packets, 
-                                file_size_mb, 
-                                file_path,
-                                num_dropped_packets,
-                                frac_of_packets_dropped,
-                                num_gaps,
-                                neg_gaps,
-                                mean_gap,
-                                std_gap,
-                                max_gap, 
-                                deleted
-                                ) 
-                                Values (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s) RETURNING spec_id"""
+                                  (run_id, {})
+                                  VALUES %s RETURNING file_in_acq, spec_id""".format(
+                ", ".join(SPEC_FILE_COLUMNS)
+            )
 
-            query = cursor.mogrify(
+            returned = execute_values(
+                cursor,
                 insert_statement,
-                (
-                    run_id,
-                    int(spec_file_dict["file_in_acq"]),
-                    int(spec_file_dict["packets"]),
-                    int(spec_file_dict["file_size_mb"]),
-                    spec_file_dict["file_path"],
-                    int(spec_file_dict["num_dropped_packets"]),
-                    spec_file_dict["frac_of_packets_dropped"],
-                    spec_file_dict["num_gaps"],
-                    spec_file_dict["neg_gaps"],
-                    spec_file_dict["mean_gap"],
-                    spec_file_dict["std_gap"],
-                    spec_file_dict["max_gap"],
-                    bool(spec_file_dict["deleted"]),
-                ),
+                [spec_file_row(run_id, spec_file_dict) for spec_file_dict in spec_file_list],
+                page_size=page_size,
+                fetch=True,
             )
 
-            cursor.execute(query)
-            connection.commit()
-            print("file_in_acq: ", file_in_acq, "spec_id: ", cursor.fetchone()[0])
+        # RETURNING order is not guaranteed, so sort back into file order.
+        spec_ids = [spec_id for file_in_acq, spec_id in sorted(returned)]
 
+        print("Inserted env_parameters into he6cres_runs.run_log.\n")
+        print("spec_ids: ", spec_ids)
         print(
             "\nInserted {} files into he6cres_runs.spec_files.".format(
                 len(spec_file_list)
@@ -159,138 +586,278 @@ def fill_he6cres_db(env_parameters: dict, spec_file_list: List[dict]) -> None:
 
     except Exception as error:
         print("Error while connecting to he6cres_db", error)
-        query_result = None
-
-    finally:
-        if connection:
-            cursor.close()
-            connection.close()
-            print("\nConnection to he6cres_db closed.")
-
-    return None
-
+        spec_ids = None
+
+    return spec_ids
+
+
+PACKET_REPORT_COLUMNS = (
+    "num_dropped_packets",
+    "frac_of_packets_dropped",
+    "num_gaps",
+    "neg_gaps",
+    "mean_gap",
+    "std_gap",
+    "max_gap",
+)
+
+
+def write_packet_report_to_he6db(
+    spec_file_list: List[dict], page_size: int = 1000
+) -> None:
+    """
+    Write packet report results to he6cres_runs.spec_files, keyed on
+    spec_id. All rows are updated in one transaction with
+    UPDATE ... FROM (VALUES ...), page_size rows per statement, so
+    back-filling thousands of files costs a few round trips instead of an
+    UPDATE and a commit per file.
+    """
+
+    update_statement = """UPDATE he6cres_runs.spec_files AS s
+                          SET {}
+                          FROM (VALUES %s) AS v (spec_id, {})
+                          WHERE s.spec_id = v.spec_id""".format(
+        ", ".join("{0} = v.{0}".format(col) for col in PACKET_REPORT_COLUMNS),
+        ", ".join(PACKET_REPORT_COLUMNS),
+    )
 
-def write_packet_report_to_he6db(spec_file_list: List[dict]) -> None:
+    rows = [
+        (
+            int(spec_file_dict["spec_id"]),
+            int(spec_file_dict["num_dropped_packets"]),
+            spec_file_dict["frac_of_packets_dropped"],
+            spec_file_dict["num_gaps"],
+            spec_file_dict["neg_gaps"],
+            spec_file_dict["mean_gap"],
+            spec_file_dict["std_gap"],
+            spec_file_dict["max_gap"],
+        )
+        for spec_file_dict in spec_file_list
+    ]
 
-    connection = False
     try:
 
-        connection = he6cres_db_connection()
-
-        # Create a cursor to perform database operations
-        cursor = connection.cursor()
-        print("\nConnected to he6cres_db.\n")
-
-        total_files = len(spec_file_list)
-        for i, spec_file_dict in enumerate(spec_file_list):
-
-            print("Writing packet report to db for file {}/{}".format(i, total_files))
-
-            insert_statement = """UPDATE he6cres_runs.spec_files
-                                  SET 
-                                    num_dropped_packets = %s,
-                                    frac_of_packets_dropped = %s,
-                                    num_gaps = %s, 
-                                    neg_gaps = %s, 
-                                    mean_gap = %s, 
-                                    std_gap = %s, 
-                                    max_gap = %s
-                                  WHERE spec_id = %s """.format()
-
-            query = cursor.mogrify(
-                insert_statement,
-                (
-                    int(spec_file_dict["num_dropped_packets"]),
-                    spec_file_dict["frac_of_packets_dropped"],
-                    spec_file_dict["num_gaps"],
-                    spec_file_dict["neg_gaps"],
-                    spec_file_dict["mean_gap"],
-                    spec_file_dict["std_gap"],
-                    spec_file_dict["max_gap"],
-                    spec_file_dict["spec_id"],
-                ),
-            )
-            cursor.execute(query)
-            connection.commit()
+        with he6cres_db_session() as connection, connection.cursor() as cursor:
+            execute_values(cursor, update_statement, rows, page_size=page_size)
 
         print(
-            "\nInserted {} files into he6cres_runs.spec_files.".format(
+            "\nWrote packet reports for {} files to he6cres_runs.spec_files.".format(
                 len(spec_file_list)
             )
         )
 
     except Exception as error:
         print("Error while connecting to he6cres_db", error)
-        query_result = None
-
-    finally:
-        if connection:
-            cursor.close()
-            connection.close()
-            print("\nConnection to he6cres_db closed.")
 
     return None
 
 
 def mark_spec_files_as_deleted(run_id):
 
-    connection = False
     try:
 
-        connection = he6cres_db_connection()
-
-        # Create a cursor to perform database operations
-        cursor = connection.cursor()
-        print("\nConnected to he6cres_db.\n")
+        with he6cres_db_session() as connection, connection.cursor() as cursor:
 
-        insert_statement = """UPDATE he6cres_runs.spec_files
-                              SET 
-                                deleted = True
-                              WHERE run_id = {}""".format(
-            run_id
-        )
+            insert_statement = """UPDATE he6cres_runs.spec_files
+                                  SET 
+                                    deleted = True
+                                  WHERE run_id = %s"""
 
-        cursor.execute(insert_statement)
-        connection.commit()
+            cursor.execute(insert_statement, (run_id,))
 
     except Exception as error:
         print("Error while connecting to he6cres_db", error)
-        query_result = None
-
-    finally:
-        if connection:
-            cursor.close()
-            connection.close()
-            print("\nConnection to he6cres_db closed.")
 
     return None
 
 
-def backup_he6cres_run_tables(base_path, limit=1e6):
+BACKUP_TABLES = ("run_log", "spec_files", "monitor", "nmr")
 
-    today = datetime.today().strftime("%m-%d-%Y")
+# Newest created_at backed up per table, kept next to the backups.
+BACKUP_WATERMARKS = "he6cres_runs_db_backup_watermarks.json"
 
-    base_path = Path(base_path)
-    backup_dir_path = base_path / Path(f"he6cres_runs_db_backup_{today}")
-    backup_dir_path.mkdir()
+BACKUP_EXTENSIONS = {None: ".csv", "gzip": ".csv.gz", "zstd": ".csv.zst", "parquet": ".parquet"}
 
-    table_names = ["run_log", "spec_files", "monitor", "nmr"]
+# created_at is now() at the start of the inserting transaction, so a row
+# can commit with a created_at older than one already backed up. Incremental
+# backups only take rows older than this, which every transaction has
+# committed by, and leave newer ones for the next backup.
+BACKUP_SETTLE_TIME = "5 minutes"
 
-    for table_name in table_names:
 
-        csv_path = backup_dir_path / Path(f"{table_name}_{today}.csv")
+def _check_backup_compression(compression):
+    if compression not in BACKUP_EXTENSIONS:
+        raise ValueError(
+            "compression must be None, 'gzip', 'zstd' or 'parquet'. You input {}.".format(
+                compression
+            )
+        )
+
 
-        query = """SELECT *
-                   FROM he6cres_runs.{}
-                   ORDER BY created_at DESC
-                   LIMIT {}
-                """.format(
-            table_name, int(limit)
+@contextmanager
+def _open_backup_file(path, compression):
+    """Binary file object for a CSV backup, compressed as requested."""
+    if compression is None:
+        with open(path, "wb") as backup_file:
+            yield backup_file
+    elif compression == "gzip":
+        # Level 6 is several times faster than the default 9 for ~the same size.
+        with gzip.open(path, "wb", compresslevel=6) as backup_file:
+            yield backup_file
+    elif compression == "zstd":
+        import zstandard
+
+        with open(path, "wb") as raw_file:
+            with zstandard.ZstdCompressor(threads=-1).stream_writer(raw_file) as backup_file:
+                yield backup_file
+
+
+def backup_he6cres_table(
+    table_name, out_path, since=None, limit=None, compression="gzip", settle_time=None
+):
+    """
+    Back up one he6cres_runs table, streamed by the server with
+    COPY ... TO STDOUT straight into a (compressed) CSV file, or through a
+    server-side cursor into Parquet.
+
+    ----------Parameters----------
+    table_name (str): Table in the he6cres_runs schema.
+    out_path (Path): File to write.
+    since (str): Only rows with created_at after this (incremental backup).
+        Default None (all rows).
+    limit (int): Only the newest limit rows. Default None (no limit).
+    compression (str): None, "gzip", "zstd" or "parquet".
+    settle_time (str): Leave rows created in this last interval (e.g.
+        BACKUP_SETTLE_TIME) for the next backup, as they may still have
+        uncommitted neighbours. Default None (take every row).
+
+    ------------Returns------------
+    rows (int): Rows written.
+    newest (datetime): Newest created_at written, the next watermark, or
+        None if there were no rows.
+    """
+    _check_backup_compression(compression)
+
+    with he6cres_db_session() as connection, connection.cursor() as cursor:
+
+        # Fix the upper end first so rows inserted during the copy are left
+        # for the next incremental backup rather than half-included.
+        cursor.execute("SELECT now() - %s::interval", (settle_time or "0",))
+        settled = cursor.fetchone()[0]
+        if settle_time is not None:
+            print(
+                "{}: Leaving rows created after {} for the next backup.".format(
+                    table_name, settled
+                )
+            )
+
+        conditions = ["created_at <= %(settled)s"]
+        if since is not None:
+            conditions.append("created_at > %(since)s")
+        select_query = """SELECT *
+                          FROM he6cres_runs.{}
+                          WHERE {}
+                          ORDER BY created_at DESC""".format(
+            table_name, " AND ".join(conditions)
         )
+        if limit is not None:
+            select_query += " LIMIT {}".format(int(limit))
+        select_query = cursor.mogrify(
+            select_query, {"since": since, "settled": settled}
+        ).decode()
+
+        # The watermark is the newest row this backup actually writes.
+        cursor.execute("SELECT max(created_at) FROM ({}) AS copied".format(select_query))
+        newest = cursor.fetchone()[0]
+
+        if compression == "parquet":
+            rows = 0
+        else:
+            with _open_backup_file(out_path, compression) as backup_file:
+                cursor.copy_expert(
+                    "COPY ({}) TO STDOUT WITH (FORMAT csv, HEADER)".format(select_query),
+                    backup_file,
+                )
+            rows = cursor.rowcount
+
+    if compression == "parquet":
+        rows = he6cres_db_to_parquet(select_query, out_path)
+
+    return rows, newest
+
+
+def backup_he6cres_run_tables(
+    base_path, limit=1e6, compression="gzip", incremental=False, max_workers=None
+):
+    """
+    Back up the he6cres_runs tables, all at once, each on its own pooled
+    connection.
+
+    ----------Parameters----------
+    base_path (str): Directory the backup directory is made in. It also
+        holds the watermark file used by incremental backups.
+    limit (int): Newest rows per table in a full backup. Default 1e6.
+        Incremental backups take every row since the last backup.
+    compression (str): "gzip" (default), "zstd" (needs zstandard),
+        "parquet" (needs pyarrow) or None for plain CSV.
+    incremental (bool): Only back up rows created since the previous
+        backup of each table, up to BACKUP_SETTLE_TIME ago (newer rows are
+        left for the next one). Default False; a full backup takes every
+        row.
+    max_workers (int): Tables backed up at once. Default: all of them.
+
+    ------------Returns------------
+    rows (dict): Rows written per table (None for a table that failed).
+    """
+    _check_backup_compression(compression)
+
+    today = datetime.today().strftime("%m-%d-%Y")
 
-        table = he6cres_db_query(query)
+    base_path = Path(base_path)
+    if incremental:
+        now = datetime.today().strftime("%m-%d-%Y-%H-%M-%S")
+        backup_dir_path = base_path / Path(f"he6cres_runs_db_backup_{now}_incremental")
+    else:
+        backup_dir_path = base_path / Path(f"he6cres_runs_db_backup_{today}")
+    backup_dir_path.mkdir()
 
-        print(f"{table_name}: Writing {len(table)} rows.\n")
-        table.to_csv(csv_path, index=False)
+    watermark_path = base_path / BACKUP_WATERMARKS
+    watermarks = {}
+    if watermark_path.is_file():
+        watermarks = json.loads(watermark_path.read_text())
+
+    extension = BACKUP_EXTENSIONS[compression]
+    with ThreadPoolExecutor(max_workers=max_workers or len(BACKUP_TABLES)) as pool:
+        futures = {
+            table_name: pool.submit(
+                backup_he6cres_table,
+                table_name,
+                backup_dir_path / Path(f"{table_name}_{today}{extension}"),
+                watermarks.get(table_name) if incremental else None,
+                None if incremental else limit,
+                compression,
+                BACKUP_SETTLE_TIME if incremental else None,
+            )
+            for table_name in BACKUP_TABLES
+        }
 
-    return None
+    rows = {}
+    for table_name, future in futures.items():
+        try:
+            rows[table_name], newest = future.result()
+        except Exception as error:
+            print(f"{table_name}: Backup failed: {error}\n")
+            rows[table_name] = None
+            continue
+
+        print(f"{table_name}: Wrote {rows[table_name]} rows.\n")
+        if newest is not None:
+            watermarks[table_name] = newest.isoformat()
+
+    # Write the new watermarks atomically so a crash cannot leave a
+    # half-written file behind.
+    temp_path = watermark_path.with_suffix(".tmp")
+    temp_path.write_text(json.dumps(watermarks, indent=2))
+    os.replace(temp_path, watermark_path)
+
+    return rows
@@ -0,0 +1,129 @@
+from time import time
+from threading import Lock
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+
+# Local modules.
+from .Instrument_Poller import default_poller
+
+
+class RGAClient:
+    """
+    Client for the RGA flask app, which serves one species per URL
+    (e.g. http://10.95.100.45:5000/Helium -> "pressure x x time_since_write").
+
+    All species are requested in parallel over one keep-alive
+    requests.Session, so a poll costs one round trip on already open
+    connections. Readings are cached for ttl_s, so calls made within a few
+    seconds of each other do not go back to the instrument. A species that
+    fails only loses its own reading.
+    """
+
+    def __init__(
+        self,
+        rga_url="http://10.95.100.45:5000/",
+        timeout=10,
+        ttl_s=5,
+        max_age_s=60,
+        max_workers=10,
+    ):
+        """
+        ----------Parameters----------
+        rga_url (str): Base URL of the RGA flask app.
+        timeout (float): Per-request timeout in s.
+        ttl_s (float): How long a reading is reused before it is fetched
+            again.
+        max_age_s (float): Readings the RGA wrote longer ago than this are
+            reported as 0 (the RGA or flask app has probably stopped).
+        max_workers (int): Species fetched at once.
+        """
+        self.rga_url = rga_url
+        self.timeout = timeout
+        self.ttl_s = ttl_s
+        self.max_age_s = max_age_s
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        self.session.mount(rga_url, adapter)
+        self._pool = ThreadPoolExecutor(max_workers=max_workers)
+
+        self._cache = {}
+        self._cache_lock = Lock()
+        # Outcome of the last request per species: "ok", "stale", "cached"
+        # or "error: ...".
+        self.status = {}
+        self.poller = None
+
+    def fetch(self, species: str) -> float:
+        """Read one species from the RGA, bypassing the cache."""
+
+        # Grab output and split the string based on spaces.
+        with self.session.get(self.rga_url + species, timeout=self.timeout) as response:
+            rga_out = response.text.split()
+        time_since_write = float(rga_out[3])
+
+        # Verify the rga pressure is recent to within max_age_s
+        if time_since_write > self.max_age_s:
+            print(
+                "The rga pressure was last written over {}s ago. "
+                "Are the rga and rga flask app running?".format(self.max_age_s)
+            )
+            self.status[species] = "stale"
+            return 0
+
+        self.status[species] = "ok"
+        return float(rga_out[0])
+
+    def pressure(self, species: str) -> float:
+        """
+        Pressure of one species, from the cache if it is younger than ttl_s.
+        A failed request gives 0, as the RGA has always been logged.
+        """
+        with self._cache_lock:
+            cached = self._cache.get(species)
+        if cached is not None and time() - cached[1] < self.ttl_s:
+            self.status[species] = "cached"
+            return cached[0]
+
+        try:
+            pressure = self.fetch(species)
+        except Exception as error:
+            print("RGA error for {}: {}".format(species, error))
+            self.status[species] = "error: {}".format(error)
+            return 0
+
+        with self._cache_lock:
+            self._cache[species] = (pressure, time())
+
+        return pressure
+
+    def pressures(self, species_list) -> np.ndarray:
+        """Pressures of all species in species_list, fetched in parallel."""
+        return np.array(list(self._pool.map(self.pressure, species_list)))
+
+    def start(self, species_list, interval_s=5, poller=None):
+        """
+        Sample species_list every interval_s on the shared InstrumentPoller
+        (or the one given), so pressures() calls (e.g. from EnvParams.get)
+        are answered from a fresh cache instead of waiting on the RGA.
+        Nothing is written to the database.
+        """
+        self.poller = poller if poller is not None else default_poller()
+        species_list = list(species_list)
+
+        def sample():
+            self.pressures(species_list)
+            return None
+
+        self.poller.add_task("rga", interval_s, sample)
+        return None
+
+    def stop(self):
+        self.poller.remove_task("rga")
+        return None
+
+    def close(self):
+        self._pool.shutdown()
+        self.session.close()
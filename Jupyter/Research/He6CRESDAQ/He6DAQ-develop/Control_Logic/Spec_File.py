@@ -0,0 +1,231 @@
+import os
+import numpy as np
+
+SUMMARY_SUFFIX = ".summary.npz"
+
+
+class SpecFile:
+    """
+    Read-only, memory-mapped view of a .spec file.
+
+    Nothing is read when the file is opened; headers and payloads are
+    strided views into the mapping, so looking at a few thousand slices of
+    a GB-sized capture only pages in those slices.
+    """
+
+    BYTES_IN_HEADER = 32
+
+    # packet size and packets per spectrum for each supported bitcode
+    BYTES_IN_PACKET = {4096: 4128, 32768: 8224}
+    PACKETS_PER_SLICE = {4096: 1, 32768: 4}
+
+    def __init__(self, spec_path, freq_ch=None, bytes_in_packet=None):
+        """
+        ----------Parameters----------
+        spec_path (str): Path to the .spec file.
+        freq_ch (int): 4096 or 32768. Sets the packet size and packets per
+            slice.
+        bytes_in_packet (int): Packet size, for when only the buffer size is
+            known (as in Spec_Packet_Report). One of freq_ch or
+            bytes_in_packet must be given.
+        """
+        if freq_ch is None:
+            freq_ch = {v: k for k, v in self.BYTES_IN_PACKET.items()}.get(
+                bytes_in_packet
+            )
+        if freq_ch not in self.BYTES_IN_PACKET:
+            raise ValueError(
+                "SpecFile currently only works for freq_ch = 4096 or 32768."
+            )
+
+        self.spec_path = spec_path
+        self.freq_ch = freq_ch
+        self.bytes_in_packet = self.BYTES_IN_PACKET[freq_ch]
+        self.bytes_in_payload = self.bytes_in_packet - self.BYTES_IN_HEADER
+        self.packets_per_slice = self.PACKETS_PER_SLICE[freq_ch]
+
+        # A trailing partial packet (e.g. from an interrupted write) is ignored.
+        self.n_packets = os.path.getsize(spec_path) // self.bytes_in_packet
+        if self.n_packets:
+            self.packets = np.memmap(
+                spec_path,
+                dtype=np.uint8,
+                mode="r",
+                shape=(self.n_packets, self.bytes_in_packet),
+            )
+        else:
+            # np.memmap refuses to map an empty file.
+            self.packets = np.zeros((0, self.bytes_in_packet), dtype=np.uint8)
+
+    def __len__(self):
+        return self.n_packets
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def n_slices(self):
+        return self.n_packets // self.packets_per_slice
+
+    @property
+    def headers(self):
+        """(n_packets, 32) uint8 view of the packet headers."""
+        return self.packets[:, : self.BYTES_IN_HEADER]
+
+    @property
+    def payloads(self):
+        """(n_packets, bytes_in_payload) uint8 view of the packet payloads."""
+        return self.packets[:, self.BYTES_IN_HEADER :]
+
+    def packet_ids(self, start=0, stop=None):
+        """
+        Packet sequence numbers from header bytes 1-3, as int64, for packets
+        [start, stop).
+        """
+        header_data = self.packets[start:stop, 1:4].astype(np.int64)
+        return (
+            header_data[:, 0] * 2**16 + header_data[:, 1] * 2**8 + header_data[:, 2]
+        )
+
+    def slices(self, start=0, stop=None):
+        """
+        Payload view of the packets that make up slices [start, stop), i.e.
+        packets [start * packets_per_slice, stop * packets_per_slice).
+        """
+        if stop is None or stop < 0:
+            stop = self.n_slices
+        pps = self.packets_per_slice
+        return self.payloads[start * pps : stop * pps]
+
+    def chunk_index(self, start=0, stop=None):
+        """
+        Which quarter of the spectrum each packet in [start, stop) carries,
+        as uint8 0-3. This is the reserved_1 >> 56 nibble that
+        SpecFileEventWriter.output_to_spec reads, i.e. bits 5-6 of header
+        byte 24 (bit 7 is freq_not_time). Always 0 for 4096 channels.
+        """
+        if self.packets_per_slice == 1:
+            return np.zeros(len(self.packets[start:stop]), dtype=np.uint8)
+        return (self.packets[start:stop, 24] >> 5) & 0x3
+
+    def slice_starts(self, start_packet=0, n_slices=-1):
+        """
+        Packet indices of the first packet of each complete slice, i.e.
+        each run of packets whose chunk indices go 0, 1, ..., pps - 1.
+        Slices that lost a packet at a gap are skipped, and the first slice
+        is found wherever the file happens to start.
+
+        ----------Parameters----------
+        start_packet (int): Packet to start looking from.
+        n_slices (int): Stop after this many slices; -1 for the whole file.
+            Only as many headers as needed are read.
+
+        ------------Returns------------
+        starts (ndarray): int64 packet indices, increasing.
+        """
+        pps = self.packets_per_slice
+        if n_slices < 0:
+            n_slices = self.n_packets
+        if pps == 1:
+            return np.arange(
+                start_packet, min(start_packet + n_slices, self.n_packets)
+            )
+
+        starts = []
+        n_found = 0
+        begin = start_packet
+        while n_found < n_slices and begin + pps <= self.n_packets:
+            # Enough packets for the missing slices if there are no more
+            # gaps, plus the tail of a slice that straddles the window.
+            stop = min(begin + (n_slices - n_found) * pps + pps - 1, self.n_packets)
+            chunk = self.chunk_index(begin, stop)
+            complete = chunk[: len(chunk) - pps + 1] == 0
+            for i in range(1, pps):
+                complete &= chunk[i : len(chunk) - pps + 1 + i] == i
+            found = np.flatnonzero(complete)[: n_slices - n_found] + begin
+            starts.append(found)
+            n_found += len(found)
+            # No complete slice can start in the last pps - 1 packets.
+            begin = stop - pps + 1
+
+        if not starts:
+            return np.zeros(0, dtype=np.int64)
+        return np.concatenate(starts).astype(np.int64)
+
+    def spectra(self, start_packet=0, n_slices=-1):
+        """
+        Complete slices as a (slices, freq_ch) uint8 array, one spectrum
+        per row, using slice_starts to align and skip broken slices.
+
+        Where the slices are back to back in the file (the usual case),
+        the packets are reshaped to a (slices, pps, payload) view of the
+        mapping and copied out once; otherwise only the complete slices are
+        gathered. The result is a fresh, writable array either way.
+        """
+        return self.gather(self.slice_starts(start_packet, n_slices))
+
+    def iter_spectra(self, chunk_slices=4096, start_packet=0, n_slices=-1):
+        """
+        The same slices as spectra, as a sequence of (<= chunk_slices,
+        freq_ch) arrays, so a whole file can be walked in bounded memory.
+        """
+        starts = self.slice_starts(start_packet, n_slices)
+        for i in range(0, len(starts), chunk_slices):
+            yield self.gather(starts[i : i + chunk_slices])
+
+    def gather(self, starts):
+        """
+        (len(starts), freq_ch) spectra of the slices starting at starts, as
+        a fresh, writable array (never a view of the read-only mapping).
+        """
+        pps = self.packets_per_slice
+        n = len(starts)
+        if n == 0:
+            return np.zeros((0, self.freq_ch), dtype=np.uint8)
+
+        if starts[-1] - starts[0] == (n - 1) * pps:
+            first = starts[0]
+            payloads = np.array(self.payloads[first : first + n * pps])
+        else:
+            packet_index = (np.asarray(starts)[:, None] + np.arange(pps)).ravel()
+            # Fancy indexing already copies.
+            payloads = np.asarray(self.payloads[packet_index])
+
+        return payloads.reshape(n, self.freq_ch)
+
+    def close(self):
+        """
+        Drop this object's reference to the mapping. The file is unmapped
+        once any views handed out from it are gone as well.
+        """
+        self.packets = np.zeros((0, self.bytes_in_packet), dtype=np.uint8)
+
+
+def summary_path(spec_path):
+    """The summary sidecar path for spec_path: <spec_path>.summary.npz"""
+    return spec_path + SUMMARY_SUFFIX
+
+
+def load_summary(spec_path):
+    """
+    The summary written by Spec_Summary.write_summary for spec_path, as a
+    dict of arrays, or None if there is no sidecar or the .spec file has
+    changed since it was written (then the raw file has to be read).
+    """
+    try:
+        with np.load(summary_path(spec_path)) as npz:
+            summary = {key: npz[key] for key in npz.files}
+        spec_stat = os.stat(spec_path)
+    except (OSError, ValueError):
+        return None
+
+    if (
+        spec_stat.st_size != summary["spec_size"]
+        or spec_stat.st_mtime_ns != summary["spec_mtime_ns"]
+    ):
+        return None
+
+    return summary
@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+
+import ctypes
+import ctypes.util
+import fcntl
+import mmap
+import os
+from concurrent.futures import ThreadPoolExecutor
+from errno import EINVAL
+
+O_DIRECT = getattr(os, "O_DIRECT", 0)
+
+# O_DIRECT needs buffer address, file offset and length all aligned to the
+# device's logical block size; a page covers every disk we use.
+ALIGNMENT = mmap.PAGESIZE
+
+# sync_file_range(2) starts (or waits for) writeback of just a byte range,
+# so written pages can be made clean, and then actually dropped, without a
+# full fdatasync. Linux-only and not in the os module; where it is missing
+# buffered writes fall back to an fdatasync every FDATASYNC_BYTES.
+SYNC_FILE_RANGE_WAIT_BEFORE = 1
+SYNC_FILE_RANGE_WRITE = 2
+SYNC_FILE_RANGE_WAIT_AFTER = 4
+FDATASYNC_BYTES = 64*2**20
+
+try:
+    _libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    _sync_file_range = _libc.sync_file_range
+    _sync_file_range.argtypes = [ctypes.c_int, ctypes.c_int64,
+                                 ctypes.c_int64, ctypes.c_uint]
+    _sync_file_range.restype = ctypes.c_int
+except (OSError, AttributeError, TypeError):
+    _sync_file_range = None
+
+
+class SpecFileWriter:
+    """
+    Write raw packets to one .spec file in large chunks instead of one
+    write() per packet.
+
+    In buffered mode the data is handed to os.writev in chunk_bytes pieces.
+    Writeback of each piece is started right away with sync_file_range, and
+    the piece before it is waited on and then dropped from the page cache
+    with posix_fadvise(DONTNEED) (DONTNEED skips dirty pages, so they have
+    to be written first). At most two chunks are ever cached, so streaming
+    many GB to disk does not evict everything else. In direct mode
+    (O_DIRECT) the data is gathered into a page-aligned staging buffer and
+    written a full chunk at a time, bypassing the page cache; the unaligned
+    tail of the file is written after O_DIRECT is switched off. The bytes on
+    disk are identical in both modes.
+
+    If the final size is known up front, preallocate_bytes reserves it with
+    posix_fallocate so the file is laid out contiguously and no block
+    allocation happens mid-stream. A file that ends up shorter than planned
+    is truncated to what was actually written when it is closed.
+    """
+
+    def __init__(self, path, chunk_bytes=4*2**20, direct=False,
+                 drop_cache=True, preallocate_bytes=None):
+        """
+        ----------Parameters----------
+        path (str): File to create (truncated if it exists).
+        chunk_bytes (int): Bytes per write call. Rounded down to a multiple
+            of the page size. Default is 4 MiB.
+        direct (bool): Open with O_DIRECT. Falls back to buffered writes if
+            the platform or filesystem does not support it. Default False.
+        drop_cache (bool): Write back and drop written pages from the page
+            cache as the file is written. Default True.
+        preallocate_bytes (int): Expected final file size to reserve on
+            disk. Default None (no preallocation).
+        """
+        self.path = path
+        self.chunk_bytes = max(ALIGNMENT, chunk_bytes - chunk_bytes % ALIGNMENT)
+        self.drop_cache = drop_cache and hasattr(os, "posix_fadvise")
+        self.bytes_written = 0
+        self._staging = None
+        self._staged = 0
+        self.preallocated = 0
+        # Buffered bytes written but not yet dropped from the page cache.
+        self._dirty_start = 0
+        self._dirty_length = 0
+
+        flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC
+        self.direct = bool(direct and O_DIRECT)
+        if self.direct:
+            try:
+                self._fd = os.open(path, flags | O_DIRECT, 0o644)
+            except OSError as error:
+                if error.errno != EINVAL:
+                    raise
+                print("O_DIRECT not supported for {0}, "
+                      "using buffered writes".format(path))
+                self.direct = False
+        if not self.direct:
+            self._fd = os.open(path, flags, 0o644)
+        else:
+            # anonymous mmaps are page aligned, as O_DIRECT requires
+            self._staging = mmap.mmap(-1, self.chunk_bytes)
+
+        if preallocate_bytes:
+            self.preallocate(preallocate_bytes)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def preallocate(self, n_bytes):
+        """
+        Reserve n_bytes on disk for the file. Filesystems without fallocate
+        support just skip it.
+        """
+        try:
+            os.posix_fallocate(self._fd, 0, n_bytes)
+            self.preallocated = n_bytes
+        except (AttributeError, OSError) as error:
+            print("Could not preallocate {0}: {1}".format(self.path, error))
+
+    def _advise_written(self, start, length):
+        if self.drop_cache and length:
+            os.posix_fadvise(self._fd, start, length,
+                             os.POSIX_FADV_DONTNEED)
+
+    def _sync_range(self, start, length, flags):
+        if _sync_file_range(self._fd, start, length, flags) != 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), self.path)
+
+    def _drop_written(self, start, length):
+        """
+        Drop a buffered write of [start, start+length) from the page cache:
+        start its writeback now and wait for, then drop, the write before.
+        """
+        if not self.drop_cache:
+            return
+        if _sync_file_range is not None:
+            self._sync_range(start, length, SYNC_FILE_RANGE_WRITE)
+            if self._dirty_length:
+                self._sync_range(self._dirty_start, self._dirty_length,
+                                 SYNC_FILE_RANGE_WAIT_BEFORE
+                                 | SYNC_FILE_RANGE_WRITE
+                                 | SYNC_FILE_RANGE_WAIT_AFTER)
+                self._advise_written(self._dirty_start, self._dirty_length)
+            self._dirty_start, self._dirty_length = start, length
+            return
+
+        self._dirty_length += length
+        if self._dirty_length >= FDATASYNC_BYTES:
+            self._drop_dirty()
+
+    def _drop_dirty(self):
+        """Write back and drop everything _drop_written has not dropped yet."""
+        if self.drop_cache and self._dirty_length:
+            os.fdatasync(self._fd)
+            self._advise_written(self._dirty_start, self._dirty_length)
+        self._dirty_start += self._dirty_length
+        self._dirty_length = 0
+
+    def _write_all(self, buffers):
+        """os.writev that retries until every byte is written."""
+        views = [memoryview(b).cast("B") for b in buffers]
+        views = [v for v in views if v.nbytes]
+        while views:
+            n = os.writev(self._fd, views)
+            while n:
+                if n >= views[0].nbytes:
+                    n -= views[0].nbytes
+                    views.pop(0)
+                else:
+                    views[0] = views[0][n:]
+                    n = 0
+
+    def write(self, data):
+        """
+        Append data (bytes, memoryview or a C-contiguous ndarray of packets)
+        to the file.
+        """
+        mv = memoryview(data).cast("B")
+        if not self.direct:
+            for start in range(0, mv.nbytes, self.chunk_bytes):
+                piece = mv[start:start+self.chunk_bytes]
+                self._write_all([piece])
+                self._drop_written(self.bytes_written, piece.nbytes)
+                self.bytes_written += piece.nbytes
+            return
+
+        pos = 0
+        while pos < mv.nbytes:
+            n = min(self.chunk_bytes - self._staged, mv.nbytes - pos)
+            self._staging[self._staged:self._staged+n] = mv[pos:pos+n]
+            self._staged += n
+            pos += n
+            if self._staged == self.chunk_bytes:
+                self._flush_staging()
+
+    def _flush_staging(self):
+        """Write the staging buffer; only the final flush may be unaligned."""
+        staged = memoryview(self._staging)[:self._staged]
+        aligned = self._staged - self._staged % ALIGNMENT
+        if aligned:
+            self._write_all([staged[:aligned]])
+        if aligned < self._staged:
+            flags = fcntl.fcntl(self._fd, fcntl.F_GETFL)
+            fcntl.fcntl(self._fd, fcntl.F_SETFL, flags & ~O_DIRECT)
+            self._write_all([staged[aligned:]])
+        self._advise_written(self.bytes_written, self._staged)
+        self.bytes_written += self._staged
+        self._staged = 0
+
+    def close(self):
+        """
+        Write anything still staged, trim any unused preallocated space
+        and close the file.
+        """
+        if self._fd is None:
+            return
+        try:
+            if self._staged:
+                self._flush_staging()
+            self._drop_dirty()
+            if self.preallocated > self.bytes_written:
+                os.ftruncate(self._fd, self.bytes_written)
+        finally:
+            os.close(self._fd)
+            self._fd = None
+            if self._staging is not None:
+                self._staging.close()
+
+
+class SpecFileSequence:
+    """
+    Hand out SpecFileWriters for a known series of paths, one after the
+    other. While one file is being written the next is already opened (and
+    preallocated) on a background thread, and finished files are closed on
+    that same thread, so moving on to the next file does not stall the
+    thread that is writing data.
+    """
+
+    def __init__(self, paths, **writer_kwargs):
+        """
+        ----------Parameters----------
+        paths (iterable): Output file paths, in the order they will be used.
+        writer_kwargs: Passed on to every SpecFileWriter.
+        """
+        self._paths = iter(paths)
+        self._writer_kwargs = writer_kwargs
+        self._pool = ThreadPoolExecutor(max_workers=1)
+        self._closing = []
+        self._next = self._open_next()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _open_next(self):
+        path = next(self._paths, None)
+        if path is None:
+            return None
+        return self._pool.submit(SpecFileWriter, path, **self._writer_kwargs)
+
+    def next_writer(self):
+        """
+        Return the writer for the next path (normally already open) and
+        start opening the one after it. Returns None when the paths run out.
+        """
+        if self._next is None:
+            return None
+        writer = self._next.result()
+        self._next = self._open_next()
+        return writer
+
+    def retire(self, writer):
+        """Close a finished writer in the background."""
+        self._closing.append(self._pool.submit(writer.close))
+
+    def close(self):
+        """
+        Wait for all background closes. A file that was opened ahead but
+        never used is removed again.
+        """
+        try:
+            if self._next is not None:
+                unused = self._next.result()
+                unused.close()
+                os.remove(unused.path)
+                self._next = None
+            for closing in self._closing:
+                closing.result()
+        finally:
+            self._pool.shutdown()
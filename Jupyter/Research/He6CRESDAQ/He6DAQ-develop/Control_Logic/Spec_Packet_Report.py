@@ -2,37 +2,120 @@
 # * Don't put "list" in the name of a list. Change this.
 
 import numpy as np
-import matplotlib
-
-matplotlib.use("TkAgg")
-import matplotlib.pyplot as plt
+import os
 import typing
 from typing import List
 import pathlib
+from time import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
 
 # Local modules.
 from . import PostgreSQL_Interface as he6db
+from .Spec_File import SpecFile, load_summary
 
 
 def packetIDs(spec_path, BUFFERSIZE):
-    dtype = np.dtype("B")
     try:
-        with open(spec_path, "rb") as f:
-            numpy_data = np.fromfile(f, dtype)
-        # Parse spec file
-        packet_num = int(numpy_data.size / BUFFERSIZE)
-        numpy_data.shape = (packet_num, BUFFERSIZE)
-        header_data = numpy_data[:, 0:4]
-        packetID = header_data[:, 1] * 2**16 + header_data[:, 2] * 2**8 + header_data[:, 3]
-        
+        # Memory-map the spec file; only the 3 header bytes per packet that
+        # hold the packet ID are touched.
+        packetID = SpecFile(spec_path, bytes_in_packet=BUFFERSIZE).packet_ids()
+
     except IOError:
         print("Error While Opening the file!")
-        packetID = None
+        return None
 
     return packetID.astype(int)
 
 
-def gap_report(spec_path, BUFFERSIZE, no_report):
+class GapTracker:
+    """
+    Running gap statistics over a stream of packet IDs.
+
+    IDs can be fed in any number of chunks; the last ID of one chunk is
+    carried over to the next, so the result is the same as for the whole
+    array at once. Only counts and integer sums are kept, so memory does not
+    depend on how many packets are seen.
+
+    With a modulus (e.g. 2**20 for the 20-bit pkt_in_batch counter) the IDs
+    are treated as a wrapping counter: steps are taken modulo modulus and
+    read as negative in its upper half, so a wrap is not counted as a gap
+    but a repeated or reordered packet still counts as a negative one.
+    """
+
+    def __init__(self, modulus=None):
+        """
+        ----------Parameters----------
+        modulus (int): Period of the packet counter, if it wraps. Default
+            None (IDs do not wrap, as for the 24-bit IDs in packetIDs).
+        """
+        self.modulus = modulus
+        self.packets = 0
+        self.neg_gaps = 0
+        self.num_gaps = 0
+        self.max_gap = 0
+        # sum and sum of squares of the positive gaps, as exact ints
+        self.gap_sum = 0
+        self.gap_sum_sq = 0
+        self._last_id = None
+
+    def update(self, packet_ids):
+        """Add the next chunk of packet IDs (1D int array)."""
+        packet_ids = np.asarray(packet_ids, dtype=np.int64)
+        if len(packet_ids) == 0:
+            return
+        if self._last_id is not None:
+            gaps = np.diff(packet_ids, prepend=self._last_id) - 1
+        else:
+            gaps = np.diff(packet_ids) - 1
+        if self.modulus:
+            half = self.modulus // 2
+            gaps = (gaps + 1 + half) % self.modulus - half - 1
+        self.packets += len(packet_ids)
+        self._last_id = int(packet_ids[-1])
+
+        self.neg_gaps += int(np.count_nonzero(gaps < 0))
+        gaps = gaps[gaps > 0]
+        if len(gaps):
+            self.num_gaps += len(gaps)
+            self.gap_sum += int(gaps.sum())
+            self.gap_sum_sq += int((gaps * gaps).sum())
+            self.max_gap = max(self.max_gap, int(gaps.max()))
+
+    @property
+    def num_dropped_packets(self):
+        return self.gap_sum
+
+    def report(self):
+        """
+        ------------Returns------------
+        The same 8-tuple as gap_report: packets, num_dropped_packets,
+        frac_of_packets_dropped, num_gaps, neg_gaps, mean_gap, std_gap,
+        max_gap. mean_gap and std_gap are over the nonzero gaps only.
+        """
+        if self.num_gaps == 0:
+            mean_gap = 0
+            std_gap = 0
+        else:
+            n = self.num_gaps
+            mean_gap = self.gap_sum / n
+            std_gap = float(np.sqrt((n * self.gap_sum_sq - self.gap_sum**2) / n**2))
+        frac_of_packets_dropped = (
+            self.gap_sum / self.packets if self.packets else 0
+        )
+        return (
+            self.packets,
+            self.gap_sum,
+            frac_of_packets_dropped,
+            self.num_gaps,
+            self.neg_gaps,
+            mean_gap,
+            std_gap,
+            self.max_gap,
+        )
+
+
+def gap_report(spec_path, BUFFERSIZE, no_report, chunk_packets=2**18):
 
     # Current convention:
     # -1 = No report run.
@@ -40,64 +123,151 @@ def gap_report(spec_path, BUFFERSIZE, no_report):
 
     if no_report:
         print("\nno_report = True")
-        packets = -1
-        num_dropped_packets = -1
-        frac_of_packets_dropped = -1
-        num_gaps = -1
-        neg_gaps = -1
-        mean_gap = -1
-        std_gap = -1
-        max_gap = -1
+        return (-1,) * 8
+
+    # The summary sidecar (Spec_Summary.write_summary), if it is up to
+    # date, already has the report.
+    summary = load_summary(spec_path)
+    if summary is not None:
+        report = summary["gap_report"]
+        return tuple(
+            float(value) if i in (2, 5, 6) else int(value)
+            for i, value in enumerate(report)
+        )
 
-    else:
+    try:
+        spec_file = SpecFile(spec_path, bytes_in_packet=BUFFERSIZE)
+    except IOError:
+        print("Error While Opening the file!")
+        return (-2,) * 8
 
-        packetID = packetIDs(spec_path, BUFFERSIZE)
+    # Walk the header bytes in bounded chunks so memory use does not grow
+    # with the file size.
+    tracker = GapTracker()
+    with spec_file:
+        for start in range(0, len(spec_file), chunk_packets):
+            tracker.update(spec_file.packet_ids(start, start + chunk_packets))
 
-        if packetID is None:
+    return tracker.report()
 
-            packets = -2
-            num_dropped_packets = -2
-            frac_of_packets_dropped = -2
-            num_gaps = -2
-            neg_gaps = -2
-            mean_gap = -2
-            std_gap = -2
-            max_gap = -2
 
-        else:
-            packets = len(packetID)
-            gaps = (packetID[1:] - packetID[:-1]) - 1
-            neg_gaps = np.count_nonzero(gaps < 0)
-            gaps[gaps < 0] = 0
-            num_gaps = np.count_nonzero(gaps)
-            num_dropped_packets = gaps.sum()
-            frac_of_packets_dropped = num_dropped_packets / packets
-            if num_gaps == 0:
-                mean_gap = 0
-                std_gap = 0
-            else:
-                mean_gap = gaps[gaps > 0].mean()
-                std_gap = gaps[gaps > 0].std()
-
-            max_gap = gaps.max()
-
-    return (
-        packets,
-        num_dropped_packets,
-        frac_of_packets_dropped,
-        num_gaps,
-        neg_gaps,
-        mean_gap,
-        std_gap,
-        max_gap,
+def mount_point(path):
+    """The mount point (i.e. the disk) that path lives on."""
+    path = os.path.realpath(path)
+    while not os.path.ismount(path):
+        path = os.path.dirname(path)
+    return path
+
+
+def disk_groups(spec_paths, workers_per_disk=1):
+    """
+    Split the indices of spec_paths into per-worker groups: files are
+    grouped by the disk (mount point) they are on and each disk's files are
+    dealt out to workers_per_disk workers, keeping their order.
+
+    ------------Returns------------
+    groups (list): Lists of indices into spec_paths, one per worker.
+    n_disks (int): Number of distinct disks.
+    """
+    disks = {}
+    for i, spec_path in enumerate(spec_paths):
+        disk = mount_point(os.path.dirname(spec_path) or ".")
+        disks.setdefault(disk, []).append(i)
+
+    groups = []
+    for file_indices in disks.values():
+        for worker in range(workers_per_disk):
+            group = file_indices[worker::workers_per_disk]
+            if group:
+                groups.append(group)
+
+    return groups, len(disks)
+
+
+def _gap_reports(spec_paths, BUFFERSIZE):
+    """Run gap_report over spec_paths in order. Runs in a worker process."""
+    return [gap_report(spec_path, BUFFERSIZE, False) for spec_path in spec_paths]
+
+
+def parallel_gap_reports(spec_paths, BUFFERSIZE, workers_per_disk=1, pool=None):
+    """
+    Run gap_report over many files in a process pool.
+
+    Files are grouped by the disk (mount point) they are on, and each disk
+    gets workers_per_disk workers, each reading its share of that disk's
+    files in order. All disks are read at once, but no disk is asked for
+    more streams than it was given workers.
+
+    ----------Parameters----------
+    spec_paths (list): Paths of the .spec files.
+    BUFFERSIZE (int): Bytes per packet (4128 or 8224).
+    workers_per_disk (int): Processes per disk. Default is 1, which keeps
+        reads sequential on spinning disks; SSDs can take a few more.
+    pool (ProcessPoolExecutor): Pool to run in, so a caller reporting
+        many batches of files starts its workers once. Default None (a
+        pool of one worker per disk share, for this call only). Each share
+        is one task, so a larger pool still reads a disk only as many
+        streams at a time as it was given workers.
+
+    ------------Returns------------
+    reports (list): One gap_report tuple per path, in the order of
+        spec_paths.
+    MB_per_s (float): Aggregate read rate over all disks.
+    """
+    start = time()
+    groups, n_disks = disk_groups(spec_paths, workers_per_disk)
+
+    reports = [None] * len(spec_paths)
+    if pool is None:
+        pool_context = ProcessPoolExecutor(max_workers=max(1, len(groups)))
+    else:
+        pool_context = nullcontext(pool)
+    with pool_context as pool:
+        futures = [
+            (group, pool.submit(_gap_reports, [spec_paths[i] for i in group], BUFFERSIZE))
+            for group in groups
+        ]
+        for group, future in futures:
+            for i, report in zip(group, future.result()):
+                reports[i] = report
+
+    read_mb = (
+        sum(os.path.getsize(path) for path in spec_paths if os.path.isfile(path))
+        / 1e6
+    )
+    elapsed = time() - start
+    MB_per_s = read_mb / elapsed if elapsed > 0 else 0
+
+    print(
+        "\nPacket report: {} files on {} disks, {:.0f} MB in {:.1f} s ({:.0f} MB/s).".format(
+            len(spec_paths), n_disks, read_mb, elapsed, MB_per_s
+        )
     )
 
+    return reports, MB_per_s
 
-def packet_report(spec_file_list, BUFFERSIZE, no_report, delete_imperfect_files):
 
-    for file_in_acq, spec_dict in enumerate(spec_file_list):
+def packet_report(
+    spec_file_list,
+    BUFFERSIZE,
+    no_report,
+    delete_imperfect_files,
+    workers_per_disk=1,
+    pool=None,
+):
+
+    if no_report:
+        reports = [gap_report(None, BUFFERSIZE, True) for _ in spec_file_list]
+    else:
+        reports, _ = parallel_gap_reports(
+            [spec_dict["file_path"] for spec_dict in spec_file_list],
+            BUFFERSIZE,
+            workers_per_disk,
+            pool,
+        )
+
+    for file_in_acq, (spec_dict, report) in enumerate(zip(spec_file_list, reports)):
 
-        spec_path = spec_dict["file_path"]
         (
             packets,
             num_dropped_packets,
@@ -107,7 +277,7 @@ def packet_report(spec_file_list, BUFFERSIZE, no_report, delete_imperfect_files)
             mean_gap,
             std_gap,
             max_gap,
-        ) = gap_report(spec_path, BUFFERSIZE, no_report)
+        ) = report
 
         print("\nGap Report for file_in_acq: {} ".format(file_in_acq))
         print("packets: ", packets)
@@ -138,7 +308,9 @@ def packet_report(spec_file_list, BUFFERSIZE, no_report, delete_imperfect_files)
 #     return [item for sublist in t for item in sublist]
 
 
-def run_packet_report(run_ids: list, freq_ch: int = 4096) -> None:
+def run_packet_report(
+    run_ids: list, freq_ch: int = 4096, workers_per_disk: int = 1
+) -> None:
 
     if freq_ch == 4096:
         BUFFERSIZE = 4128
@@ -149,8 +321,9 @@ def run_packet_report(run_ids: list, freq_ch: int = 4096) -> None:
             "freq_ch must currently be 4096 or 32768. You input {}.".format(freq_ch)
         )
 
-    spec_lists = []
-    spec_ids = []
+    # Collect the files of every run first, so a single process pool reads
+    # all of them and no disk sits idle waiting for the next run_id.
+    spec_lists = {}
     for run_id in run_ids:
 
         query_spec = """SELECT * FROM he6cres_runs.spec_files
@@ -187,10 +360,21 @@ def run_packet_report(run_ids: list, freq_ch: int = 4096) -> None:
 
             spec_list.append(spec_dict)
 
-        # Run packet report:
-        spec_list = packet_report(spec_list, BUFFERSIZE, False, delete_imperfect_files)
+        spec_lists[run_id] = spec_list
+
+    # Run packet report on all runs' files at once (the dicts are filled in
+    # place):
+    packet_report(
+        [spec_dict for spec_list in spec_lists.values() for spec_dict in spec_list],
+        BUFFERSIZE,
+        False,
+        False,
+        workers_per_disk,
+    )
 
-        he6db.write_packet_report_to_he6db(spec_list)
+    for spec_list in spec_lists.values():
+        if spec_list:
+            he6db.write_packet_report_to_he6db(spec_list)
 
     return None
 
@@ -0,0 +1,340 @@
+import os
+import json
+import shutil
+import numpy as np
+
+# Local modules.
+from .Spec_File import SpecFile, load_summary
+from .Spec_Stats import CHUNK_BYTES
+from .Spec_Summary import write_summary
+
+PYRAMID_SUFFIX = ".pyramid"
+
+# dtype each pooled spectrogram is stored as.
+PYRAMID_KINDS = {"max": np.uint8, "snr": np.float16}
+
+
+def pyramid_dir(spec_path):
+    """The pyramid directory for spec_path: <spec_path>.pyramid"""
+    return spec_path + PYRAMID_SUFFIX
+
+
+def _write_rows(tiles, r0, rows):
+    """Write rows r0, r0 + 1, ... of a level into its (tile row, tile col, t, f) array."""
+    tile_t, tile_f = tiles.shape[2:]
+    r = 0
+    while r < len(rows):
+        tile_row, offset = divmod(r0 + r, tile_t)
+        n = min(tile_t - offset, len(rows) - r)
+        tiles[tile_row, :, offset : offset + n, :] = (
+            rows[r : r + n].reshape(n, -1, tile_f).transpose(1, 0, 2)
+        )
+        r += n
+
+
+def spec_snr(spectra, noise_floor):
+    """
+    The SNR of every pixel of a (slices, bins) spectrogram: its value over
+    its bin's noise floor, as float32. Bins with a zero floor (which only
+    ever hold zeros) get SNR 0.
+    """
+    noise_floor = np.asarray(noise_floor, dtype=np.float32)
+    snr = np.zeros(spectra.shape, dtype=np.float32)
+    np.divide(spectra, noise_floor, out=snr, where=noise_floor > 0)
+    return snr
+
+
+def round_down_float16(snr):
+    """
+    snr as float16, rounded toward -inf rather than to nearest, so that
+    snr >= cut is unchanged for any cut float16 holds exactly (e.g. whole
+    numbers up to 2048).
+    """
+    rounded = snr.astype(np.float16)
+    return np.where(
+        rounded > snr, np.nextafter(rounded, np.float16(-np.inf)), rounded
+    )
+
+
+def pool_max(spectra, t_factor, f_factor):
+    """
+    Max-pool a (slices, bins) array by t_factor in time and f_factor in
+    frequency. A trailing partial block in time is pooled on its own; bins
+    must divide by f_factor.
+    """
+    n, bins = spectra.shape
+    n_full = n - n % t_factor
+    blocks = [spectra[:n_full].reshape(n_full // t_factor, t_factor, bins)]
+    if n_full < n:
+        blocks.append(spectra[n_full:].reshape(1, n - n_full, bins))
+
+    return np.concatenate(
+        [
+            block.reshape(len(block), block.shape[1], bins // f_factor, f_factor).max(
+                axis=(1, 3)
+            )
+            for block in blocks
+        ]
+    )
+
+
+def build_pyramid(spec_path, freq_ch, first_level=2, tile=256):
+    """
+    Build the tiled spectrogram pyramid of a .spec file.
+
+    Level k is the spectrogram pooled over 2**k slices by 2**k bins, kept
+    as two max-pooled arrays: the values (uint8, so a single-bin track
+    stays visible when zoomed out) and the SNR (float16, rounded down), i.e.
+    the largest value / noise floor of any pixel in the block, worked out
+    at full resolution. Thresholding a level's SNR at a cut therefore lights the
+    same blocks as thresholding the full-resolution spectrogram and then
+    pooling it, at every zoom. Levels go from first_level up to the first
+    one that fits in a single tile; level 0 is the .spec file itself, read
+    through SpecFile. With first_level = 2 the pyramid is about a quarter of
+    the size of the .spec file.
+
+    The noise floor and slice starts come from the file's summary sidecar
+    (Spec_Summary.write_summary), which is written first if it is missing
+    or out of date, so the pyramid itself takes one pass over the file.
+
+    Every level is stored as a .npy of shape (tile rows, tile cols, tile,
+    tile), so each tile is contiguous on disk and SpecPyramid reads only
+    the tiles a viewport covers.
+
+    ----------Parameters----------
+    spec_path (str): Path to the .spec file.
+    freq_ch (int): 4096 or 32768.
+    first_level (int): Finest stored level.
+    tile (int): Tile edge in pixels.
+
+    ------------Returns------------
+    path (str): The pyramid directory.
+    """
+    summary = load_summary(spec_path)
+    if summary is None:
+        write_summary(spec_path, freq_ch)
+        summary = load_summary(spec_path)
+    noise_floor = summary["mean"]
+    starts = summary["slice_starts"]
+    n_slices = len(starts)
+
+    top_level = first_level
+    while (
+        max(-(-n_slices >> top_level), freq_ch >> top_level) > tile
+        and freq_ch >> (top_level + 1)
+    ):
+        top_level += 1
+    levels = range(first_level, top_level + 1)
+
+    path = pyramid_dir(spec_path)
+    tmp_path = path + ".tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    tiles = {}
+    for level in levels:
+        rows = -(-n_slices >> level)
+        bins = freq_ch >> level
+        tile_f = min(tile, bins)
+        for kind, dtype in PYRAMID_KINDS.items():
+            tiles[kind, level] = np.lib.format.open_memmap(
+                os.path.join(tmp_path, "{}_{}.npy".format(kind, level)),
+                mode="w+",
+                dtype=dtype,
+                shape=(max(1, -(-rows // tile)), bins // tile_f, tile, tile_f),
+            )
+
+    # Chunks are whole multiples of the top level's block, so no block at
+    # any level is split between chunks.
+    block = 2**top_level
+    chunk_slices = block * max(1, CHUNK_BYTES // freq_ch // block)
+
+    with SpecFile(spec_path, freq_ch) as spec_file:
+        for i in range(0, n_slices, chunk_slices):
+            spectra = spec_file.gather(starts[i : i + chunk_slices])
+            level_max = pool_max(spectra, 2**first_level, 2**first_level)
+            level_snr = round_down_float16(
+                pool_max(spec_snr(spectra, noise_floor), 2**first_level, 2**first_level)
+            )
+            for level in levels:
+                if level > first_level:
+                    level_max = pool_max(level_max, 2, 2)
+                    level_snr = pool_max(level_snr, 2, 2)
+                r0 = i >> level
+                _write_rows(tiles["max", level], r0, level_max)
+                _write_rows(tiles["snr", level], r0, level_snr)
+
+    for array in tiles.values():
+        array.flush()
+    del tiles
+
+    meta = {
+        "freq_ch": freq_ch,
+        "n_slices": n_slices,
+        "first_level": first_level,
+        "top_level": top_level,
+        "tile": tile,
+        "spec_size": os.path.getsize(spec_path),
+        "spec_mtime_ns": os.stat(spec_path).st_mtime_ns,
+    }
+    with open(os.path.join(tmp_path, "meta.json"), "w") as meta_file:
+        json.dump(meta, meta_file)
+
+    # Swap in the finished pyramid, so a reader never sees half of one.
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp_path, path)
+
+    return path
+
+
+class SpecPyramid:
+    """
+    Reader for the pyramid written by build_pyramid. Levels are memory
+    mapped, so opening one reads nothing and a viewport costs only the
+    tiles it covers. Level 0 is read from the .spec file.
+
+    Coordinates are (slice, bin) of the full-resolution spectrogram,
+    counting complete slices only (see SpecFile.slice_starts).
+    """
+
+    def __init__(self, spec_path):
+        """
+        ----------Parameters----------
+        spec_path (str): Path to the .spec file. Raises OSError if it has
+            no pyramid or summary, or either is older than the file; see
+            open_pyramid.
+        """
+        path = pyramid_dir(spec_path)
+        with open(os.path.join(path, "meta.json")) as meta_file:
+            meta = json.load(meta_file)
+
+        spec_stat = os.stat(spec_path)
+        if (
+            spec_stat.st_size != meta["spec_size"]
+            or spec_stat.st_mtime_ns != meta["spec_mtime_ns"]
+        ):
+            raise OSError("The pyramid of {} is out of date.".format(spec_path))
+        summary = load_summary(spec_path)
+        if summary is None:
+            raise OSError("The summary of {} is missing or out of date.".format(spec_path))
+
+        self.spec_path = spec_path
+        self.freq_ch = meta["freq_ch"]
+        self.n_slices = meta["n_slices"]
+        self.first_level = meta["first_level"]
+        self.top_level = meta["top_level"]
+        self.tile = meta["tile"]
+
+        self.noise_floor = summary["mean"]
+        self._starts = summary["slice_starts"]
+        self._tiles = {
+            (kind, level): np.load(
+                os.path.join(path, "{}_{}.npy".format(kind, level)), mmap_mode="r"
+            )
+            for kind in PYRAMID_KINDS
+            for level in self.levels[1:]
+        }
+        self._spec_file = None
+
+    @property
+    def levels(self):
+        """Readable levels: 0 (the .spec file) and the stored ones."""
+        return [0] + list(range(self.first_level, self.top_level + 1))
+
+    def shape(self, level):
+        """(slices, bins) of the spectrogram at level."""
+        return -(-self.n_slices >> level), self.freq_ch >> level
+
+    def packet_slice(self, packet):
+        """The (complete) slice holding packet, or the one before it."""
+        return max(0, int(np.searchsorted(self._starts, packet, side="right")) - 1)
+
+    def read(self, level, t0, t1, f0, f1, kind="max"):
+        """
+        Rows [t0, t1) and bins [f0, f1) of level, in that level's
+        coordinates (clipped to its shape), reading only the tiles they
+        fall in.
+
+        ------------Returns------------
+        spectrogram (ndarray): (rows, bins), uint8 for max, float16 for
+            snr (float32 at level 0).
+        """
+        rows, bins = self.shape(level)
+        t0, t1 = max(0, t0), min(rows, t1)
+        f0, f1 = max(0, f0), min(bins, f1)
+        if t1 <= t0 or f1 <= f0:
+            return np.zeros((0, 0), dtype=PYRAMID_KINDS[kind])
+
+        if level == 0:
+            if self._spec_file is None:
+                self._spec_file = SpecFile(self.spec_path, self.freq_ch)
+            spectra = self._spec_file.gather(self._starts[t0:t1])[:, f0:f1]
+            if kind == "snr":
+                return spec_snr(spectra, self.noise_floor[f0:f1])
+            return spectra
+
+        tiles = self._tiles[kind, level]
+        tile_t, tile_f = tiles.shape[2:]
+        tr0, tr1 = t0 // tile_t, -(-t1 // tile_t)
+        tf0, tf1 = f0 // tile_f, -(-f1 // tile_f)
+        block = tiles[tr0:tr1, tf0:tf1]
+        block = block.transpose(0, 2, 1, 3).reshape(
+            (tr1 - tr0) * tile_t, (tf1 - tf0) * tile_f
+        )
+        return np.array(
+            block[t0 - tr0 * tile_t : t1 - tr0 * tile_t, f0 - tf0 * tile_f : f1 - tf0 * tile_f]
+        )
+
+    def choose_level(self, t_span, f_span, pixels=(1000, 1000)):
+        """
+        The finest level at which a t_span by f_span viewport fits in
+        pixels (width, height), so a viewport never reads more than about
+        that many pixels, however far it is zoomed in along one axis.
+        Below first_level that is level 0, the raw file, at most 2 x 2
+        pixels per screen pixel.
+        """
+        scale = max(t_span / pixels[0], f_span / pixels[1])
+        level = int(np.ceil(np.log2(scale))) if scale > 1 else 0
+        if level < self.first_level:
+            return 0
+        return min(level, self.top_level)
+
+    def viewport(self, t0, t1, f0, f1, pixels=(1000, 1000), kind="max"):
+        """
+        The spectrogram over slices [t0, t1) and bins [f0, f1) (full
+        resolution coordinates) at the level choose_level picks.
+
+        ------------Returns------------
+        spectrogram (ndarray): (rows, bins) at that level.
+        level (int): Each pixel covers 2**level slices and bins.
+        origin (tuple): (slice, bin) of the first pixel, for placing the
+            image.
+        """
+        level = self.choose_level(t1 - t0, f1 - f0, pixels)
+        lt0, lf0 = int(t0) >> level, int(f0) >> level
+        spectrogram = self.read(
+            level, lt0, -(-int(t1) >> level), lf0, -(-int(f1) >> level), kind
+        )
+        return spectrogram, level, (lt0 << level, lf0 << level)
+
+    def close(self):
+        self._tiles = {}
+        if self._spec_file is not None:
+            self._spec_file.close()
+            self._spec_file = None
+
+
+def open_pyramid(spec_path, freq_ch=None):
+    """
+    The SpecPyramid of spec_path. If there is none or it is out of date,
+    build it first when freq_ch is given, else return None.
+    """
+    try:
+        return SpecPyramid(spec_path)
+    except (OSError, ValueError, KeyError):
+        if freq_ch is None:
+            return None
+
+    print("Building the spectrogram pyramid of {}.".format(spec_path))
+    build_pyramid(spec_path, freq_ch)
+    return SpecPyramid(spec_path)
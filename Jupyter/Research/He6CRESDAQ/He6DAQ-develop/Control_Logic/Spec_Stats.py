@@ -0,0 +1,194 @@
+import os
+from time import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+# Local modules.
+from .Spec_File import SpecFile
+from .Spec_Packet_Report import disk_groups
+
+# Bytes of spectra per chunk. The float64 temporaries in SpecStats.update
+# are 8x this.
+CHUNK_BYTES = 2**24
+
+
+class SpecStats:
+    """
+    Running per-bin statistics of a spectrogram: count, mean, variance,
+    min and max, and optionally a histogram of the 256 possible uint8
+    values per bin for exact percentiles.
+
+    Chunks of spectra are folded in with update() and accumulators built
+    on separate chunks, files or processes are combined with merge()
+    (Chan et al.'s parallel form of Welford's algorithm), so the result
+    does not depend on how the data was split and memory does not depend
+    on how many slices are seen.
+    """
+
+    def __init__(self, freq_ch, histogram=True):
+        """
+        ----------Parameters----------
+        freq_ch (int): Number of frequency bins.
+        histogram (bool): Keep per-bin value counts for percentiles()
+            (256 uint32 counts per bin, 32 MB for 32768 bins).
+        """
+        self.freq_ch = freq_ch
+        self.n = 0
+        self.mean = np.zeros(freq_ch)
+        self._m2 = np.zeros(freq_ch)
+        self.min = np.full(freq_ch, 255, dtype=np.uint8)
+        self.max = np.zeros(freq_ch, dtype=np.uint8)
+        self.hist = np.zeros((freq_ch, 256), dtype=np.uint32) if histogram else None
+
+    def update(self, spectra):
+        """Add a (slices, freq_ch) uint8 chunk of spectra."""
+        n_b = len(spectra)
+        if n_b == 0:
+            return
+        chunk_mean = spectra.mean(axis=0)
+        chunk_m2 = ((spectra - chunk_mean) ** 2).sum(axis=0)
+        self._combine(n_b, chunk_mean, chunk_m2)
+
+        np.minimum(self.min, spectra.min(axis=0), out=self.min)
+        np.maximum(self.max, spectra.max(axis=0), out=self.max)
+        if self.hist is not None:
+            # One bincount over (bin, value) pairs fills every histogram.
+            index = np.arange(self.freq_ch, dtype=np.int32) * 256 + spectra
+            self.hist += np.bincount(
+                index.ravel(), minlength=self.freq_ch * 256
+            ).reshape(self.freq_ch, 256).astype(np.uint32)
+
+    def merge(self, other):
+        """Fold in another SpecStats (e.g. from another file or worker)."""
+        if other.n == 0:
+            return self
+        self._combine(other.n, other.mean, other._m2)
+        np.minimum(self.min, other.min, out=self.min)
+        np.maximum(self.max, other.max, out=self.max)
+        if self.hist is not None and other.hist is not None:
+            self.hist += other.hist
+        else:
+            self.hist = None
+
+        return self
+
+    def _combine(self, n_b, mean_b, m2_b):
+        n_a = self.n
+        n = n_a + n_b
+        delta = mean_b - self.mean
+        self.mean = self.mean + delta * (n_b / n)
+        self._m2 = self._m2 + m2_b + delta**2 * (n_a * n_b / n)
+        self.n = n
+
+    @property
+    def var(self):
+        """Population variance per bin."""
+        return self._m2 / self.n if self.n else np.full(self.freq_ch, np.nan)
+
+    @property
+    def std(self):
+        return np.sqrt(self.var)
+
+    def percentiles(self, q):
+        """
+        Exact per-bin percentiles from the histograms: the smallest value
+        with at least q percent of the slices at or below it (numpy's
+        "inverted_cdf" method).
+
+        ----------Parameters----------
+        q (float or list): Percentile(s) in [0, 100].
+
+        ------------Returns------------
+        values (ndarray): (freq_ch,) uint8, or (len(q), freq_ch) for a list.
+        """
+        if self.hist is None:
+            raise ValueError("SpecStats was built without histograms.")
+        cdf = np.cumsum(self.hist, axis=1, dtype=np.int64)
+        q = np.asarray(q, dtype=float)
+        ranks = np.maximum(np.ceil(q / 100 * self.n), 1).astype(np.int64)
+        values = np.stack(
+            [(cdf < rank).sum(axis=1) for rank in np.atleast_1d(ranks)]
+        ).astype(np.uint8)
+
+        return values if q.ndim else values[0]
+
+
+def spec_file_stats(
+    spec_path, freq_ch, n_slices=-1, chunk_slices=None, histogram=True
+):
+    """
+    SpecStats of the complete slices of one .spec file, read chunk_slices
+    at a time.
+
+    ----------Parameters----------
+    spec_path (str): Path to the .spec file.
+    freq_ch (int): 4096 or 32768.
+    n_slices (int): Only the first n_slices slices; -1 for the whole file.
+    chunk_slices (int): Slices held in memory at once. Default is
+        CHUNK_BYTES worth (512 slices for 32768 bins).
+    histogram (bool): Keep histograms for percentiles.
+    """
+    if chunk_slices is None:
+        chunk_slices = max(1, CHUNK_BYTES // freq_ch)
+
+    stats = SpecStats(freq_ch, histogram)
+    with SpecFile(spec_path, freq_ch) as spec_file:
+        for spectra in spec_file.iter_spectra(chunk_slices, n_slices=n_slices):
+            stats.update(spectra)
+
+    return stats
+
+
+def _spec_files_stats(spec_paths, freq_ch, chunk_slices, histogram):
+    """Merged SpecStats of spec_paths. Runs in a worker process."""
+    stats = SpecStats(freq_ch, histogram)
+    for spec_path in spec_paths:
+        stats.merge(spec_file_stats(spec_path, freq_ch, -1, chunk_slices, histogram))
+    return stats
+
+
+def parallel_spec_stats(
+    spec_paths, freq_ch, workers_per_disk=1, chunk_slices=None, histogram=True
+):
+    """
+    SpecStats over every slice of many .spec files (e.g. all files of a
+    run), computed in a process pool laid out like parallel_gap_reports:
+    workers_per_disk processes per disk, each merging its own files, and
+    the per-worker results merged at the end.
+
+    ------------Returns------------
+    stats (SpecStats): Statistics over all files.
+    MB_per_s (float): Aggregate read rate over all disks.
+    """
+    start = time()
+    groups, n_disks = disk_groups(spec_paths, workers_per_disk)
+
+    stats = SpecStats(freq_ch, histogram)
+    with ProcessPoolExecutor(max_workers=max(1, len(groups))) as pool:
+        futures = [
+            pool.submit(
+                _spec_files_stats,
+                [spec_paths[i] for i in group],
+                freq_ch,
+                chunk_slices,
+                histogram,
+            )
+            for group in groups
+        ]
+        for future in futures:
+            stats.merge(future.result())
+
+    read_mb = (
+        sum(os.path.getsize(path) for path in spec_paths if os.path.isfile(path))
+        / 1e6
+    )
+    elapsed = time() - start
+    MB_per_s = read_mb / elapsed if elapsed > 0 else 0
+
+    print(
+        "\nSpec stats: {} files on {} disks, {} slices, {:.0f} MB in {:.1f} s ({:.0f} MB/s).".format(
+            len(spec_paths), n_disks, stats.n, read_mb, elapsed, MB_per_s
+        )
+    )
+
+    return stats, MB_per_s
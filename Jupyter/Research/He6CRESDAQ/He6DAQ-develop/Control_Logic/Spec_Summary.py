@@ -0,0 +1,129 @@
+import os
+from time import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+# Local modules.
+from .Spec_File import SpecFile, summary_path, load_summary
+from .Spec_Stats import SpecStats, CHUNK_BYTES
+from .Spec_Packet_Report import GapTracker, disk_groups
+
+# Percentiles kept in the summary, from SpecStats' histograms.
+SUMMARY_PERCENTILES = (5, 50, 95)
+
+
+def write_summary(spec_path, freq_ch):
+    """
+    Write the summary sidecar of a .spec file, reading the file once.
+
+    The sidecar is an .npz next to the file holding:
+    * mean, std, min, max and SUMMARY_PERCENTILES per bin (SpecStats),
+    * packet_ids (the 24-bit header IDs) and slice_starts (first packet of
+      each complete slice), so slices can be found without the headers,
+    * gap_report, the same 8-tuple as Spec_Packet_Report.gap_report,
+    * the size and mtime of the .spec file, to tell when it is stale.
+
+    The zoomable spectrogram is kept apart, in the file's pyramid
+    (Spec_Pyramid.build_pyramid), which uses the mean here as its noise
+    floor.
+
+    ----------Parameters----------
+    spec_path (str): Path to the .spec file.
+    freq_ch (int): 4096 or 32768.
+
+    ------------Returns------------
+    path (str): Path of the sidecar.
+    """
+    spec_file = SpecFile(spec_path, freq_ch)
+    with spec_file:
+        starts = spec_file.slice_starts()
+        n_slices = len(starts)
+        chunk_slices = max(1, CHUNK_BYTES // freq_ch)
+
+        stats = SpecStats(freq_ch)
+        for i in range(0, n_slices, chunk_slices):
+            stats.update(spec_file.gather(starts[i : i + chunk_slices]))
+
+        packet_ids = spec_file.packet_ids()
+        tracker = GapTracker()
+        tracker.update(packet_ids)
+
+    summary = {
+        "freq_ch": freq_ch,
+        "n_slices": n_slices,
+        "mean": stats.mean,
+        "std": stats.std,
+        "min": stats.min,
+        "max": stats.max,
+        "percentiles": np.array(SUMMARY_PERCENTILES),
+        "percentile_values": stats.percentiles(list(SUMMARY_PERCENTILES)),
+        "packet_ids": packet_ids.astype(np.int32),
+        "slice_starts": starts,
+        "gap_report": np.array(tracker.report(), dtype=float),
+        "spec_size": os.path.getsize(spec_path),
+        "spec_mtime_ns": os.stat(spec_path).st_mtime_ns,
+    }
+
+    # Write then rename, so a reader never sees half a sidecar.
+    path = summary_path(spec_path)
+    tmp_path = path + ".tmp.npz"
+    np.savez_compressed(tmp_path, **summary)
+    os.replace(tmp_path, path)
+
+    return path
+
+
+def _write_summaries(spec_paths, freq_ch, pyramids=False):
+    """
+    write_summary (then build_pyramid, if pyramids) over spec_paths in
+    order. Runs in a worker process.
+    """
+    # Spec_Pyramid imports this module.
+    from .Spec_Pyramid import build_pyramid
+
+    paths = []
+    for spec_path in spec_paths:
+        try:
+            paths.append(write_summary(spec_path, freq_ch))
+            if pyramids:
+                build_pyramid(spec_path, freq_ch)
+        except OSError as error:
+            print("Could not summarize {}: {}".format(spec_path, error))
+            paths.append(None)
+    return paths
+
+
+def write_summaries(spec_paths, freq_ch, workers_per_disk=1, pyramids=False):
+    """
+    Write the sidecar of many .spec files in a process pool, laid out per
+    disk as in parallel_gap_reports. With pyramids, also build each file's
+    spectrogram pyramid (Spec_Pyramid.build_pyramid) from its new sidecar.
+
+    ------------Returns------------
+    paths (list): Sidecar path per spec path (None where it failed).
+    """
+    start = time()
+    groups, n_disks = disk_groups(spec_paths, workers_per_disk)
+
+    paths = [None] * len(spec_paths)
+    with ProcessPoolExecutor(max_workers=max(1, len(groups))) as pool:
+        futures = [
+            (
+                group,
+                pool.submit(
+                    _write_summaries, [spec_paths[i] for i in group], freq_ch, pyramids
+                ),
+            )
+            for group in groups
+        ]
+        for group, future in futures:
+            for i, path in zip(group, future.result()):
+                paths[i] = path
+
+    print(
+        "\nWrote {} summaries on {} disks in {:.1f} s.".format(
+            sum(path is not None for path in paths), n_disks, time() - start
+        )
+    )
+
+    return paths
@@ -0,0 +1,112 @@
+from datetime import timezone
+import numpy as np
+
+from .PostgreSQL_Interface import he6cres_db_session
+
+
+def utc_seconds(created_at):
+    """
+    Seconds since the epoch for a created_at value. Naive timestamps are
+    taken to be UTC, as the GUI has always done.
+    """
+    if created_at is None:
+        return np.nan
+    if created_at.tzinfo is None:
+        created_at = created_at.replace(tzinfo=timezone.utc)
+    return created_at.timestamp()
+
+
+class TableFeed:
+    """
+    Incremental reader for one of the he6cres_runs time-series tables
+    (monitor, nmr, run_log).
+
+    The feed remembers the last id it has seen and each poll() asks only
+    for newer rows, which go into fixed-capacity ring buffers. The cost of
+    a poll therefore depends on how many rows arrived since the last one,
+    not on how much history is being plotted.
+
+    Each buffer is twice the capacity long and every value is stored at
+    i and i + capacity, so the newest rows in time order are always one
+    contiguous slice: values() hands out views, never copies.
+    """
+
+    def __init__(self, table, id_col, columns, capacity=100):
+        """
+        ----------Parameters----------
+        table (str): Table in the he6cres_runs schema, e.g. "monitor".
+        id_col (str): Its increasing primary key, e.g. "monitor_id".
+        columns (list): Numeric (or boolean) columns to keep. created_at is
+            always read and kept as "UTC_time" in seconds.
+        capacity (int): Rows kept in the buffers (the plot's history).
+        """
+        self.table = table
+        self.id_col = id_col
+        self.columns = list(columns)
+        self.set_capacity(capacity)
+
+    def set_capacity(self, capacity):
+        """Resize the buffers. They start empty; the next poll refills them."""
+        self.capacity = int(capacity)
+        self.last_id = None
+        self.n = 0
+        self._write = 0
+        self._buffers = {
+            col: np.full(2 * self.capacity, np.nan)
+            for col in [self.id_col, "UTC_time"] + self.columns
+        }
+
+    def __len__(self):
+        return self.n
+
+    def poll(self):
+        """
+        Fetch rows newer than the last one seen (the newest capacity rows
+        on the first call) and append them.
+
+        ------------Returns------------
+        new_rows (int): How many rows were added; 0 means the buffers are
+            unchanged and nothing needs replotting.
+        """
+        query = """SELECT {id_col}, created_at, {columns}
+                   FROM he6cres_runs.{table}
+                   WHERE {id_col} > %s
+                   ORDER BY {id_col} DESC LIMIT %s""".format(
+            id_col=self.id_col, columns=", ".join(self.columns), table=self.table
+        )
+        last_id = -1 if self.last_id is None else self.last_id
+
+        with he6cres_db_session() as connection, connection.cursor() as cursor:
+            cursor.execute(query, (last_id, self.capacity))
+            rows = cursor.fetchall()
+
+        # Newest first from the query; append oldest first.
+        for row in reversed(rows):
+            self._append(row)
+        if rows:
+            self.last_id = rows[0][0]
+
+        return len(rows)
+
+    def _append(self, row):
+        values = [row[0], utc_seconds(row[1])] + [
+            np.nan if value is None else float(value) for value in row[2:]
+        ]
+        i = self._write
+        for col, value in zip(self._buffers, values):
+            buffer = self._buffers[col]
+            buffer[i] = value
+            buffer[i + self.capacity] = value
+        self._write = (i + 1) % self.capacity
+        self.n = min(self.n + 1, self.capacity)
+
+    def values(self, col):
+        """The buffered values of col, oldest first (a view)."""
+        end = self._write + self.capacity
+        return self._buffers[col][end - self.n : end]
+
+    def latest(self, col):
+        """The newest value of col, or None if nothing has been read yet."""
+        if self.n == 0:
+            return None
+        return self.values(col)[-1]
@@ -25,6 +25,36 @@ from Control_Logic import PostgreSQL_Interface as he6db
 from Control_Logic import Data_Quality_Control as DQC
 from Control_Logic.Monitor import Monitor
 from Control_Logic.NMR import NMR
+from Control_Logic.Table_Feed import TableFeed
+from Control_Logic.Spec_Stats import spec_file_stats
+from Control_Logic.Spec_File import load_summary
+from Control_Logic.Spec_Pyramid import open_pyramid
+
+# RGA partial pressures plotted from he6cres_runs.run_log, and their colors.
+RGA_PENS = {
+	"rga_nitrogen": (115, 31, 25),
+	"rga_helium": (23, 0, 173),
+	"rga_c02": (13, 153, 11),
+	"rga_hydrogen": (14, 149, 173),
+	"rga_water": (255, 172, 56),
+	"rga_oxygen": (125, 250, 250),
+	"rga_argon": (251, 0, 255),
+	"rga_krypton": (158, 146, 176),
+	"rga_cf3": (255, 249, 77),
+	"rga_ne19": (82, 0, 204),
+	"rga_tot": (255, 255, 255),
+}
+
+
+def noise_floor(spec_path, freq_ch, slices):
+	"""
+	Per-bin mean of a spec file: from its summary sidecar (whole file) if
+	there is an up to date one, otherwise streamed from the first slices.
+	"""
+	summary = load_summary(spec_path)
+	if summary is not None:
+		return summary["mean"]
+	return spec_file_stats(spec_path, freq_ch, n_slices=slices, histogram=False).mean
 
 # Create a worker class to donload large spec files
 class Worker(QObject):
@@ -175,22 +205,12 @@ class MainWindow(QtWidgets.QMainWindow):
 		self.nmrScale.valueChanged[int].connect(self.nmrScaleChange)
 		self.rgaScale.valueChanged[int].connect(self.rgaScaleChange)
 
-	
-		self.query_monitor_log = '''
-					SELECT monitor_id, rate, created_at
-					FROM he6cres_runs.monitor
-					ORDER BY monitor_id DESC LIMIT 100
-				  '''
-		self.query_nmr_log = '''
-					SELECT nmr_id, field, created_at, locked
-					FROM he6cres_runs.nmr
-					ORDER BY nmr_id DESC LIMIT 100
-				  '''
-		self.query_rga_log = '''
-					SELECT run_id, created_at, rga_nitrogen, rga_helium, rga_c02, rga_hydrogen, rga_water, rga_krypton, rga_argon, rga_cf3, rga_ne19, rga_oxygen, rga_tot
-					FROM he6cres_runs.run_log
-					ORDER BY run_id DESC LIMIT 100
-					'''
+
+		# Incremental feeds for the time-series plots: each tick only fetches
+		# rows newer than the last one seen.
+		self.monitor_feed = TableFeed("monitor", "monitor_id", ["rate"], 100)
+		self.nmr_feed = TableFeed("nmr", "nmr_id", ["field", "locked"], 100)
+		self.rga_feed = TableFeed("run_log", "run_id", list(RGA_PENS), 100)
 		self.query_rid_log = '''
 					SELECT run_id, created_at, num_spec_acq, monitor_rate, true_field, Isotope, rf_side, run_notes, trap_config
 					FROM he6cres_runs.run_log
@@ -202,9 +222,9 @@ class MainWindow(QtWidgets.QMainWindow):
 		#self.t = np.array([])
 		#self.B = np.array([])
 		#self.marks = np.array([])
-		self.monitor_log = he6db.he6cres_db_query(self.query_monitor_log)
-		self.nmr_log = he6db.he6cres_db_query(self.query_nmr_log)
-		self.rga_log = he6db.he6cres_db_query(self.query_rga_log)
+		self.monitor_feed.poll()
+		self.nmr_feed.poll()
+		self.rga_feed.poll()
 		self.rid_log = he6db.he6cres_db_query(self.query_rid_log)
 
 		#put run_ids in table from db
@@ -216,11 +236,6 @@ class MainWindow(QtWidgets.QMainWindow):
 		#self.nmr_log["seattle_time"] = self.nmr_log["created_at"].dt.tz_localize('UTC').dt.tz_convert('US/Pacific').dt.strftime('%H:%M:%S')
 		#self.nmr_log["seattle_time"] = self.nmr_log["created_at"].dt.tz_localize('UTC').dt.tz_convert('US/Pacific').dt.tz_localize(None)
 
-		#NOT tz-aware so it's not time-zone local to seattle
-		self.monitor_log["UTC_time"] = pd.to_datetime(self.monitor_log["created_at"]).astype('long')/ 10**9
-		self.nmr_log["UTC_time"] = pd.to_datetime(self.nmr_log["created_at"]).astype('long')/ 10**9
-		self.rga_log["UTC_time"] = pd.to_datetime(self.rga_log["created_at"]).astype('long')/ 10**9
-
 		# Create an axis with a date-time axis (timestamps on x-axis) and attach it to a plot
 		axis1 = DateAxisItem(orientation='bottom')
 		self.betaMonitorPlot.setAxisItems({'bottom':axis1})
@@ -246,30 +261,21 @@ class MainWindow(QtWidgets.QMainWindow):
 		pen = pg.mkPen(color=(0, 80, 239))
 
 		#Field mean and standard deviation over last minute
-		self.stdB = self.nmr_log["field"].iloc[0:6].std()
-		self.meanB = self.nmr_log["field"].iloc[0:6].mean()
+		self.stdB = np.nanstd(self.nmr_feed.values("field")[-6:], ddof=1)
+		self.meanB = np.nanmean(self.nmr_feed.values("field")[-6:])
 		self.stdp = pg.InfiniteLine(pos=self.meanB+self.stdB, angle=0, movable=False, pen=pg.mkPen('y', width=1, style=QtCore.Qt.DashLine))
 		self.stdm = pg.InfiniteLine(pos=self.meanB-self.stdB, angle=0, movable=False, pen=pg.mkPen('y', width=1, style=QtCore.Qt.DashLine))
 
-		#print(np.full(self.nmr_log["UTC_time"].size, self.meanB+self.stdB))
-
-		self.monitor_line = self.betaMonitorPlot.plot(self.monitor_log["UTC_time"], self.monitor_log["rate"], pen=pen)
-		self.nmr_line = self.nmrPlot.plot(self.nmr_log["UTC_time"], self.nmr_log["field"], pen=pen)
+		self.monitor_line = self.betaMonitorPlot.plot(self.monitor_feed.values("UTC_time"), self.monitor_feed.values("rate"), pen=pen)
+		self.nmr_line = self.nmrPlot.plot(self.nmr_feed.values("UTC_time"), self.nmr_feed.values("field"), pen=pen)
 		self.nmrPlot.addItem(self.stdp, ignoreBounds=True)
 		self.nmrPlot.addItem(self.stdm, ignoreBounds=True)
 
 		#All the RGA lines defined here
-		self.rga_nitrogen_line = self.rgaPlot.plot(self.rga_log["UTC_time"], self.rga_log["rga_nitrogen"], pen=pg.mkPen(color=(115, 31, 25)))
-		self.rga_helium_line = self.rgaPlot.plot(self.rga_log["UTC_time"], self.rga_log["rga_helium"], pen=pg.mkPen(color=(23, 0, 173)))
-		self.rga_c02_line = self.rgaPlot.plot(self.rga_log["UTC_time"], self.rga_log["rga_c02"], pen=pg.mkPen(color=(13, 153, 11)))
-		self.rga_hydrogen_line = self.rgaPlot.plot(self.rga_log["UTC_time"], self.rga_log["rga_hydrogen"], pen=pg.mkPen(color=(14, 149, 173)))
-		self.rga_water_line = self.rgaPlot.plot(self.rga_log["UTC_time"], self.rga_log["rga_water"], pen=pg.mkPen(color=(255, 172, 56)))
-		self.rga_oxygen_line = self.rgaPlot.plot(self.rga_log["UTC_time"], self.rga_log["rga_oxygen"], pen=pg.mkPen(color=(125, 250, 250)))
-		self.rga_argon_line = self.rgaPlot.plot(self.rga_log["UTC_time"], self.rga_log["rga_argon"], pen=pg.mkPen(color=(251, 0, 255)))
-		self.rga_krypton_line = self.rgaPlot.plot(self.rga_log["UTC_time"], self.rga_log["rga_krypton"], pen=pg.mkPen(color=(158, 146, 176)))
-		self.rga_cf3_line = self.rgaPlot.plot(self.rga_log["UTC_time"], self.rga_log["rga_cf3"], pen=pg.mkPen(color=(255, 249, 77)))
-		self.rga_ne19_line = self.rgaPlot.plot(self.rga_log["UTC_time"], self.rga_log["rga_ne19"], pen=pg.mkPen(color=(82, 0, 204)))
-		self.rga_tot_line = self.rgaPlot.plot(self.rga_log["UTC_time"], self.rga_log["rga_tot"], pen=pg.mkPen(color=(255, 255, 255)))
+		self.rga_lines = {}
+		for col, color in RGA_PENS.items():
+			self.rga_lines[col] = self.rgaPlot.plot(self.rga_feed.values("UTC_time"), self.rga_feed.values(col), pen=pg.mkPen(color=color))
+		self.UpdateCurrentValues()
 
 		#beta monitor box
 		self.bmStopButton.setEnabled(False)
@@ -306,6 +312,18 @@ class MainWindow(QtWidgets.QMainWindow):
 		self.noiseClearButton.clicked.connect(self.clearNoises)
 		self.sparseClearButton.clicked.connect(self.clearSparseSpec)
 
+		# The sparse spectrogram is browsed through the file's tile pyramid:
+		# after a pan or zoom settles, only the tiles in view are fetched.
+		self.sparse_pyramid = None
+		# The viewport now shown, as a DQC.SparseSpectrogram, and where it sits.
+		self.sparse_spec = None
+		self.sparse_place = None
+		self.sparse_key = None
+		self.sparse_timer = QtCore.QTimer()
+		self.sparse_timer.setSingleShot(True)
+		self.sparse_timer.timeout.connect(self.UpdateSparseSpecView)
+		self.SperseSpecPlot.view.sigRangeChanged.connect(lambda: self.sparse_timer.start(100))
+
 		self.FieldDoubSpinBox.valueChanged.connect(self.SetFieldChange)	
 
 	def SecUpdate(self):
@@ -313,43 +331,47 @@ class MainWindow(QtWidgets.QMainWindow):
 		self.UpdateRunLog()
 
 	def UpdatePlots(self):
-		self.monitor_log = he6db.he6cres_db_query(self.query_monitor_log)
-		self.nmr_log = he6db.he6cres_db_query(self.query_nmr_log)
-		self.rga_log = he6db.he6cres_db_query(self.query_rga_log)
-
-		#NOT tz-aware so it's not time-zone local to seattle
-		self.monitor_log["UTC_time"] = pd.to_datetime(self.monitor_log["created_at"]).astype('long')/ 10**9
-		self.nmr_log["UTC_time"] = pd.to_datetime(self.nmr_log["created_at"]).astype('long')/ 10**9
-		self.rga_log["UTC_time"] = pd.to_datetime(self.rga_log["created_at"]).astype('long')/ 10**9
-
-		self.monitor_line.setData(self.monitor_log["UTC_time"], self.monitor_log["rate"])  # Update the monitor data.
-		self.nmr_line.setData(self.nmr_log["UTC_time"], self.nmr_log["field"])  # Update the nmr data.
-		#update rga data
-		self.rga_nitrogen_line.setData(self.rga_log["run_id"], self.rga_log["rga_nitrogen"])
-		self.rga_helium_line.setData(self.rga_log["run_id"], self.rga_log["rga_helium"])
-		self.rga_c02_line.setData(self.rga_log["run_id"], self.rga_log["rga_c02"])
-		self.rga_hydrogen_line.setData(self.rga_log["run_id"], self.rga_log["rga_hydrogen"])
-		self.rga_water_line.setData(self.rga_log["run_id"], self.rga_log["rga_water"])
-		self.rga_oxygen_line.setData(self.rga_log["run_id"], self.rga_log["rga_oxygen"])
-		self.rga_argon_line.setData(self.rga_log["run_id"], self.rga_log["rga_argon"])
-		self.rga_krypton_line.setData(self.rga_log["run_id"], self.rga_log["rga_krypton"])
-		self.rga_cf3_line.setData(self.rga_log["run_id"], self.rga_log["rga_cf3"])
-		self.rga_ne19_line.setData(self.rga_log["run_id"], self.rga_log["rga_ne19"])
-		self.rga_tot_line.setData(self.rga_log["run_id"], self.rga_log["rga_tot"])
-
-		self.curMonitor.setText(str(self.monitor_log["rate"].iloc[0])+" Hz")
-		self.curNMR.setText(str(self.nmr_log["field"].iloc[0])+" T")
-		self.curPres.setText(str(self.rga_log["rga_tot"].iloc[0])+" Tor")
-
-		if self.nmr_log["locked"].iloc[0] == True:
+		# Only replot a feed that actually got new rows. Each feed is polled
+		# on its own, so one failing query does not hold back the others.
+		new_monitor = self.pollFeed(self.monitor_feed)
+		new_nmr = self.pollFeed(self.nmr_feed)
+		self.new_runs = self.pollFeed(self.rga_feed)
+
+		if new_monitor:
+			self.monitor_line.setData(self.monitor_feed.values("UTC_time"), self.monitor_feed.values("rate"))  # Update the monitor data.
+		if new_nmr:
+			self.nmr_line.setData(self.nmr_feed.values("UTC_time"), self.nmr_feed.values("field"))  # Update the nmr data.
+		if self.new_runs:
+			#update rga data
+			for col, line in self.rga_lines.items():
+				line.setData(self.rga_feed.values("UTC_time"), self.rga_feed.values(col))
+		if new_monitor or new_nmr or self.new_runs:
+			self.UpdateCurrentValues()
+
+	def pollFeed(self, feed):
+		# New rows of one feed, or 0 if its query failed.
+		try:
+			return feed.poll()
+		except Exception as error:
+			print("Error while connecting to he6cres_db", error)
+			return 0
+
+	def UpdateCurrentValues(self):
+		self.curMonitor.setText(str(self.monitor_feed.latest("rate"))+" Hz")
+		self.curNMR.setText(str(self.nmr_feed.latest("field"))+" T")
+		self.curPres.setText(str(self.rga_feed.latest("rga_tot"))+" Tor")
+
+		if self.nmr_feed.latest("locked") == True:
 			self.LockedIndicator.setStyleSheet("background-color: green; border: 1px solid black;")
 		else:
 			self.LockedIndicator.setStyleSheet("background-color: red; border: 1px solid black;")
 
 	def UpdateRunLog(self):
-		model = pandasModel(self.rid_log)
-		self.runIDTableView.setModel(model)
-		self.rid_log = he6db.he6cres_db_query(self.query_rid_log)
+		# The run table only changes when a new run_id shows up.
+		if self.new_runs:
+			self.rid_log = he6db.he6cres_db_query(self.query_rid_log)
+			model = pandasModel(self.rid_log)
+			self.runIDTableView.setModel(model)
 
 	#Beta monitor box
 	#--------------------------------------
@@ -372,11 +394,7 @@ class MainWindow(QtWidgets.QMainWindow):
 	def monitorScaleChange(self):
 		self.monitorRange = self.monitorScale.value()
 		self.monitorPlotNumRecLabel.setText(str(self.monitorRange))
-		self.query_monitor_log = '''
-					SELECT monitor_id, rate, created_at
-					FROM he6cres_runs.monitor
-					ORDER BY monitor_id DESC LIMIT 
-				  ''' + str(self.monitorRange)
+		self.monitor_feed.set_capacity(self.monitorRange)
 	#---------------------------------------
 
 	#NMR Probe box
@@ -400,11 +418,7 @@ class MainWindow(QtWidgets.QMainWindow):
 	def nmrScaleChange(self):
 		self.nmrRange = self.nmrScale.value()
 		self.nmrPlotNumRecLabel.setText(str(self.nmrRange))
-		self.query_nmr_log = '''
-					SELECT nmr_id, field, created_at, locked
-					FROM he6cres_runs.nmr
-					ORDER BY nmr_id DESC LIMIT 
-				  ''' + str(self.nmrRange)
+		self.nmr_feed.set_capacity(self.nmrRange)
 	#---------------------------------------
 
 	#RGAbox
@@ -412,18 +426,13 @@ class MainWindow(QtWidgets.QMainWindow):
 	def rgaScaleChange(self):
 		self.rgaRange = self.rgaScale.value()
 		self.rgaPlotNumRecLabel.setText(str(self.rgaRange))
-		self.query_rga_log = '''
-					SELECT run_id, created_at, rga_nitrogen, rga_helium, rga_c02, rga_hydrogen, rga_water, rga_krypton, rga_argon, rga_cf3, rga_ne19, rga_oxygen, rga_tot
-					FROM he6cres_runs.run_log
-					ORDER BY run_id DESC LIMIT 
-					''' + str(self.rgaRange)
+		self.rga_feed.set_capacity(self.rgaRange)
 	#---------------------------------------
 
 	#Noise plot
 	#--------------------------------------
 	def plotNoises(self):
 		slices=10000
-		start_packet=0
 
 		self.NoisePlot.setLabel(axis='left', text='arb. roach units')
 		self.NoisePlot.setLabel(axis='bottom', text='freq bin')
@@ -464,8 +473,8 @@ class MainWindow(QtWidgets.QMainWindow):
 					lambda: print("Done fetching first file!")
 	   			)
 			if path.exists("./temp/"+rid1_path[14:]):
-				spec1_array = DQC.spec_to_array("./temp/"+rid1_path[14:], rid1_fc, slices=slices, start_packet=start_packet)
-				self.noise1 = self.NoisePlot.plot(spec1_array.mean(axis=1), name = self.rid1.toPlainText(), pen=pg.mkColor(191,228,118))
+				noise1 = noise_floor("./temp/"+rid1_path[14:], rid1_fc, slices)
+				self.noise1 = self.NoisePlot.plot(noise1, name = self.rid1.toPlainText(), pen=pg.mkColor(191,228,118))
 
 		if self.rid2.toPlainText() != "":
 			print("Looking for run_id: "+ self.rid2.toPlainText() + " a" +self.fia.toPlainText())
@@ -498,8 +507,8 @@ class MainWindow(QtWidgets.QMainWindow):
 					lambda: print("Done fetching second file!")	
 		   		)
 			if path.exists("./temp/"+rid2_path[14:]):
-				spec2_array = DQC.spec_to_array("./temp/"+rid2_path[14:], rid2_fc, slices=slices, start_packet=start_packet)
-				self.noise2 = self.NoisePlot.plot(spec2_array.mean(axis=1), name = self.rid2.toPlainText(), pen=pg.mkColor(154,206,223))
+				noise2 = noise_floor("./temp/"+rid2_path[14:], rid2_fc, slices)
+				self.noise2 = self.NoisePlot.plot(noise2, name = self.rid2.toPlainText(), pen=pg.mkColor(154,206,223))
 
 		if self.rid3.toPlainText() != "":
 			print("Looking for run_id: "+ self.rid3.toPlainText() + " a" +self.fia.toPlainText())
@@ -532,8 +541,8 @@ class MainWindow(QtWidgets.QMainWindow):
 					lambda: print("Done fetching second file!")	
 		   		)
 			if path.exists("./temp/"+rid3_path[14:]):
-				spec3_array = DQC.spec_to_array("./temp/"+rid3_path[14:], rid3_fc, slices=slices, start_packet=start_packet)
-				self.noise3 = self.NoisePlot.plot(spec3_array.mean(axis=1), name = self.rid3.toPlainText(), pen=pg.mkColor(255, 189, 56))
+				noise3 = noise_floor("./temp/"+rid3_path[14:], rid3_fc, slices)
+				self.noise3 = self.NoisePlot.plot(noise3, name = self.rid3.toPlainText(), pen=pg.mkColor(255, 189, 56))
 		
 		if self.rid4.toPlainText() != "":
 			print("Looking for run_id: "+ self.rid4.toPlainText() + " a" +self.fia.toPlainText())
@@ -566,8 +575,8 @@ class MainWindow(QtWidgets.QMainWindow):
 					lambda: print("Done fetching second file!")	
 		   		)
 			if path.exists("./temp/"+rid4_path[14:]):
-				spec4_array = DQC.spec_to_array("./temp/"+rid4_path[14:], rid4_fc, slices=slices, start_packet=start_packet)
-				self.noise4 = self.NoisePlot.plot(spec4_array.mean(axis=1), name = self.rid4.toPlainText(), pen=pg.mkColor(95, 56, 193))
+				noise4 = noise_floor("./temp/"+rid4_path[14:], rid4_fc, slices)
+				self.noise4 = self.NoisePlot.plot(noise4, name = self.rid4.toPlainText(), pen=pg.mkColor(95, 56, 193))
 
 		elif ((self.rid1.toPlainText() == "") and (self.rid2.toPlainText() == "") and (self.rid3.toPlainText() == "") and (self.rid4.toPlainText() == "")):
 			print("No run_ids selected! Please enter one or more run_ids and try again.")
@@ -584,16 +593,20 @@ class MainWindow(QtWidgets.QMainWindow):
 	def SNRThreshChange(self):
 		self.SNRCut = self.SNRCutSlider.value()
 		self.SNRCutlabel.setText(str(self.SNRCut))
-		self.plotSparseSpec()
+		if self.sparse_spec is not None:
+			# Only the pixels between the old and new cut change.
+			image = self.sparse_spec.set_cut(self.SNRCut)
+			self.SperseSpecPlot.setImage(image.T, autoRange=False, autoLevels=False, **self.sparse_place)
+			self.SperseSpecPlot.view.invertY(False)
+		else:
+			self.plotSparseSpec()
 	#---------------------------------------
 
 	#Sparse spectrogram plot
 	#--------------------------------------
 	def plotSparseSpec(self):
-		slices=1000
-		start_packet=0
-		start_packet = int(self.StartPacketText.toPlainText())
 		#slices = int(self.SlicesText.toPlainText())
+		start_packet = int(self.StartPacketText.toPlainText() or 0)
 
 		# Set a custom color map
 		colors = [
@@ -641,12 +654,13 @@ class MainWindow(QtWidgets.QMainWindow):
 					lambda: print("Done fetching first file!")
 	   			)
 			if path.exists("./temp/"+rid1s_path[14:]):
-				spec1_array = DQC.spec_to_array("./temp/"+rid1s_path[14:], rid1s_fc, slices=slices, start_packet=start_packet)
-				#cut_condition1 = np.array((spec1_array < np.expand_dims(spec1_array.mean(axis=1), axis=1) * self.SNRCut), dtype=int)
-				spec1_array[spec1_array < (np.expand_dims(spec1_array.mean(axis=1), axis=1) * self.SNRCut)]=0
-
-				self.SperseSpecPlot.setImage(spec1_array.T)
-				self.SperseSpecPlot.view.invertY(False)
+				# Built on first look at a file, then reused.
+				if self.sparse_pyramid is not None:
+					self.sparse_pyramid.close()
+				self.sparse_pyramid = open_pyramid("./temp/"+rid1s_path[14:], rid1s_fc)
+				# Start with the rest of the file from start_packet on.
+				t0 = self.sparse_pyramid.packet_slice(start_packet)
+				self.showSparseSpecViewport(t0, self.sparse_pyramid.n_slices, 0, self.sparse_pyramid.freq_ch, autoRange=True)
 
 		else:
 			print("No run_ids selected! Please enter one or more run_ids and try again.")
@@ -657,7 +671,52 @@ class MainWindow(QtWidgets.QMainWindow):
 	#--------------------------------------
 	def clearSparseSpec(self):
 		print("clearing sparse spec!")
+		if self.sparse_pyramid is not None:
+			self.sparse_pyramid.close()
+		self.sparse_pyramid = None
+		self.sparse_spec = None
+		self.sparse_key = None
 		self.SperseSpecPlot.clear()
+
+	def showSparseSpecViewport(self, t0, t1, f0, f1, autoRange=False):
+		"""
+		Show slices [t0, t1) and bins [f0, f1) at the coarsest pyramid
+		level that still fills the plot, thresholded at SNRCut times the
+		file's noise floor. A pooled pixel is lit if any pixel it covers
+		is over the cut, whatever the zoom.
+		"""
+		pixels = (self.SperseSpecPlot.width(), self.SperseSpecPlot.height())
+		# The SNR is worked out once per file, in the pyramid; a pan or zoom
+		# that still shows the same pixels keeps the current image.
+		level = self.sparse_pyramid.choose_level(t1 - t0, f1 - f0, pixels)
+		key = (level, t0 >> level, -(-t1 >> level), f0 >> level, -(-f1 >> level))
+		if key == self.sparse_key and not autoRange:
+			return
+		self.sparse_key = key
+		spec, level, (t_origin, f_origin) = self.sparse_pyramid.viewport(t0, t1, f0, f1, pixels=pixels)
+		if level:
+			lt0, lf0 = t_origin >> level, f_origin >> level
+			snr = self.sparse_pyramid.read(level, lt0, lt0 + spec.shape[0], lf0, lf0 + spec.shape[1], kind="snr")
+			self.sparse_spec = DQC.SparseSpectrogram(spec.T, snr_cut=self.SNRCut, snr=snr.T)
+		else:
+			floor = self.sparse_pyramid.noise_floor[f_origin:f_origin + spec.shape[1]]
+			self.sparse_spec = DQC.SparseSpectrogram(spec.T, floor, self.SNRCut)
+		self.sparse_place = dict(pos=(t_origin, f_origin), scale=(2**level, 2**level))
+
+		self.SperseSpecPlot.setImage(self.sparse_spec.image.T, autoRange=autoRange, autoLevels=autoRange, **self.sparse_place)
+		self.SperseSpecPlot.view.invertY(False)
+		if autoRange:
+			# From here on the view only moves when the user moves it.
+			self.SperseSpecPlot.view.disableAutoRange()
+
+	def UpdateSparseSpecView(self):
+		if self.sparse_pyramid is None:
+			return
+		(x0, x1), (y0, y1) = self.SperseSpecPlot.view.viewRange()
+		t0, t1 = max(0, int(x0)), min(self.sparse_pyramid.n_slices, int(np.ceil(x1)))
+		f0, f1 = max(0, int(y0)), min(self.sparse_pyramid.freq_ch, int(np.ceil(y1)))
+		if t1 > t0 and f1 > f0:
+			self.showSparseSpecViewport(t0, t1, f0, f1)
 	#---------------------------------------
 
 	def SetFieldChange(self):
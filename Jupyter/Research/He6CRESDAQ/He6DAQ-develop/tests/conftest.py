@@ -0,0 +1,36 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+# Make Control_Logic importable as it is from Command_Line_UI.py.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def write_spec(path, spectra, packet_ids=None, freq_ch=4096):
+    """
+    Write spectra, a (slices, freq_ch) uint8 array, as a .spec file: one
+    packet per slice for 4096 channels, four (chunk indices 0-3) for
+    32768. Packet IDs count up from 0 unless given.
+    """
+    packets_per_slice = 1 if freq_ch == 4096 else 4
+    payload = freq_ch // packets_per_slice
+    n_packets = len(spectra) * packets_per_slice
+    packets = np.zeros((n_packets, 32 + payload), dtype=np.uint8)
+    packets[:, 32:] = spectra.reshape(n_packets, payload)
+    if packet_ids is None:
+        packet_ids = np.arange(n_packets)
+    packet_ids = np.asarray(packet_ids)
+    packets[:, 1] = packet_ids >> 16
+    packets[:, 2] = (packet_ids >> 8) & 255
+    packets[:, 3] = packet_ids & 255
+    if packets_per_slice > 1:
+        packets[:, 24] = np.tile(np.arange(4), len(spectra)) << 5
+    packets.tofile(str(path))
+    return str(path)
+
+
+@pytest.fixture
+def rng():
+    return np.random.default_rng(0)
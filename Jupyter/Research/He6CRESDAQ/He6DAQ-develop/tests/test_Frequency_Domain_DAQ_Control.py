@@ -0,0 +1,136 @@
+import os
+import threading
+
+import numpy as np
+import pytest
+
+import Control_Logic.Frequency_Domain_DAQ_Control as DAQ_Control
+from Control_Logic.Frequency_Domain_DAQ_Control import DAQ_SpecWriter
+from Control_Logic.Spec_Packet_Report import GapTracker
+
+BYTES_IN_PACKET = 64
+
+
+class FakeReceiver:
+    """
+    Stands in for FDPreceiver: hands out a fixed stream of packets, as
+    many as fit in each block (fewer in block short_block), and can fail
+    on a given block.
+    """
+
+    def __init__(self, stream, short_block=None, fail_block=None):
+        self.stream = stream
+        self.position = 0
+        self.blocks = 0
+        self.short_block = short_block
+        self.fail_block = fail_block
+
+    def drain(self, bytes_in_packet):
+        return 0
+
+    def recv_into_array(self, rows):
+        if self.blocks == self.fail_block:
+            raise OSError("receiver failed")
+        n = len(rows) - 3 if self.blocks == self.short_block else len(rows)
+        rows[:n] = self.stream[self.position : self.position + n]
+        self.position += n
+        self.blocks += 1
+        return n
+
+
+def packet_stream(rng, n):
+    """n packets with a 20-bit pkt_in_batch that drops a few and wraps."""
+    ids = (2**20 - 50 + np.cumsum(rng.choice([1, 1, 1, 3], size=n))) % 2**20
+    packets = rng.integers(0, 256, (n, BYTES_IN_PACKET), dtype=np.uint8)
+    packets[:, 1] = (packets[:, 1] & 0xF0) | (ids >> 16)
+    packets[:, 2] = (ids >> 8) & 255
+    packets[:, 3] = ids & 255
+    return packets, ids
+
+
+def capture(writer, *args, **kwargs):
+    """Run capture_files on a thread, so a deadlock fails the test instead of hanging it."""
+    result = {}
+
+    def run():
+        try:
+            result["stats"] = writer.capture_files(*args, **kwargs)
+        except Exception as error:
+            result["error"] = error
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    thread.join(30)
+    assert not thread.is_alive(), "capture_files deadlocked"
+    return result
+
+
+@pytest.fixture
+def spec_writer(monkeypatch):
+    monkeypatch.setattr(DAQ_Control, "FDPreceiver", lambda *args, **kwargs: None)
+    return DAQ_SpecWriter()
+
+
+def out_dirs(tmp_path, n):
+    dirs = []
+    for i in range(n):
+        os.makedirs(str(tmp_path / str(i)))
+        dirs.append(str(tmp_path / str(i)) + "/")
+    return dirs
+
+
+def test_ring_to_writer_path(tmp_path, rng, spec_writer):
+    acquisitions, acq_length = 7, 100
+    stream, ids = packet_stream(rng, acquisitions * acq_length)
+    spec_writer.receiver = FakeReceiver(stream, short_block=4)
+
+    # Two blocks for three disks, so the capture waits on the writers.
+    result = capture(
+        spec_writer, acquisitions, acq_length, out_dirs(tmp_path, 3),
+        ring_blocks=2, bytes_in_packet=BYTES_IN_PACKET, write_chunk_bytes=4096,
+    )
+
+    assert "error" not in result
+    assert result["stats"]["ring_high_water"] <= 2
+    position = 0
+    for file_num, spec_dict in enumerate(spec_writer.spec_file_list):
+        n = acq_length - 3 if file_num == 4 else acq_length
+        # Files are dealt to the disks in turn and hold their block exactly.
+        assert spec_dict["file_path"].startswith(str(tmp_path / str(file_num % 3)))
+        written = np.fromfile(spec_dict["file_path"], dtype=np.uint8)
+        np.testing.assert_array_equal(
+            written.reshape(-1, BYTES_IN_PACKET), stream[position : position + n]
+        )
+        # Gap statistics taken in memory match the packets in the file.
+        gaps = GapTracker(modulus=2**20)
+        gaps.update(ids[position : position + n])
+        assert spec_dict["num_dropped_packets"] == gaps.num_dropped_packets
+        assert spec_dict["packets"] == n
+        assert spec_writer.udprx_output[file_num].startswith(
+            "file_path:{},packets:{},".format(spec_dict["file_path"], n)
+        )
+        position += n
+
+
+def test_receiver_error_is_raised(tmp_path, rng, spec_writer):
+    stream, _ = packet_stream(rng, 1000)
+    spec_writer.receiver = FakeReceiver(stream, fail_block=3)
+
+    result = capture(
+        spec_writer, 6, 100, out_dirs(tmp_path, 2),
+        ring_blocks=2, bytes_in_packet=BYTES_IN_PACKET,
+    )
+
+    assert isinstance(result["error"], OSError)
+
+
+def test_writer_error_is_raised(tmp_path, rng, spec_writer):
+    stream, _ = packet_stream(rng, 1000)
+    spec_writer.receiver = FakeReceiver(stream)
+    dirs = out_dirs(tmp_path, 1) + [str(tmp_path / "missing") + "/"]
+
+    result = capture(
+        spec_writer, 6, 100, dirs, ring_blocks=2, bytes_in_packet=BYTES_IN_PACKET
+    )
+
+    assert isinstance(result["error"], FileNotFoundError)
@@ -0,0 +1,84 @@
+from struct import unpack
+
+import numpy as np
+import pytest
+
+from Control_Logic.Frequency_Domain_Packet import FDpacket, FDpacketView
+
+
+def legacy_from_byte_string(bytestr):
+    """The struct-based decoder FDpacket.from_byte_string used to be."""
+    hdr = unpack(">4Q", bytestr[:32])
+    fields = (
+        hdr[0] & 0xFFFFFFFF,
+        (hdr[0] >> 32) & 0xFFFFF,
+        (hdr[0] >> 52) & 0x3F,
+        (hdr[0] >> 58) & 0x3F,
+        (hdr[1] >> 32) & 0xFFFFFFFF,
+        hdr[1] & 0xFFFFFFFF,
+        hdr[2],
+        hdr[3] & 0x7FFFFFFFFFFFFFFF,
+        not (hdr[3] & 0x8000000000000000 == 0),
+    )
+    words = unpack(">{0}Q".format((len(bytestr) - 32) // 8), bytestr[32:])
+    data = np.array(
+        [(word >> (8 * j)) & 0xFF for word in words for j in range(8)], dtype=np.uint8
+    )
+    return fields, data
+
+
+FIELDS = (
+    "unix_time",
+    "pkt_in_batch",
+    "digital_id",
+    "if_id",
+    "user_data_0",
+    "user_data_1",
+    "reserved_0",
+    "reserved_1",
+    "freq_not_time",
+)
+
+
+@pytest.fixture
+def packets(rng):
+    # Random bytes set every header bit, including freq_not_time both ways.
+    return rng.integers(0, 256, (16, FDpacket.BYTES_IN_PACKET), dtype=np.uint8)
+
+
+def test_decode_many_matches_legacy_decoder(packets):
+    header_table, payload = FDpacket.decode_many(packets.tobytes())
+
+    for i, packet in enumerate(packets):
+        fields, data = legacy_from_byte_string(packet.tobytes())
+        assert tuple(header_table[i][name] for name in FIELDS) == fields
+        np.testing.assert_array_equal(payload[i], data)
+    assert header_table["freq_not_time"].any()
+    assert not header_table["freq_not_time"].all()
+
+
+def test_from_byte_string_and_view_match_legacy_decoder(packets):
+    for packet in packets:
+        fields, data = legacy_from_byte_string(packet.tobytes())
+        for decoded in (
+            FDpacket.from_byte_string(packet.tobytes()),
+            FDpacketView(packet.tobytes()),
+        ):
+            assert tuple(getattr(decoded, name) for name in FIELDS) == fields
+            np.testing.assert_array_equal(decoded.data, data)
+
+
+def test_decode_many_4096_channel_packets(rng):
+    packets = rng.integers(0, 256, (4, 32 + 4096), dtype=np.uint8)
+    _, payload = FDpacket.decode_many(packets, bytes_in_payload=4096)
+    for i, packet in enumerate(packets):
+        np.testing.assert_array_equal(
+            payload[i], legacy_from_byte_string(packet.tobytes())[1]
+        )
+
+
+def test_decode_many_rejects_bad_lengths():
+    with pytest.raises(ValueError, match="multiple of 8"):
+        FDpacket.decode_many(bytes(2 * (32 + 100)), bytes_in_payload=100)
+    with pytest.raises(ValueError, match="not a multiple"):
+        FDpacket.decode_many(bytes(FDpacket.BYTES_IN_PACKET + 1))
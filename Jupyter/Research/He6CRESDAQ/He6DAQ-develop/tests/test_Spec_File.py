@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+from conftest import write_spec
+from Control_Logic.Spec_File import SpecFile
+
+
+def write_packets(path, payloads, chunks):
+    """A 32768-channel .spec file of one packet per payload row, with the given chunk indices."""
+    packets = np.zeros((len(payloads), 8224), dtype=np.uint8)
+    packets[:, 32:] = payloads
+    packets[:, 24] = np.asarray(chunks) << 5
+    packets.tofile(str(path))
+    return str(path)
+
+
+@pytest.mark.parametrize("freq_ch", [4096, 32768])
+def test_spectra_are_writable_copies(tmp_path, rng, freq_ch):
+    spectra = rng.integers(0, 256, (20, freq_ch), dtype=np.uint8)
+    spec_path = write_spec(tmp_path / "copy.spec", spectra, freq_ch=freq_ch)
+
+    with SpecFile(spec_path, freq_ch) as spec_file:
+        # Back to back slices and, skipping one, gathered slices.
+        pps = spec_file.packets_per_slice
+        for result in (
+            spec_file.spectra(),
+            spec_file.gather(np.array([0, 2 * pps, 3 * pps])),
+        ):
+            assert result.flags.writeable
+            result[result < 128] = 0
+
+    # Thresholding in place leaves the file alone.
+    with SpecFile(spec_path, freq_ch) as spec_file:
+        np.testing.assert_array_equal(spec_file.spectra(), spectra)
+
+
+def test_spectra_align_on_chunk_index_and_skip_broken_slices(tmp_path, rng):
+    # The file starts mid-slice (chunks 2, 3), then has two whole slices,
+    # one missing its chunk 2, and a whole last slice.
+    chunks = [2, 3, 0, 1, 2, 3, 0, 1, 2, 3, 0, 1, 3, 0, 1, 2, 3]
+    payloads = rng.integers(0, 256, (len(chunks), 8192), dtype=np.uint8)
+    spec_path = write_packets(tmp_path / "gaps.spec", payloads, chunks)
+
+    whole = [2, 6, 13]
+    expected = np.stack(
+        [payloads[start : start + 4].reshape(-1) for start in whole]
+    )
+    with SpecFile(spec_path, 32768) as spec_file:
+        np.testing.assert_array_equal(spec_file.slice_starts(), whole)
+        np.testing.assert_array_equal(spec_file.spectra(), expected)
+        np.testing.assert_array_equal(spec_file.slice_starts(3), [6, 13])
+        np.testing.assert_array_equal(spec_file.spectra(n_slices=2), expected[:2])
+        chunked = np.concatenate(list(spec_file.iter_spectra(chunk_slices=2)))
+        np.testing.assert_array_equal(chunked, expected)
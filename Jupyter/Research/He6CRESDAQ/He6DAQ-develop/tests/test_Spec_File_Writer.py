@@ -0,0 +1,80 @@
+import os
+
+import numpy as np
+import pytest
+
+import Control_Logic.Spec_File_Writer as Spec_File_Writer
+from Control_Logic.Spec_File_Writer import ALIGNMENT, SpecFileSequence, SpecFileWriter
+
+
+@pytest.fixture
+def data(rng):
+    # Not a whole number of pages, so the direct writer has an unaligned tail.
+    return rng.integers(0, 256, 5 * 8224 * 37 + 100, dtype=np.uint8)
+
+
+def write_pieces(writer, data):
+    """Write data in uneven pieces, as packets arrive from the ring."""
+    for start, stop in zip([0, 1, 8224, 50000, 120000], [1, 8224, 50000, 120000, None]):
+        writer.write(data[start:stop])
+
+
+@pytest.mark.parametrize("direct", [False, True])
+def test_modes_write_the_same_bytes(tmp_path, data, direct):
+    path = str(tmp_path / "out.spec")
+    with SpecFileWriter(
+        path, chunk_bytes=4 * ALIGNMENT, direct=direct, preallocate_bytes=2 * data.nbytes
+    ) as writer:
+        write_pieces(writer, data)
+        if direct and not writer.direct:
+            pytest.skip("O_DIRECT is not supported on {}".format(tmp_path))
+
+    assert writer.bytes_written == data.nbytes
+    # The unused preallocated space is trimmed on close.
+    assert os.path.getsize(path) == data.nbytes
+    np.testing.assert_array_equal(np.fromfile(path, dtype=np.uint8), data)
+
+
+@pytest.mark.parametrize("sync_file_range", [True, False])
+def test_buffered_mode_drops_every_written_byte(tmp_path, data, monkeypatch, sync_file_range):
+    if not hasattr(os, "posix_fadvise"):
+        pytest.skip("no posix_fadvise")
+    dropped = []
+    fadvise = os.posix_fadvise
+
+    def record(fd, start, length, advice):
+        dropped.append((start, length))
+        fadvise(fd, start, length, advice)
+
+    monkeypatch.setattr(os, "posix_fadvise", record)
+    if not sync_file_range:
+        monkeypatch.setattr(Spec_File_Writer, "_sync_file_range", None)
+        monkeypatch.setattr(Spec_File_Writer, "FDATASYNC_BYTES", 10 * ALIGNMENT)
+    elif Spec_File_Writer._sync_file_range is None:
+        pytest.skip("no sync_file_range")
+
+    path = str(tmp_path / "out.spec")
+    with SpecFileWriter(path, chunk_bytes=4 * ALIGNMENT) as writer:
+        write_pieces(writer, data)
+        # Only the last write (or the last fdatasync's worth) is still cached.
+        assert sum(length for _, length in dropped) >= data.nbytes - 10 * ALIGNMENT
+
+    # Back to back ranges covering the whole file, each dropped once.
+    ends = np.cumsum([length for _, length in dropped])
+    assert [start for start, _ in dropped] == [0] + list(ends[:-1])
+    assert ends[-1] == data.nbytes
+    np.testing.assert_array_equal(np.fromfile(path, dtype=np.uint8), data)
+
+
+def test_sequence_removes_the_unused_file(tmp_path, data):
+    paths = [str(tmp_path / "{}.spec".format(i)) for i in range(3)]
+    with SpecFileSequence(paths, chunk_bytes=4 * ALIGNMENT) as sequence:
+        for i in range(2):
+            writer = sequence.next_writer()
+            writer.write(data[i:])
+            sequence.retire(writer)
+
+    for i in range(2):
+        np.testing.assert_array_equal(np.fromfile(paths[i], dtype=np.uint8), data[i:])
+    # The third file was opened ahead but never used.
+    assert not os.path.exists(paths[2])
@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+from conftest import write_spec
+from Control_Logic.Spec_Packet_Report import GapTracker, gap_report
+
+
+def whole_array_report(packet_ids):
+    """gap_report's 8-tuple for the whole array of (unwrapped) IDs at once."""
+    gaps = np.diff(packet_ids) - 1
+    positive = gaps[gaps > 0]
+    if len(positive):
+        mean_gap, std_gap, max_gap = positive.mean(), positive.std(), positive.max()
+    else:
+        mean_gap, std_gap, max_gap = 0, 0, 0
+    return (
+        len(packet_ids),
+        positive.sum(),
+        positive.sum() / len(packet_ids),
+        len(positive),
+        np.count_nonzero(gaps < 0),
+        mean_gap,
+        std_gap,
+        max_gap,
+    )
+
+
+def dropped_ids(rng, n, start=0):
+    """n increasing IDs from start with random gaps and a few repeats."""
+    steps = rng.choice([1, 1, 1, 1, 2, 5, 0, -3], size=n)
+    return start + np.cumsum(steps)
+
+
+@pytest.mark.parametrize("chunk", [1, 7, 100, 999, 1000, 5000])
+def test_chunked_matches_whole_array(rng, chunk):
+    # 1000 IDs, so most chunk sizes leave a partial last chunk.
+    packet_ids = dropped_ids(rng, 1000)
+    tracker = GapTracker()
+    for start in range(0, len(packet_ids), chunk):
+        tracker.update(packet_ids[start : start + chunk])
+
+    assert tracker.report() == pytest.approx(whole_array_report(packet_ids))
+
+
+@pytest.mark.parametrize("chunk", [13, 500])
+def test_wraparound_is_not_a_gap(rng, chunk):
+    modulus = 2**20
+    # Cross the wrap a few times, with drops and repeats on both sides.
+    packet_ids = dropped_ids(rng, 3000, start=modulus - 1000)
+    tracker = GapTracker(modulus=modulus)
+    for start in range(0, len(packet_ids), chunk):
+        tracker.update(packet_ids[start : start + chunk] % modulus)
+
+    assert (packet_ids // modulus).max() > 0
+    assert tracker.report() == pytest.approx(whole_array_report(packet_ids))
+
+
+def test_gap_report_streams_the_file(tmp_path, rng):
+    packet_ids = np.unique(rng.choice(3000, size=1000, replace=False))
+    spectra = np.zeros((len(packet_ids), 4096), dtype=np.uint8)
+    spec_path = write_spec(tmp_path / "gaps.spec", spectra, packet_ids)
+
+    # 64-packet chunks, and a partial last one.
+    report = gap_report(spec_path, 4128, False, chunk_packets=64)
+
+    assert report == pytest.approx(whole_array_report(packet_ids))
@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+
+from conftest import write_spec
+import Control_Logic.Spec_Pyramid as Spec_Pyramid
+from Control_Logic.Spec_Pyramid import (
+    build_pyramid,
+    open_pyramid,
+    pool_max,
+    round_down_float16,
+    spec_snr,
+)
+
+
+@pytest.fixture
+def pyramid(tmp_path, rng, monkeypatch):
+    # 300 slices: the last chunk and the last tile row of every level are
+    # partial.
+    spectra = rng.exponential(20, (300, 4096)).clip(0, 255).astype(np.uint8)
+    spec_path = write_spec(tmp_path / "pyramid.spec", spectra)
+
+    # Chunks of 64 slices, the top level's block for 64-pixel tiles.
+    monkeypatch.setattr(Spec_Pyramid, "CHUNK_BYTES", 4096 * 64)
+    build_pyramid(spec_path, 4096, tile=64)
+    pyramid = open_pyramid(spec_path)
+    yield pyramid, spectra
+    pyramid.close()
+
+
+def test_levels_match_whole_array_pooling(pyramid):
+    pyramid, spectra = pyramid
+    snr = spec_snr(spectra, spectra.mean(axis=0))
+    assert pyramid.levels == [0, 2, 3, 4, 5, 6]
+
+    for level in pyramid.levels[1:]:
+        factor = 2**level
+        stored = pyramid.read(level, 0, 10**9, 0, 10**9, "max")
+        np.testing.assert_array_equal(stored, pool_max(spectra, factor, factor))
+
+        stored_snr = pyramid.read(level, 0, 10**9, 0, 10**9, "snr")
+        np.testing.assert_array_equal(
+            stored_snr, round_down_float16(pool_max(snr, factor, factor))
+        )
+        # A pooled pixel is lit when any pixel it covers is.
+        np.testing.assert_array_equal(
+            stored_snr >= 5, pool_max(snr >= 5, factor, factor)
+        )
+
+
+def test_read_windows(pyramid):
+    pyramid, spectra = pyramid
+    level_max = pool_max(spectra, 4, 4)
+    rows = len(level_max)
+
+    # Windows inside one tile, across tiles, and into the partial last row.
+    for t0, t1, f0, f1 in [(3, 10, 5, 60), (60, 70, 100, 700), (50, rows, 0, 1024)]:
+        np.testing.assert_array_equal(
+            pyramid.read(2, t0, t1, f0, f1), level_max[t0:t1, f0:f1]
+        )
+    np.testing.assert_array_equal(
+        pyramid.read(0, 290, 300, 4000, 4096), spectra[290:300, 4000:4096]
+    )
+
+
+def test_choose_level_keeps_to_the_pixel_budget(pyramid):
+    pyramid, _ = pyramid
+    for t_span, f_span in [(300, 4096), (10, 4096), (300, 10), (10, 10)]:
+        level = pyramid.choose_level(t_span, f_span, pixels=(100, 100))
+        assert -(-t_span >> level) <= 2 * 100
+        assert -(-f_span >> level) <= 2 * 100
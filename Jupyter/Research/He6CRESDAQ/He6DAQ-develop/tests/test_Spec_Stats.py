@@ -0,0 +1,41 @@
+import numpy as np
+
+from conftest import write_spec
+from Control_Logic.Spec_Stats import SpecStats, spec_file_stats
+
+
+def test_chunks_and_merge_match_numpy(rng):
+    spectra = rng.poisson(20, (1000, 64)).astype(np.uint8)
+
+    # Uneven chunks into two accumulators, then merged.
+    first = SpecStats(64)
+    second = SpecStats(64)
+    for start, stop in [(0, 1), (1, 300), (300, 301)]:
+        first.update(spectra[start:stop])
+    for start, stop in [(301, 777), (777, 1000)]:
+        second.update(spectra[start:stop])
+    stats = first.merge(second)
+
+    assert stats.n == 1000
+    np.testing.assert_allclose(stats.mean, spectra.mean(axis=0))
+    np.testing.assert_allclose(stats.var, spectra.var(axis=0))
+    np.testing.assert_array_equal(stats.min, spectra.min(axis=0))
+    np.testing.assert_array_equal(stats.max, spectra.max(axis=0))
+    np.testing.assert_array_equal(
+        stats.percentiles([5, 50, 95]),
+        np.percentile(spectra, [5, 50, 95], axis=0, method="inverted_cdf"),
+    )
+
+
+def test_spec_file_stats_partial_last_chunk(tmp_path, rng):
+    spectra = rng.poisson(20, (300, 4096)).astype(np.uint8)
+    spec_path = write_spec(tmp_path / "stats.spec", spectra)
+
+    stats = spec_file_stats(spec_path, 4096, chunk_slices=64)
+
+    assert stats.n == 300
+    np.testing.assert_allclose(stats.mean, spectra.mean(axis=0))
+    np.testing.assert_allclose(stats.std, spectra.std(axis=0))
+    np.testing.assert_array_equal(
+        stats.percentiles(50), np.percentile(spectra, 50, axis=0, method="inverted_cdf")
+    )